@@ -0,0 +1,7 @@
+"""
+Offline benchmarks for the scrapers: a corpus of recorded result pages replayed by a local mock server.
+
+Record a corpus once with `python -m benchmarks record <site>`, then `python -m benchmarks run` measures
+parse_listing, parse_page_content, the parser consumers and full scraper runs against it and saves the
+results under benchmarks/results to compare them across commits with `python -m benchmarks compare`.
+"""
@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import json
+import os
+
+from benchmarks import runner, server
+from benchmarks.cases import CASES, DEFAULT_ROUNDS, run_case
+from benchmarks.fixtures import FIXTURES_DIR, record
+from benchmarks.sites import SITES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline scraper benchmarks")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="fixture corpus directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_command = commands.add_parser("record", help="record the pages of a real scrape as fixtures")
+    record_command.add_argument("sites", nargs="+", choices=list(SITES))
+
+    mock_server_options = argparse.ArgumentParser(add_help=False)
+    mock_server_options.add_argument("--port", type=int, default=server.DEFAULT_PORT)
+    mock_server_options.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    mock_server_options.add_argument("--jitter", type=float, default=0.0, help="latency varies +/- these seconds")
+    mock_server_options.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 responses")
+
+    serve_command = commands.add_parser("serve", parents=[mock_server_options], help="serve the fixtures")
+    serve_command.add_argument("--sites", nargs="+", choices=list(SITES), default=list(SITES))
+    serve_command.add_argument("--block-bots", action="store_true", help="answer 403 to clients that are not browsers")
+
+    run_command = commands.add_parser("run", parents=[mock_server_options], help="run the benchmarks")
+    run_command.add_argument("--sites", nargs="+", choices=list(SITES))
+    run_command.add_argument("--cases", nargs="+", choices=CASES)
+    run_command.add_argument("--backends", nargs="+", help="parser backends, every one installed by default")
+    run_command.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    run_command.add_argument("--no-save", action="store_true", help="do not save the results")
+
+    compare_command = commands.add_parser("compare", help="compare two saved results")
+    compare_command.add_argument("baseline")
+    compare_command.add_argument("current")
+
+    # used by `run`, every case runs in its own process
+    case_command = commands.add_parser("case")
+    case_command.add_argument("site", choices=list(SITES))
+    case_command.add_argument("case", choices=CASES)
+    case_command.add_argument("--output", required=True)
+    case_command.add_argument("--backend")
+    case_command.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    case_command.add_argument("--base-url")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "record":
+        for site in args.sites:
+            corpus = asyncio.run(record(site, args.fixtures))
+            print(f"{site}: {len(corpus)} pages recorded in {corpus.directory}")
+    elif args.command == "serve":
+        print(f"serving {', '.join(args.sites)} fixtures on http://127.0.0.1:{args.port}")
+        server.serve(
+            args.sites,
+            port=args.port,
+            root=args.fixtures,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            block_bots=args.block_bots,
+        )
+    elif args.command == "run":
+        report = runner.run(
+            sites=args.sites,
+            cases=args.cases,
+            backends=args.backends,
+            rounds=args.rounds,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            port=args.port,
+            root=args.fixtures,
+        )
+        print(runner.report_table(report))
+        if not args.no_save:
+            print(f"results saved to {runner.save(report)}")
+    elif args.command == "compare":
+        print(runner.compare_table(runner.load(args.baseline), runner.load(args.current)))
+    elif args.command == "case":
+        result = run_case(
+            args.site,
+            args.case,
+            os.path.dirname(os.path.abspath(args.output)),
+            parser_backend=args.backend,
+            rounds=args.rounds,
+            base_url=args.base_url,
+            root=args.fixtures,
+        )
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark cases, each one measuring a stage of a scraper over its fixture corpus:
+
+- parse_listing: extracting and filtering the listings of already parsed cards, a page at a time
+- parse_page_content: parsing whole result pages in this process
+- consumer: pipeline consumers parsing the pages in a pool of worker processes
+- end_to_end / end_to_end_streaming: a whole scrape against the mock server, pages parsed by the
+  worker pool or while they download
+"""
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.fixtures import FIXTURES_DIR, Corpus
+from benchmarks.sites import SITES, load_scraper, offline
+from scraping import pipeline
+from scraping.metrics import Metrics
+from scraping.parsers import get_backend
+
+CASES = ("parse_listing", "parse_page_content", "consumer", "end_to_end", "end_to_end_streaming")
+DEFAULT_ROUNDS = 5
+
+
+def measure(rounds: int, run_round: callable) -> tuple:
+    """
+    Calls run_round `rounds` times, returns (median seconds, what the last round returned)
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        returned = run_round()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), returned
+
+
+def bench_parse_listing(site: str, scraper, pages: list, rounds: int) -> dict:
+    backend = get_backend(scraper.PARSER_BACKEND)
+    listing_selector = scraper.SELECTORS.compiled(backend)["listing"]
+    pages_apartments = [backend.select(backend.parse(page), listing_selector) for page in pages]
+
+    def run_round():
+        return sum(len(scraper.parse_listings(apartments, False, backend)) for apartments in pages_apartments)
+
+    seconds, listings = measure(rounds, run_round)
+    return {"pages": len(pages), "listings": listings, "seconds": seconds}
+
+
+def bench_parse_page_content(site: str, scraper, pages: list, rounds: int) -> dict:
+    args = SITES[site].page_args
+
+    def run_round():
+        return sum(len(scraper.parse_page_content(page, *args)) for page in pages)
+
+    seconds, listings = measure(rounds, run_round)
+    return {"pages": len(pages), "listings": listings, "seconds": seconds}
+
+
+async def consume(handler: callable, pages: list, args: tuple, executor: ProcessPoolExecutor, workers: int) -> int:
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=workers * 2)
+    metrics = Metrics()
+    consumers = [
+        asyncio.create_task(pipeline.consumer(str(i), queue, handler, executor, metrics)) for i in range(workers)
+    ]
+    parsed = []
+    for page in pages:
+        future = loop.create_future()
+        await queue.put((page, args, future))
+        parsed.append(future)
+    listings = await asyncio.gather(*parsed)
+    for c in consumers:
+        c.cancel()
+    return sum(len(page_listings) for page_listings in listings)
+
+
+def bench_consumer(site: str, scraper, pages: list, rounds: int) -> dict:
+    workers = scraper.PARSER_WORKERS
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        seconds, listings = measure(
+            rounds,
+            lambda: asyncio.run(consume(scraper.parse_page_content, pages, SITES[site].page_args, executor, workers)),
+        )
+    return {"pages": len(pages), "listings": listings, "seconds": seconds, "workers": workers}
+
+
+def bench_end_to_end(site: str, scraper, output_dir: str) -> dict:
+    """
+    A single scrape, whole runs are too slow to repeat
+    """
+    cwd = os.getcwd()
+    os.chdir(output_dir)
+    try:
+        start = time.perf_counter()
+        asyncio.run(getattr(scraper, SITES[site].entry_point)())
+        seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    with open(scraper.METRICS_FILE) as metrics_file:
+        metrics = json.load(metrics_file)
+    return {
+        "pages": metrics["pages_parsed"] + metrics["pages_from_cache"],
+        "listings": metrics["listings"],
+        "seconds": seconds,
+        "bytes_downloaded": metrics["bytes_downloaded"],
+        "fetch_latency_p95": metrics["fetch_latency_seconds"]["p95"],
+    }
+
+
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(
+    site: str,
+    case: str,
+    output_dir: str,
+    parser_backend: str = None,
+    rounds: int = DEFAULT_ROUNDS,
+    base_url: str = None,
+    root: str = FIXTURES_DIR,
+) -> dict:
+    """
+    Runs one case and returns its measurements, it is meant to run in a fresh process so the peak RSS
+    reported is the one of the case alone
+    """
+    scraper = offline(
+        load_scraper(site), output_dir, base_url, parser_backend, streaming=case == "end_to_end_streaming"
+    )
+    if case in ("end_to_end", "end_to_end_streaming"):
+        result = bench_end_to_end(site, scraper, output_dir)
+    else:
+        pages = Corpus(site, root).pages()
+        if not pages:
+            raise RuntimeError(f"no fixtures recorded for {site}, run `python -m benchmarks record {site}` first")
+        benchmark = {
+            "parse_listing": bench_parse_listing,
+            "parse_page_content": bench_parse_page_content,
+            "consumer": bench_consumer,
+        }[case]
+        result = benchmark(site, scraper, pages, rounds)
+    result["pages_per_second"] = result["pages"] / result["seconds"] if result["seconds"] else 0.0
+    result["listings_per_second"] = result["listings"] / result["seconds"] if result["seconds"] else 0.0
+    result["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_SELF)
+    result["peak_worker_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
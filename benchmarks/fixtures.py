@@ -0,0 +1,97 @@
+"""
+Fixture corpus: result pages recorded from the real sites, one directory per site with the pages and a
+manifest.json mapping each page URL to its file.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import yarl
+
+from benchmarks.sites import SITES, load_scraper, offline
+from scraping.fetch import FetchResponse, Fetcher
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MANIFEST_FILE = "manifest.json"
+
+
+def fixture_key(url: str) -> str:
+    """
+    Host, path and query of `url` as they go on the wire, which is how the mock server looks pages up
+    """
+    url = yarl.URL(url)
+    key = url.host + url.raw_path
+    return f"{key}?{url.raw_query_string}" if url.raw_query_string else key
+
+
+class Corpus:
+    def __init__(self, site: str, root: str = FIXTURES_DIR):
+        self.site = site
+        self.directory = os.path.join(root, site)
+        self.manifest = {}
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+    def __len__(self) -> int:
+        return len(self.manifest)
+
+    def add(self, url: str, status: int, text: str):
+        key = fixture_key(url)
+        file_name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".html"
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, file_name), "w", encoding="utf-8") as page_file:
+            page_file.write(text)
+        self.manifest[key] = {"url": url, "file": file_name, "status": status}
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, MANIFEST_FILE), "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2, sort_keys=True)
+
+    def read(self, key: str) -> str:
+        with open(os.path.join(self.directory, self.manifest[key]["file"]), encoding="utf-8") as page_file:
+            return page_file.read()
+
+    def pages(self) -> list:
+        """
+        Returns the content of every recorded result page that was served successfully
+        """
+        return [self.read(key) for key, entry in sorted(self.manifest.items()) if entry["status"] == 200]
+
+
+class RecordingFetcher(Fetcher):
+    """
+    Fetcher that adds every page it downloads to a corpus
+    """
+
+    def __init__(self, *args, corpus: Corpus, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.corpus = corpus
+
+    async def get(self, url: str, headers: dict = None) -> FetchResponse:
+        response = await super().get(url, headers=headers)
+        self.corpus.add(url, response.status, response.text)
+        return response
+
+
+async def record(site: str, root: str = FIXTURES_DIR) -> Corpus:
+    """
+    Runs the scraper of `site` against the real site and records every page it fetches
+    """
+    corpus = Corpus(site, root)
+    scraper = load_scraper(site)
+    with tempfile.TemporaryDirectory() as output_dir:
+        offline(scraper, output_dir)
+        scraper.Fetcher = lambda *args, **kwargs: RecordingFetcher(*args, corpus=corpus, **kwargs)
+        cwd = os.getcwd()
+        os.chdir(output_dir)
+        try:
+            await getattr(scraper, SITES[site].entry_point)()
+        finally:
+            os.chdir(cwd)
+            scraper.Fetcher = Fetcher
+            corpus.save()
+    return corpus
@@ -0,0 +1,160 @@
+"""
+Runs the benchmark cases, each one in its own process, and saves the results per commit.
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from prettytable import PrettyTable
+
+from benchmarks import server
+from benchmarks.cases import CASES, DEFAULT_ROUNDS
+from benchmarks.fixtures import FIXTURES_DIR
+from benchmarks.sites import ROOT, SITES
+from scraping.parsers import available_backends
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def git_revision() -> str:
+    """
+    Short hash of the checked out commit, with a -dirty suffix when the working tree has changes
+    """
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        changes = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return revision + "-dirty" if changes.strip() else revision
+
+
+def run_in_process(site: str, case: str, parser_backend: str, rounds: int, base_url: str, root: str) -> dict:
+    with tempfile.TemporaryDirectory() as output_dir:
+        result_path = os.path.join(output_dir, "result.json")
+        command = [sys.executable, "-m", "benchmarks", "--fixtures", root, "case", site, case, "--output", result_path]
+        command += ["--backend", parser_backend, "--rounds", str(rounds)]
+        if base_url is not None:
+            command += ["--base-url", base_url]
+        # the scrapers print every page and rejected listing, keep that out of the report
+        completed = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+        with open(result_path) as result_file:
+            return json.load(result_file)
+
+
+def run(
+    sites: list = None,
+    cases: list = None,
+    backends: list = None,
+    rounds: int = DEFAULT_ROUNDS,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    port: int = server.DEFAULT_PORT,
+    root: str = FIXTURES_DIR,
+) -> dict:
+    """
+    Runs every case for every site and parser backend, end to end cases against a mock server serving
+    the fixtures with the given latency, jitter and error rate
+    """
+    sites = sites or list(SITES)
+    cases = cases or list(CASES)
+    backends = backends or available_backends()
+    mock_server, base_url = None, None
+    if any(case.startswith("end_to_end") for case in cases):
+        mock_server = server.start(
+            sites, port=port, root=root, latency=latency, jitter=jitter, error_rate=error_rate, seed=0
+        )
+        base_url = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        for site in sites:
+            for case in cases:
+                for parser_backend in backends:
+                    print(f"{site} {case} ({parser_backend})...", flush=True)
+                    result = run_in_process(site, case, parser_backend, rounds, base_url, root)
+                    results.append({"site": site, "case": case, "backend": parser_backend, **result})
+    finally:
+        if mock_server is not None:
+            mock_server.terminate()
+            mock_server.join()
+    return {
+        "revision": git_revision(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "server": {"latency": latency, "jitter": jitter, "error_rate": error_rate},
+        "rounds": rounds,
+        "results": results,
+    }
+
+
+def save(report: dict, results_dir: str = RESULTS_DIR) -> str:
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{report['date'].replace(':', '')}-{report['revision']}.json")
+    with open(path, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+    return path
+
+
+def load(path: str) -> dict:
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def report_table(report: dict) -> PrettyTable:
+    table = PrettyTable()
+    table.field_names = ["site", "case", "backend", "pages/s", "listings/s", "peak RSS MB", "workers RSS MB"]
+    for result in report["results"]:
+        if "error" in result:
+            table.add_row([result["site"], result["case"], result["backend"], "error", result["error"], "", ""])
+            continue
+        table.add_row(
+            [
+                result["site"],
+                result["case"],
+                result["backend"],
+                f"{result['pages_per_second']:.1f}",
+                f"{result['listings_per_second']:.1f}",
+                f"{result['peak_rss_mb']:.1f}",
+                f"{result['peak_worker_rss_mb']:.1f}",
+            ]
+        )
+    table.align = "r"
+    return table
+
+
+def compare_table(baseline: dict, current: dict) -> PrettyTable:
+    """
+    Throughput and peak RSS of the cases present in both reports, with the change relative to baseline
+    """
+
+    def change(before: float, after: float) -> str:
+        return f"{(after - before) / before * 100:+.1f}%" if before else ""
+
+    baseline_results = {(r["site"], r["case"], r["backend"]): r for r in baseline["results"] if "error" not in r}
+    table = PrettyTable()
+    table.field_names = ["site", "case", "backend", "listings/s", "change", "peak RSS MB", "change "]
+    for result in current["results"]:
+        before = baseline_results.get((result["site"], result["case"], result["backend"]))
+        if before is None or "error" in result:
+            continue
+        table.add_row(
+            [
+                result["site"],
+                result["case"],
+                result["backend"],
+                f"{before['listings_per_second']:.1f} -> {result['listings_per_second']:.1f}",
+                change(before["listings_per_second"], result["listings_per_second"]),
+                f"{before['peak_rss_mb']:.1f} -> {result['peak_rss_mb']:.1f}",
+                change(before["peak_rss_mb"], result["peak_rss_mb"]),
+            ]
+        )
+    table.align = "r"
+    table.title = f"{baseline['revision']} -> {current['revision']}"
+    return table
@@ -0,0 +1,89 @@
+"""
+Local stand-in for the scraped sites: replays a fixture corpus with configurable latency, jitter and error rate.
+With block_bots it also refuses clients that are not browsers, like the sites do, to exercise the browser
+fallback of the scrapers.
+
+A page recorded from https://<host>/<path>?<query> is served on http://<server>/<host>/<path>?<query>.
+"""
+import asyncio
+import multiprocessing
+import random
+import socket
+import time
+
+from aiohttp import web
+
+from benchmarks.fixtures import FIXTURES_DIR, Corpus
+
+DEFAULT_PORT = 8890
+ERROR_STATUS = 503
+BLOCKED_STATUS = 403
+BLOCKED_PAGE = "<html><head><title>Just a moment...</title></head><body>Checking your browser</body></html>"
+
+
+def create_app(
+    sites: list,
+    root: str = FIXTURES_DIR,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    block_bots: bool = False,
+    seed=None,
+) -> web.Application:
+    """
+    latency and jitter are in seconds: every response is delayed latency +/- jitter, and a fraction
+    error_rate of the requests is answered with a 503. With block_bots requests without a browser
+    User-Agent get a 403 challenge page
+    """
+    pages = {}
+    for site in sites:
+        corpus = Corpus(site, root)
+        for key, entry in corpus.manifest.items():
+            pages[key] = (entry["status"], corpus.read(key).encode("utf-8"))
+    generator = random.Random(seed)
+
+    async def handle_page(request):
+        key = request.rel_url.raw_path[1:]
+        if request.rel_url.raw_query_string:
+            key += "?" + request.rel_url.raw_query_string
+        if key not in pages:
+            raise web.HTTPNotFound()
+        delay = latency + generator.uniform(-jitter, jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if generator.random() < error_rate:
+            return web.Response(status=ERROR_STATUS, text="Service Unavailable")
+        if block_bots and not request.headers.get("User-Agent", "").startswith("Mozilla/"):
+            return web.Response(status=BLOCKED_STATUS, text=BLOCKED_PAGE, content_type="text/html")
+        status, body = pages[key]
+        return web.Response(status=status, body=body, content_type="text/html", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handle_page)
+    return app
+
+
+def serve(sites: list, port: int = DEFAULT_PORT, host: str = "127.0.0.1", **options):
+    """
+    Serves the corpora of `sites` until interrupted, options are the ones of create_app
+    """
+    web.run_app(create_app(sites, **options), host=host, port=port, print=None)
+
+
+def start(sites: list, port: int = DEFAULT_PORT, host: str = "127.0.0.1", timeout: float = 10, **options):
+    """
+    Starts serving in a separate process, so the server does not compete for the event loop or memory of
+    what is being measured, and returns the process once it accepts connections
+    """
+    process = multiprocessing.Process(target=serve, args=(sites, port, host), kwargs=options, daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process
+        except OSError:
+            if not process.is_alive() or time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError(f"mock server did not start on {host}:{port}")
+            time.sleep(0.05)
@@ -0,0 +1,43 @@
+"""
+How the benchmarks drive each scraper: the scripts are loaded as modules by scraping.sites and their
+settings overridden for offline runs.
+"""
+import os
+from collections import namedtuple
+
+from scraping.sites import ENTRY_POINTS, ROOT, SEARCH_URL_SETTINGS, load_site
+
+# entry_point is the coroutine running a whole scrape, search_urls the constants holding the search URLs
+# and page_args the extra arguments parse_page_content takes after the page content
+Site = namedtuple("Site", ["entry_point", "search_urls", "page_args"])
+
+SITES = {
+    "lavoz": Site(ENTRY_POINTS["lavoz"], SEARCH_URL_SETTINGS["lavoz"], page_args=()),
+    "mercadolibre": Site(ENTRY_POINTS["mercadolibre"], SEARCH_URL_SETTINGS["mercadolibre"], page_args=(False,)),
+}
+
+
+def load_scraper(site: str):
+    return load_site(site)
+
+
+def offline(module, output_dir: str, base_url: str = None, parser_backend: str = None, streaming: bool = False):
+    """
+    Configures a loaded scraper for a benchmark run: no response cache, no incremental index, no rate
+    limit, no browser fallback, no price history, run artifacts written to output_dir and, with a base_url, searches sent to the mock server
+    instead of the real site
+    """
+    module.RESPONSE_CACHE_FILE = None
+    module.ADAPTIVE_RATE = False
+    module.BROWSER_FALLBACK = False
+    module.INCREMENTAL = False
+    module.HISTORY_FILE = None
+    module.METRICS_PORT = None
+    module.METRICS_FILE = os.path.join(output_dir, os.path.basename(module.METRICS_FILE))
+    module.PARSER_BACKEND = parser_backend
+    module.STREAMING_PARSER = streaming
+    if base_url is not None:
+        site = SITES[module.SOURCE]
+        for constant in site.search_urls:
+            setattr(module, constant, getattr(module, constant).replace("https://", base_url.rstrip("/") + "/", 1))
+    return module
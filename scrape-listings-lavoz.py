@@ -1,213 +1,348 @@
 import asyncio
-import csv
-import math
 import re
-import statistics
 import time
-import aiohttp
+from collections import Counter
 
+from scraping import browser, history, pipeline
+from scraping.cache import ResponseCache
+from scraping.exporters import open_exporter
+from scraping.fetch import Fetcher, create_session
+from scraping.filters import ListingFilter, parse_price
+from scraping.index import SeenIndex, known_fraction, print_changes_and_generate_csv
+from scraping.listing import Listing, ListingSink
+from scraping.metrics import Metrics, serve
+from scraping.parsers import Selectors, get_backend
+from scraping.pipeline import Page
+from scraping.streaming import ElementStream, StreamTarget
 
-import numpy
-from bs4 import BeautifulSoup
-from prettytable import PrettyTable
-
+SOURCE = "lavoz"
 URL_TO_SCRAPE_AGENCIES = "https://clasificados.lavoz.com.ar/inmuebles/departamentos/nueva-cordoba/1-dormitorio?ciudad=cordoba&provincia=cordoba&operacion=alquileres&cantidad-de-dormitorios[1]=1-dormitorio&tipo-de-vendedor=inmobiliaria"
 URL_TO_SCRAPE_OWNERS = "https://clasificados.lavoz.com.ar/inmuebles/departamentos/nueva-cordoba/1-dormitorio?ciudad=cordoba&provincia=cordoba&operacion=alquileres&cantidad-de-dormitorios[1]=1-dormitorio&tipo-de-vendedor=particular"
 CSV_FILE_NAME = "1-bedroom-rents-nueva-cordoba.csv"
-MIN_PRICE_TO_CONSIDER = 12000
-MAX_PRICE_TO_CONSIDER = 30000
-apartment_listings = []
-
-
-async def consumer(name: str, queue: asyncio.Queue, handler: callable):
-    while True:
-        content = await queue.get()
-        print(f"{name}::queue::got item")
-        try:
-            handler(content)
-            print(f"{name}::item processed")
-        except Exception as e:
-            print(f"{name}:: {e}")
-        finally:
-            queue.task_done()
-        await asyncio.sleep(0.1)
-
-
-async def html_fetcher(name: str, session: aiohttp.ClientSession, url: str, queue: asyncio.Queue):
-    async with session.get(url) as response:
-        html_as_string = await response.text()
-        await queue.put(html_as_string)
-        print(f"[{name}] fetch done")
-
-
-async def get_pages_and_total_items_expected(session: aiohttp.ClientSession):
-    pages = []
-    initial_tasks = [
-        _get_total_apartments_and_page_size(session, URL_TO_SCRAPE_AGENCIES),
-        _get_total_apartments_and_page_size(session, URL_TO_SCRAPE_OWNERS),
-    ]
-    seed_results = await asyncio.gather(*initial_tasks, return_exceptions=True)
-    total_agencies, last_page = seed_results[0]
-    for i in range(1, last_page + 1):
-        pages.append(URL_TO_SCRAPE_AGENCIES + f"&page={str(i)}")
-    total_owners, last_page = seed_results[1]
-    for i in range(1, last_page + 1):
-        pages.append(URL_TO_SCRAPE_OWNERS + f"&page={str(i)}")
-    return pages, total_agencies + total_owners
+CHANGES_CSV_FILE_NAME = "1-bedroom-rents-nueva-cordoba-changes.csv"
+STATS_FILE_NAME = "1-bedroom-rents-nueva-cordoba-stats.json"
+# listings are exported while scraping to every file listed, in the format of its extension: .csv, .parquet
+# (needs pyarrow) or .sqlite/.db
+EXPORT_FILES = [CSV_FILE_NAME]
+LISTING_FILTER = ListingFilter(
+    exclude_keywords=(
+        "inversiones",
+        "inversión",
+        "amueblado",
+        "amoblado",
+        "amoblados",
+        "venta",
+        "vendo",
+        "temporal",
+        "temporario",
+        "temporada",
+    ),
+    currency="$",
+    min_price=12000,
+    max_price=30000,
+)
+MAX_CONCURRENT_REQUESTS = 20
+MAX_CONNECTIONS_PER_HOST = 10
+# pace requests with a rate that adapts to how the site responds, backing off on 429/503 responses
+ADAPTIVE_RATE = True
+# pages whose response looks blocked (403, captcha or challenge pages) are fetched again with a pool of headless
+# browsers, needs playwright (see scraping.browser); BROWSER_EXECUTABLE_PATH runs an installed Chrome instead
+BROWSER_FALLBACK = False
+BROWSER_POOL_SIZE = browser.BROWSER_POOL_SIZE
+BROWSER_EXECUTABLE_PATH = None
+# number of processes parsing page content; pages waiting to be parsed are capped to keep memory bounded
+PARSER_WORKERS = pipeline.PARSER_WORKERS
+MAX_PENDING_PAGES = PARSER_WORKERS * 2
+# pages that did not change since the last run reuse the listings cached then, None disables the cache
+RESPONSE_CACHE_FILE = "responses-cache.sqlite"
+# change it whenever parsing or filtering changes so listings cached by older runs are not reused
+RESPONSE_CACHE_NAMESPACE = f"lavoz-v5-{LISTING_FILTER.fingerprint()}"
+# listings of the same apartment, found by id or by price and title, even on other sites or by other publishers,
+# are counted once in the statistics (see scraping.dedup)
+DEDUPLICATE = True
+# every run but incremental ones appends its listings to a price history with daily statistics, None disables it
+# (see scraping.history)
+HISTORY_FILE = history.HISTORY_FILE
+# incremental mode only reports listings that are new, changed their price or were removed since the last run,
+# and stops paginating a search once a page is mostly made of listings seen before
+INCREMENTAL = False
+SEEN_INDEX_FILE = "seen-listings.sqlite"
+KNOWN_FRACTION_TO_STOP = 0.8
+INCREMENTAL_WINDOW = 2
+# run metrics are written to METRICS_FILE when the run ends, with METRICS_PORT they are also served while it runs
+# in Prometheus text format on http://127.0.0.1:<port>/metrics
+METRICS_FILE = "lavoz-metrics.json"
+METRICS_PORT = None
+# "selectolax", "lxml" or "bs4"; None picks the fastest one installed
+PARSER_BACKEND = None
+# parse pages while they download, card by card, instead of building the whole page tree in a parser worker
+STREAMING_PARSER = False
+LISTING_CLASS = "col-6 flex flex-wrap content-start sm-col-3 md-col-3 align-top"
+APPLIED_FILTER_CLASS = "inline-flex btn btn-outline-main m0 p03"
+LISTING_ID_REGEX = re.compile(r"departamentos/(\d+)/?")
+SELECTORS = Selectors(
+    listing=f'div[class="{LISTING_CLASS}"]',
+    applied_filter=f'a[class="{APPLIED_FILTER_CLASS}"]',
+    price="span.price",
+    title="h2",
+    link="a",
+    results_count="span.h4",
+    page_link='a[class="page-link h4"]',
+)
+
+
+async def get_pages_and_total_items_expected(fetcher: Fetcher):
+    """
+    Returns ([agencies_pages, owners_pages], total_number_of_apartments)
+    """
+    seed_results = await asyncio.gather(
+        plan_search(fetcher, URL_TO_SCRAPE_AGENCIES), plan_search(fetcher, URL_TO_SCRAPE_OWNERS)
+    )
+    return [pages for pages, _ in seed_results], sum(total for _, total in seed_results)
+
+
+async def plan_search(fetcher: Fetcher, url: str, parser_backend: str = None) -> tuple:
+    """
+    Returns (pages, total_number_of_apartments) of a search, pages being (url, parse_page_content args).
+    The first page is the one read to count the results, it keeps its content so it is not downloaded twice
+    """
+    content = await fetcher.fetch(url)
+    total_number_of_apartments, last_page = _get_total_apartments_and_last_page(content, parser_backend)
+    pages = [Page(url, (), content)] + [(url + f"&page={str(i)}", ()) for i in range(2, last_page + 1)]
+    return pages, total_number_of_apartments
 
 
 async def main():
     start_time = time.time()
-    async with aiohttp.ClientSession() as session:
-        print("getting pages to scrape")
-        pages, total_items_to_parse = await get_pages_and_total_items_expected(session)
-
-        content_queue = asyncio.Queue()
-        consumers = [
-            asyncio.create_task(consumer(name=str(i), queue=content_queue, handler=parse_page_content))
-            for i in range(1)
-        ]
-        print(f"{len(consumers)} page content consumer/s started")
-
-        tasks = []
-        for i, url in enumerate(pages):
-            tasks.append(html_fetcher(str(i), session, url, content_queue))
-        print(f"starting {len(tasks)} html fetchers")
-        await asyncio.gather(*tasks, return_exceptions=True)
-        print("fetching content")
-    await content_queue.join()
-    for c in consumers:
-        c.cancel()
-    print(f"finishing processing {len(pages)} pages")
+    scopes = [URL_TO_SCRAPE_AGENCIES, URL_TO_SCRAPE_OWNERS]
+    cache = ResponseCache(RESPONSE_CACHE_NAMESPACE, RESPONSE_CACHE_FILE) if RESPONSE_CACHE_FILE else None
+    index = SeenIndex(SEEN_INDEX_FILE) if INCREMENTAL else None
+    known = [index.known(scope) for scope in scopes] if INCREMENTAL else None
+
+    def page_mostly_known(search: int, listings: list) -> bool:
+        return known_fraction(listings, known[search]) >= KNOWN_FRACTION_TO_STOP
+
+    sink = ListingSink()
+    exporters = [] if INCREMENTAL else [open_exporter(path) for path in EXPORT_FILES]
+    metrics = Metrics()
+    metrics_server = await serve(metrics, METRICS_PORT) if METRICS_PORT else None
+    browser_pool = browser.BrowserPool(BROWSER_POOL_SIZE, BROWSER_EXECUTABLE_PATH) if BROWSER_FALLBACK else None
+    try:
+        async with create_session(limit_per_host=MAX_CONNECTIONS_PER_HOST) as session:
+            fetcher = Fetcher(
+                session,
+                concurrency=MAX_CONCURRENT_REQUESTS,
+                metrics=metrics,
+                adaptive_rate=ADAPTIVE_RATE,
+                browser=browser_pool,
+            )
+            print("getting pages to scrape")
+            searches, total_items_to_parse = await get_pages_and_total_items_expected(fetcher)
+            results = await pipeline.run(
+                fetcher,
+                searches,
+                handler=parse_page_content,
+                stream_factory=PageContentStream if STREAMING_PARSER else None,
+                parser_workers=PARSER_WORKERS,
+                max_pending_pages=MAX_PENDING_PAGES,
+                cache=cache,
+                window=INCREMENTAL_WINDOW if INCREMENTAL else None,
+                stop_when=page_mostly_known if INCREMENTAL else None,
+                sinks=[sink] + exporters,
+                keep_listings=INCREMENTAL,
+            )
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        if browser_pool is not None:
+            await browser_pool.close()
+    if cache is not None:
+        cache.close()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+    metrics.dump_json(METRICS_FILE)
+    print(metrics.summary())
+    print(f"finishing processing {sum(result.pages_scanned for result in results)} pages")
     time_elapsed = (time.time() - start_time) / 60
     print(f"scraping finished in {round(time_elapsed,2)} minutes")
-    print_results_and_generate_csv(total_items_to_parse, apartment_listings)
+    if INCREMENTAL:
+        changes = []
+        for scope, result in zip(scopes, results):
+            changes.extend(index.update(scope, result.listings, complete=result.complete))
+        index.close()
+        print_changes_and_generate_csv(changes, CHANGES_CSV_FILE_NAME)
+        return
+    print(f"{len(sink)} listings exported to {', '.join(EXPORT_FILES)}")
+    columns = sink.flush()
+    if HISTORY_FILE:
+        history.record_run(HISTORY_FILE, columns, name=SOURCE)
+    if DEDUPLICATE:
+        # numpy and prettytable are only imported to compute the statistics, incremental runs and parser
+        # workers do not load them
+        from scraping import dedup
 
+        columns, duplicates = dedup.drop_duplicates(columns)
+        print(f"{duplicates} listings of apartments already listed left out of the statistics")
+    print_results_and_generate_stats(total_items_to_parse, columns)
 
-def parse_page_content(content: str):
-    soup = BeautifulSoup(content, "html.parser")
-    apartments = soup.find_all("div", attrs={"class": "col-6 flex flex-wrap content-start sm-col-3 md-col-3 align-top"})
-    filters = [
-        e.text.replace(" ×", "").strip()
-        for e in soup.find_all("a", attrs={"class": "inline-flex btn btn-outline-main m0 p03"})
-    ]
-    is_owner = "Particular" in filters
-    listings = [parse_listing(apartment, is_owner) for apartment in apartments]
-    apartment_listings.extend([listing for listing in listings if listing is not None])
 
+def parse_page_content(content: str, listing_filter: ListingFilter = None, parser_backend: str = None) -> list:
+    """
+    Runs in a parser worker process, returns the listings found in the page that pass listing_filter,
+    LISTING_FILTER by default. parser_backend defaults to PARSER_BACKEND
+    """
+    backend = get_backend(parser_backend or PARSER_BACKEND)
+    selectors = SELECTORS.compiled(backend)
+    document = backend.parse(content)
+    apartments = backend.select(document, selectors["listing"])
+    filters = [backend.text(e).replace(" ×", "").strip() for e in backend.select(document, selectors["applied_filter"])]
+    return parse_listings(apartments, "Particular" in filters, backend, listing_filter=listing_filter)
 
-def parse_listing(apartment: dict, is_owner: bool):
-    try:
-        listing = {}
-        price = apartment.find("span", attrs={"class": "price"}).text
-        title = apartment.find("h2").text.lower()
-        url = apartment.find("a").attrs["href"]
-        if "consultar" in price or "U$S" in price:
-            print(f"not valid: {url}")
-            return None
-        if re.search(
-            r"inversiones|inversión|amueblado|amoblado|amoblados|venta|vendo|temporal|temporario|temporada",
-            title,
-        ):
-            print(f"not valid: {url}")
-            return None
-        price = float(price.replace("$", "").replace(".", "").replace(",", ".").strip())
-        if price < MIN_PRICE_TO_CONSIDER or price > MAX_PRICE_TO_CONSIDER:
-            print(f"price not valid: {url}")
-            return None
-        listing["price"] = price
-        listing["is_owner"] = is_owner
-        listing["url"] = url
-        return listing
-    except Exception as identifier:
-        print(str(identifier))
-        raise identifier
-
-
-async def _get_total_apartments_and_page_size(session: aiohttp.ClientSession, url: str):
+
+class PageContentStream:
     """
-    Returns (total_number_of_apartments, last_page)
+    Incremental counterpart of parse_page_content: feed it chunks of a page and it returns the valid
+    listings of every card closed so far. Cards rejected by the filter are counted in its own rejects, pages
+    streamed side by side do not mix theirs. Who published the cards is only known once the section of the
+    applied filters has closed, cards closed before wait until then
     """
-    async with session.get(url) as response:
-        content = await response.text()
-    soup = BeautifulSoup(content, "html.parser")
-    results_text = soup.find("span", attrs={"class": "h4"}).text
+
+    def __init__(self, backend=None, listing_filter: ListingFilter = None):
+        self.backend = backend or get_backend(PARSER_BACKEND)
+        self.listing_filter = listing_filter
+        self.selectors = SELECTORS.compiled(self.backend)
+        self.rejects = Counter()
+        self.elements = ElementStream(
+            listing=StreamTarget("div", LISTING_CLASS, exact=True),
+            applied_filter=StreamTarget("a", APPLIED_FILTER_CLASS, exact=True, section_end=True),
+        )
+        self.filters = []
+        self.filters_closed = False
+        self.pending_cards = []
+
+    def feed(self, content: str) -> list:
+        return self._parse_elements(self.elements.feed(content))
+
+    def close(self) -> list:
+        listings = self._parse_elements(self.elements.close())
+        return listings + self._parse_cards(self.pending_cards, "Particular" in self.filters)
+
+    def _parse_elements(self, elements: list) -> list:
+        listings = []
+        for name, fragment in elements:
+            if name == "applied_filter" and fragment is None:
+                self.filters_closed = True
+                pending_cards, self.pending_cards = self.pending_cards, []
+                listings.extend(self._parse_cards(pending_cards, "Particular" in self.filters))
+            elif name == "applied_filter":
+                document = self.backend.parse(fragment)
+                element = self.backend.select_one(document, self.selectors["applied_filter"])
+                self.filters.append(self.backend.text(element).replace(" ×", "").strip())
+            elif self.filters_closed:
+                listings.extend(self._parse_cards([fragment], "Particular" in self.filters))
+            else:
+                self.pending_cards.append(fragment)
+        return listings
+
+    def _parse_cards(self, fragments: list, is_owner: bool) -> list:
+        apartments = [
+            self.backend.select_one(self.backend.parse(fragment), self.selectors["listing"]) for fragment in fragments
+        ]
+        return parse_listings(apartments, is_owner, self.backend, self.rejects, self.listing_filter)
+
+
+def parse_listings(
+    apartments: list, is_owner: bool, backend=None, rejects: Counter = None, listing_filter: ListingFilter = None
+) -> list:
+    """
+    Returns the listings of the apartment cards that pass listing_filter, LISTING_FILTER by default. Rejects
+    are counted in `rejects` when given
+    """
+    backend = backend or get_backend(PARSER_BACKEND)
+    selectors = SELECTORS.compiled(backend)
+    titles = [backend.text(backend.select_one(apartment, selectors["title"])) for apartment in apartments]
+    accepted = (listing_filter or LISTING_FILTER).apply(
+        list(zip(apartments, titles)),
+        titles,
+        lambda card: parse_price(backend.text(backend.select_one(card[0], selectors["price"]))),
+        rejects,
+    )
+    listings = []
+    for (apartment, title), price in accepted:
+        url = backend.attr(backend.select_one(apartment, selectors["link"]), "href")
+        listings.append(Listing(SOURCE, listing_id(url), price, is_owner, url, title.strip()))
+    return listings
+
+
+def listing_id(url: str):
+    match = LISTING_ID_REGEX.search(url)
+    return match.group(1) if match else None
+
+
+def _get_total_apartments_and_last_page(content: str, parser_backend: str = None):
+    """
+    Returns (total_number_of_apartments, last_page) of the first page of a search
+    """
+    backend = get_backend(parser_backend or PARSER_BACKEND)
+    selectors = SELECTORS.compiled(backend)
+    document = backend.parse(content)
+    results_text = backend.text(backend.select_one(document, selectors["results_count"]))
     results_number_regex = re.compile("[\w\s]*:\s(\d+\.?\d+)")
     total_number_of_apartments = int(results_number_regex.match(results_text).group(1).replace(".", ""))
-    last_page = int(soup.find_all("a", attrs={"class": "page-link h4"})[-1].text)
+    page_links = backend.select(document, selectors["page_link"])
+    # searches with a single page have no pagination links
+    last_page = int(backend.text(page_links[-1])) if page_links else 1
     return total_number_of_apartments, last_page
 
 
-def print_results_and_generate_csv(total_parsed: int, results: list):
+def print_results_and_generate_stats(total_parsed: int, results: dict):
+    """
+    results are the listing columns collected by a ListingSink
+    """
+    from prettytable import PrettyTable
+
+    from scraping.stats import group_stats, listings_array, price_histogram, write_report
+
     # TODO: refactor
-    prices = [listing["price"] for listing in results]
-    published_by_owner_prices = [listing["price"] for listing in results if listing["is_owner"]]
-    published_by_agency_prices = [listing["price"] for listing in results if not listing["is_owner"]]
+    listings = listings_array(results)
+    everyone = group_stats(listings)
+    by_owner = group_stats(listings, by="is_owner")
 
     print("\n===============================================")
     print(f"Total scraped apartments: {total_parsed}")
-    print(f"Ignored apartments: {total_parsed - len(results)}")
+    print(f"Ignored apartments: {total_parsed - len(listings)}")
 
     stats_table = PrettyTable()
     stats_table.field_names = ["stat", "value"]
     stats_table.align["value"] = "r"
-    stats_table.add_row(["all apartments", len(prices)])
-    stats_table.add_row(["max price", max(prices)])
-    stats_table.add_row(["min price", min(prices)])
-    stats_table.add_row(["avg price", round(sum(prices) / len(prices))])
-    stats_table.add_row(["median price", statistics.median(prices)])
-    stats_table.add_row([" - - - ", " - - - "])
-
-    stats_table.add_row(["owners", len(published_by_owner_prices)])
-    stats_table.add_row(["max price", max(published_by_owner_prices)])
-    stats_table.add_row(["min price", min(published_by_owner_prices)])
-    stats_table.add_row(["avg price", round(sum(published_by_owner_prices) / len(published_by_owner_prices))])
-    stats_table.add_row(["median price", statistics.median(published_by_owner_prices)])
-    stats_table.add_row([" - - - ", " - - - "])
-
-    stats_table.add_row(["agencies", len(published_by_agency_prices)])
-    stats_table.add_row(["max price", max(published_by_agency_prices)])
-    stats_table.add_row(["min price", min(published_by_agency_prices)])
-    stats_table.add_row(["avg price", round(sum(published_by_agency_prices) / len(published_by_agency_prices))])
-    stats_table.add_row(["median price", statistics.median(published_by_agency_prices)])
+    # a group can be left empty by the filters or once duplicates are dropped
+    groups = [("all apartments", everyone[None])] if None in everyone else []
+    groups += [
+        (label, by_owner[is_owner])
+        for is_owner, label in ((True, "owners"), (False, "agencies"))
+        if is_owner in by_owner
+    ]
+    for i, (label, stats) in enumerate(groups):
+        if i:
+            stats_table.add_row([" - - - ", " - - - "])
+        stats_table.add_row([label, stats.count])
+        stats_table.add_row(["max price", stats.max])
+        stats_table.add_row(["min price", stats.min])
+        stats_table.add_row(["avg price", round(stats.mean)])
+        stats_table.add_row(["median price", stats.median])
 
     print(stats_table)
 
-    print("\nExporting to CSV... ")
-    with open(CSV_FILE_NAME, "w") as csvfile:
-        fieldnames = ["id", "price", "published_by_owner", "url"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for listing in results:
-            try:
-                listing_id = int(re.search(r"departamentos/(\d+)/?", listing["url"]).groups()[0])
-            except Exception as e:
-                print(f"error parsing listing id: {listing}, {e}")
-                listing_id = None
-            writer.writerow(
-                {
-                    "id": listing_id,
-                    "price": listing["price"],
-                    "published_by_owner": "true" if listing["is_owner"] else "false",
-                    "url": listing["url"],
-                }
-            )
     # calculate histogram values to see distribution of prices
-    first_bucket = math.floor(min(prices) / 1000) * 1000
-    last_bucket = math.ceil(max(prices) / 1000) * 1000
-    bins = [value for value in range(first_bucket, last_bucket + 1000, 1000)]
-    values, buckets = numpy.histogram(prices, bins=bins)
+    values, buckets = price_histogram(listings["price"], 1000)
     distribution_table = PrettyTable()
     distribution_table.field_names = ["rent", "apartments"]
-    with open(CSV_FILE_NAME, "a") as csvfile:
-        fieldnames = ["rent", "apartments"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        print("\nPrices distribution:")
-        for index, value in enumerate(values):
-            writer.writerow({"rent": str(buckets[index]) + " - " + str(buckets[index + 1]), "apartments": value})
-            distribution_table.add_row([f"{str(buckets[index])} - {str(buckets[index + 1])}", value])
+    print("\nPrices distribution:")
+    for index, value in enumerate(values):
+        distribution_table.add_row([f"{str(buckets[index])} - {str(buckets[index + 1])}", value])
     print(distribution_table)
+    write_report(STATS_FILE_NAME, dict(groups), (values, buckets))
+    print(f"statistics written to {STATS_FILE_NAME}")
 
 
 if __name__ == "__main__":
@@ -1,321 +1,359 @@
-import csv
+import asyncio
 import math
 import re
-import threading
 import time
-from queue import Queue
-import statistics
-
-import numpy
-import requests
-from bs4 import BeautifulSoup
-
+from collections import Counter
+
+from scraping import browser, history, pipeline
+from scraping.cache import ResponseCache
+from scraping.exporters import open_exporter
+from scraping.fetch import Fetcher, create_session
+from scraping.filters import ListingFilter, to_number
+from scraping.index import SeenIndex, known_fraction, print_changes_and_generate_csv
+from scraping.listing import Listing, ListingSink
+from scraping.metrics import Metrics, serve
+from scraping.parsers import Selectors, get_backend
+from scraping.pipeline import Page
+from scraping.streaming import ElementStream, StreamTarget
+
+SOURCE = "mercadolibre"
 AGENCIES_URL_TO_SCRAPE = "https://inmuebles.mercadolibre.com.ar/departamentos/alquiler/1-dormitorio/cordoba/cordoba/nueva-cordoba-o-guemes/{}_NoIndex_True#applied_filter_id%3DBEDROOMS%26applied_filter_name%3DDormitorios%26applied_filter_order%3D8%26applied_value_id%3D%5B1-1%5D%26applied_value_name%3D1+dormitorio%26applied_value_order%3D3%26applied_value_results%3D155%26is_custom%3Dfalse"
 OWNERS_URL_TO_SCRAPE = "https://inmuebles.mercadolibre.com.ar/departamentos/alquiler/1-dormitorio/cordoba/cordoba/nueva-cordoba-o-guemes/dueno-directo/{}_NoIndex_True"
-pages_to_fetch_queue = Queue()
-waiting_for_request_queue = Queue()
-page_contents_queue = Queue()
-apartments_list = []
 csv_file_name = "1-bedroom-rents-nueva-cordoba-mercado-libre.csv"
+changes_csv_file_name = "1-bedroom-rents-nueva-cordoba-mercado-libre-changes.csv"
+stats_file_name = "1-bedroom-rents-nueva-cordoba-mercado-libre-stats.json"
+# listings are exported while scraping to every file listed, in the format of its extension: .csv, .parquet
+# (needs pyarrow) or .sqlite/.db
+EXPORT_FILES = [csv_file_name]
+LISTING_FILTER = ListingFilter(
+    exclude_keywords=(
+        "inversiones",
+        "inversión",
+        "amueblado",
+        "amoblado",
+        "amoblados",
+        "venta",
+        "vendo",
+        "temporal",
+        "temporario",
+        "temporada",
+    ),
+    currency="$",
+    min_price=100000,  # acceptable limits ?
+    max_price=1000000,
+)
+MAX_CONCURRENT_REQUESTS = 20
+MAX_CONNECTIONS_PER_HOST = 10
+# pace requests with a rate that adapts to how the site responds, backing off on 429/503 responses
+ADAPTIVE_RATE = True
+# pages whose response looks blocked (403, captcha or challenge pages) are fetched again with a pool of headless
+# browsers, needs playwright (see scraping.browser); BROWSER_EXECUTABLE_PATH runs an installed Chrome instead
+BROWSER_FALLBACK = False
+BROWSER_POOL_SIZE = browser.BROWSER_POOL_SIZE
+BROWSER_EXECUTABLE_PATH = None
+PARSER_WORKERS = pipeline.PARSER_WORKERS
+# pages that did not change since the last run reuse the listings cached then, None disables the cache
+RESPONSE_CACHE_FILE = "responses-cache.sqlite"
+# change it whenever parsing or filtering changes so listings cached by older runs are not reused
+RESPONSE_CACHE_NAMESPACE = f"mercadolibre-v5-{LISTING_FILTER.fingerprint()}"
+# listings of the same apartment, found by id or by price and title, even on other sites or by other publishers,
+# are counted once in the statistics (see scraping.dedup)
+DEDUPLICATE = True
+# every run but incremental ones appends its listings to a price history with daily statistics, None disables it
+# (see scraping.history)
+HISTORY_FILE = history.HISTORY_FILE
+# incremental mode only reports listings that are new, changed their price or were removed since the last run,
+# and stops paginating a search once a page is mostly made of listings seen before
+INCREMENTAL = False
+SEEN_INDEX_FILE = "seen-listings.sqlite"
+KNOWN_FRACTION_TO_STOP = 0.8
+INCREMENTAL_WINDOW = 2
+# run metrics are written to METRICS_FILE when the run ends, with METRICS_PORT they are also served while it runs
+# in Prometheus text format on http://127.0.0.1:<port>/metrics
+METRICS_FILE = "mercadolibre-metrics.json"
+METRICS_PORT = None
+# "selectolax", "lxml" or "bs4"; None picks the fastest one installed
+PARSER_BACKEND = None
+# parse pages while they download, card by card, instead of building the whole page tree
+STREAMING_PARSER = False
+LISTING_CLASS = "ui-search-layout__item"
+LISTING_ID_REGEX = re.compile(r"MLA-?(\d+)")
+SELECTORS = Selectors(
+    listing=f"li.{LISTING_CLASS}",
+    link="a",
+    currency_symbol="span.andes-money-amount__currency-symbol",
+    price_fraction="span.andes-money-amount__fraction",
+    results_count="span.ui-search-search-result__quantity-results",
+)
+
+
+async def scrape():
+    start_time = time.time()
+    scopes = [AGENCIES_URL_TO_SCRAPE, OWNERS_URL_TO_SCRAPE]
+    cache = (
+        ResponseCache(RESPONSE_CACHE_NAMESPACE, RESPONSE_CACHE_FILE)
+        if RESPONSE_CACHE_FILE
+        else None
+    )
+    index = SeenIndex(SEEN_INDEX_FILE) if INCREMENTAL else None
+    known = [index.known(scope) for scope in scopes] if INCREMENTAL else None
+
+    def page_mostly_known(search, listings):
+        return known_fraction(listings, known[search]) >= KNOWN_FRACTION_TO_STOP
+
+    sink = ListingSink()
+    exporters = [] if INCREMENTAL else [open_exporter(path) for path in EXPORT_FILES]
+    metrics = Metrics()
+    metrics_server = await serve(metrics, METRICS_PORT) if METRICS_PORT else None
+    browser_pool = (
+        browser.BrowserPool(BROWSER_POOL_SIZE, BROWSER_EXECUTABLE_PATH)
+        if BROWSER_FALLBACK
+        else None
+    )
+
+    try:
+        async with create_session(limit_per_host=MAX_CONNECTIONS_PER_HOST) as session:
+            fetcher = Fetcher(
+                session,
+                concurrency=MAX_CONCURRENT_REQUESTS,
+                metrics=metrics,
+                adaptive_rate=ADAPTIVE_RATE,
+                browser=browser_pool,
+            )
+            seed_results = await asyncio.gather(
+                plan_search(fetcher, AGENCIES_URL_TO_SCRAPE, is_owner=False),
+                plan_search(fetcher, OWNERS_URL_TO_SCRAPE, is_owner=True),
+            )
+            agencies_pages, total_for_agencies = seed_results[0]
+            owners_pages, total_for_owners = seed_results[1]
+
+            results = await pipeline.run(
+                fetcher,
+                [agencies_pages, owners_pages],
+                handler=parse_page_content,
+                stream_factory=PageContentStream if STREAMING_PARSER else None,
+                parser_workers=PARSER_WORKERS,
+                cache=cache,
+                window=INCREMENTAL_WINDOW if INCREMENTAL else None,
+                stop_when=page_mostly_known if INCREMENTAL else None,
+                sinks=[sink] + exporters,
+                keep_listings=INCREMENTAL,
+            )
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        if browser_pool is not None:
+            await browser_pool.close()
+    if cache is not None:
+        cache.close()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+    metrics.dump_json(METRICS_FILE)
+    print(metrics.summary())
 
+    time_elapsed = (time.time() - start_time) / 60
+    print(f"Finished in {time_elapsed}")
+    print(f"Apartments: {len(sink)}")
 
-class PageFetcher(threading.Thread):
-    def __init__(self, pages_to_fetch_queue, page_contents_queue, session):
-        super().__init__()
-        self.pages_to_fetch_queue = pages_to_fetch_queue
-        self.page_contents_queue = page_contents_queue
-        self.session = session
-
-    def run(self):
-        while True:
-            page, owner_info = self.pages_to_fetch_queue.get()
-            waiting_for_request_queue.put(page)
-            response = self.session.get(page)
-            waiting_for_request_queue.get()
-            waiting_for_request_queue.task_done()
-            self.page_contents_queue.put((response.text, owner_info))
-            self.pages_to_fetch_queue.task_done()
-
-
-class PageConsumer(threading.Thread):
-    def __init__(self, pages_contents_queue, apartments_list):
-        super().__init__()
-        self.pages_contents_queue = pages_contents_queue
-        self.apartments_list = apartments_list
-
-    def run(self):
-        while True:
-            content, owner_info = self.pages_contents_queue.get()
-            soup = BeautifulSoup(content, "html.parser")
-            apartments = soup.find_all("li", attrs={"class": "ui-search-layout__item"})
-            for apartment in apartments:
-                listing = parse_listing(apartment, is_owner=owner_info["is_owner"])
-                if listing:
-                    self.apartments_list.append(listing)
-            self.pages_contents_queue.task_done()
-
-
-class UIProgress(threading.Thread):
-    def __init__(self, pages_to_fetch_queue, page_contents_queue):
-        super().__init__()
-        self.pages_to_fetch_queue = pages_to_fetch_queue
-        self.page_contents_queue = page_contents_queue
-
-    def run(self):
-        while True:
-            print(
-                "\r"
-                + f"Pages to fetch: [{self.pages_to_fetch_queue.qsize()}] - "
-                + f"Content to process: [{self.page_contents_queue.qsize()}] - "
-                + f"Pending requests: [{waiting_for_request_queue.qsize()}]",
-                end="",
+    if INCREMENTAL:
+        changes = []
+        for scope, result in zip(scopes, results):
+            changes.extend(
+                index.update(scope, result.listings, complete=result.complete)
             )
-            time.sleep(0.1)
+        index.close()
+        print_changes_and_generate_csv(changes, changes_csv_file_name)
+        return
+
+    print(f"{len(sink)} listings exported to {', '.join(EXPORT_FILES)}")
+    columns = sink.flush()
+    if HISTORY_FILE:
+        history.record_run(HISTORY_FILE, columns, name=SOURCE)
+    if DEDUPLICATE:
+        # numpy is only imported to compute the statistics, incremental runs and parser workers do not load it
+        from scraping import dedup
+
+        columns, duplicates = dedup.drop_duplicates(columns)
+        print(
+            f"{duplicates} listings of apartments already listed left out of the statistics"
+        )
+    print_results_and_generate_stats(
+        columns, total_for_agencies + total_for_owners, time_elapsed
+    )
 
 
-def scrape():
-    pages = []
-    start_time = time.time()
+def parse_page_content(content, is_owner, listing_filter=None, parser_backend=None):
+    """
+    Runs in a parser worker process, returns the listings found in the page that pass listing_filter,
+    LISTING_FILTER by default. parser_backend defaults to PARSER_BACKEND
+    """
+    backend = get_backend(parser_backend or PARSER_BACKEND)
+    document = backend.parse(content)
+    apartments = backend.select(document, SELECTORS.compiled(backend)["listing"])
+    return parse_listings(apartments, is_owner, backend, listing_filter=listing_filter)
 
-    ui_thread = UIProgress(pages_to_fetch_queue, page_contents_queue)
-    ui_thread.setDaemon(True)
-    ui_thread.start()
 
-    total_for_agencies, page_size_for_agencies = get_total_apartments_and_page_size(
-        AGENCIES_URL_TO_SCRAPE
-    )
-    total_for_owners, page_size_for_owners = get_total_apartments_and_page_size(
-        OWNERS_URL_TO_SCRAPE
-    )
-    increment = 0
-    number_of_pages_agencies = math.ceil(total_for_agencies / page_size_for_agencies)
-    if page_size_for_agencies <= number_of_pages_agencies:
-        pages.append((AGENCIES_URL_TO_SCRAPE.format(""), {"is_owner": False}))
-    else:
-        for _ in range(number_of_pages_agencies):
-            if increment == 0:
-                pages.append((AGENCIES_URL_TO_SCRAPE.format(""), {"is_owner": False}))
-                increment += page_size_for_agencies + 1
-            else:
-                pages.append(
-                    (
-                        AGENCIES_URL_TO_SCRAPE.format(f"_Desde_{increment}"),
-                        {"is_owner": False},
-                    )
-                )
-                increment += page_size_for_agencies
-
-    number_of_owners = math.ceil(total_for_owners / page_size_for_owners)
-    increment = 0
-    if page_size_for_owners <= number_of_owners:
-        pages.append((OWNERS_URL_TO_SCRAPE.format(""), {"is_owner": True}))
-    else:
-        for _ in range(number_of_owners):
-            if increment == 0:
-                pages.append((OWNERS_URL_TO_SCRAPE.format(""), {"is_owner": True}))
-                increment += page_size_for_owners + 1
-            else:
-                pages.append(
-                    (
-                        OWNERS_URL_TO_SCRAPE.format(f"_Desde_{increment}"),
-                        {"is_owner": True},
-                    )
-                )
-                increment += page_size_for_owners
-    sessions = []
-
-    for i in range(5):
-        session = requests.session()
-        sessions.append(session)
-        fetcher = PageFetcher(pages_to_fetch_queue, page_contents_queue, session)
-        fetcher.setDaemon(True)
-        fetcher.start()
-
-    for page_info in pages:
-        pages_to_fetch_queue.put(page_info)
-
-    consumer = PageConsumer(page_contents_queue, apartments_list)
-    consumer.setDaemon(True)
-    consumer.start()
-
-    pages_to_fetch_queue.join()
-    page_contents_queue.join()
-
-    for session in sessions:
-        session.close()
+class PageContentStream:
+    """
+    Incremental counterpart of parse_page_content: feed it chunks of a page and it returns the valid
+    listings of every card closed so far. Cards rejected by the filter are counted in its own rejects, pages
+    streamed side by side do not mix theirs
+    """
 
-    time_elapsed = (time.time() - start_time) / 60
-    print(f"Finished in {time_elapsed}")
-    print(f"Apartments: {len(apartments_list)}")
+    def __init__(self, is_owner, backend=None, listing_filter=None):
+        self.is_owner = is_owner
+        self.backend = backend or get_backend(PARSER_BACKEND)
+        self.listing_filter = listing_filter
+        self.listing_selector = SELECTORS.compiled(self.backend)["listing"]
+        self.rejects = Counter()
+        self.elements = ElementStream(listing=StreamTarget("li", LISTING_CLASS))
+
+    def feed(self, content):
+        return self._parse_cards(self.elements.feed(content))
+
+    def close(self):
+        return self._parse_cards(self.elements.close())
+
+    def _parse_cards(self, elements):
+        apartments = [
+            self.backend.select_one(self.backend.parse(fragment), self.listing_selector)
+            for _, fragment in elements
+        ]
+        return parse_listings(
+            apartments, self.is_owner, self.backend, self.rejects, self.listing_filter
+        )
 
-    print_results_and_generate_csv(
-        apartments_list, total_for_agencies + total_for_owners, time_elapsed
-    )
 
+def parse_listings(
+    apartments, is_owner, backend=None, rejects=None, listing_filter=None
+):
+    """
+    Returns the listings of the apartment cards that pass listing_filter, LISTING_FILTER by default.
+    Rejects are counted in `rejects` when given
+    """
+    backend = backend or get_backend(PARSER_BACKEND)
+    selectors = SELECTORS.compiled(backend)
+    # (apartment, link, title), the link holds both the title and the url
+    cards = []
+    for apartment in apartments:
+        link = backend.select_one(apartment, selectors["link"])
+        cards.append((apartment, link, backend.text(link)))
+    titles = [title for _, _, title in cards]
+
+    def price_of(card):
+        apartment = card[0]
+        currency_symbol = backend.select_one(apartment, selectors["currency_symbol"])
+        price_fraction = backend.select_one(apartment, selectors["price_fraction"])
+        if currency_symbol is None or price_fraction is None:
+            return None, None
+        return backend.text(currency_symbol), to_number(
+            backend.text(price_fraction), int
+        )
+
+    listings = []
+    for (_, link, title), price in (listing_filter or LISTING_FILTER).apply(
+        cards, titles, price_of, rejects
+    ):
+        url = backend.attr(link, "href")
+        listings.append(
+            Listing(SOURCE, listing_id(url), price, is_owner, url, title.strip())
+        )
+    return listings
 
-def parse_listing(apartment, is_owner):
-    try:
-        listing = {}
-        url = apartment.find("a").attrs["href"]
-        title = apartment.find("a").text
-
-        if re.search(
-            r"inversiones|inversión|amueblado|amoblado|amoblados|venta|vendo|temporal|temporario|temporada",
-            title,
-            re.IGNORECASE,
-        ):
-            print(f"amoblado o temporal, ignorado: {url}")
-            return None
-
-        if (
-            apartment.find(
-                "span", attrs={"class": "andes-money-amount__currency-symbol"}
-            ).text
-            != "$"
-        ):
-            print(f"price not in ARS: {url}")
-            return None
-        price = int(
-            apartment.find(
-                "span", attrs={"class": "andes-money-amount__fraction"}
-            ).text.replace(".", "")
+
+def listing_id(url):
+    match = LISTING_ID_REGEX.search(url)
+    return f"MLA{match.group(1)}" if match else None
+
+
+async def plan_search(fetcher, url, is_owner=None, parser_backend=None):
+    """
+    Returns (pages, total_number_of_apartments) of a search, pages being (url, parse_page_content args).
+    The url has a {} placeholder where the offset of each page goes. Unless told otherwise, searches of
+    owners are the ones filtered by "dueno-directo".
+    The first page is the one read to count the results, it keeps its content so it is not downloaded
+    twice. Offsets are 1-based: page k starts at result 1 + k * page_size
+    """
+    if "{}" not in url:
+        raise ValueError(f"{url} has no {{}} placeholder for the page offset")
+    if is_owner is None:
+        is_owner = "dueno-directo" in url
+    content = await fetcher.fetch(url.format(""))
+    total, page_size = get_total_apartments_and_page_size(content, parser_backend)
+    pages = [Page(url.format(""), (is_owner,), content)]
+    if page_size:
+        pages.extend(
+            (url.format(f"_Desde_{1 + page * page_size}"), (is_owner,))
+            for page in range(1, math.ceil(total / page_size))
         )
-        if price < 100000 or price > 1000000:  # acceptable limits ?
-            print(f"price not acceptable for listing that passed validation: {url}")
-            return None
-        listing["title"] = title
-        listing["price"] = price
-        listing["is_owner"] = is_owner
-        listing["url"] = url
-        return listing
-    except Exception as identifier:
-        raise identifier
-
-
-def get_total_apartments_and_page_size(url):
+    return pages, total
+
+
+def get_total_apartments_and_page_size(content, parser_backend=None):
     """
-    Returns (total_number_of_aparments, page_size)
+    Returns (total_number_of_aparments, page_size) of the first page of a search
     """
-    page = requests.get(url.format("")).text
-    soup = BeautifulSoup(page, "html.parser")
-    results_text = soup.find(
-        "span", attrs={"class": "ui-search-search-result__quantity-results"}
-    ).text
+    backend = get_backend(parser_backend or PARSER_BACKEND)
+    selectors = SELECTORS.compiled(backend)
+    document = backend.parse(content)
+    results_text = backend.text(
+        backend.select_one(document, selectors["results_count"])
+    )
     results_number_regex = re.compile("(\d+) resultados")
     total_number_of_apartments = int(results_number_regex.match(results_text).group(1))
-    apartments = soup.find_all("li", attrs={"class": "ui-search-layout__item"})
+    apartments = backend.select(document, selectors["listing"])
     return total_number_of_apartments, len(apartments)
 
 
-def print_results_and_generate_csv(
+def print_results_and_generate_stats(
     results, total_number_of_apartments, elapsed_time_in_minutes
 ):
+    """
+    results are the listing columns collected by a ListingSink
+    """
+    from scraping.stats import (
+        group_stats,
+        listings_array,
+        price_histogram,
+        write_report,
+    )
+
     # TODO: refactor
-    prices = [listing["price"] for listing in results]
-    published_by_owner_prices = [
-        listing["price"] for listing in results if listing["is_owner"]
-    ]
-    published_by_agency_prices = [
-        listing["price"] for listing in results if not listing["is_owner"]
-    ]
     PERCENTILE = 80
+    listings = listings_array(results)
+    everyone = group_stats(listings, percentiles=(PERCENTILE,))
+    by_owner = group_stats(listings, by="is_owner", percentiles=(PERCENTILE,))
     print("\n===============================================")
     print(f"Finished scraping mercadolibre listings {elapsed_time_in_minutes} minutes")
     print(f"Total scraped apartments: {total_number_of_apartments}")
-    print(f"Relevant apartments processed: {len(results)}")
-    print(f"Ignored apartments: {total_number_of_apartments - len(results)}")
+    print(f"Relevant apartments processed: {len(listings)}")
+    print(f"Ignored apartments: {total_number_of_apartments - len(listings)}")
+    # a group can be left empty by the filters or once duplicates are dropped
+    groups = {"all apartments": everyone[None]} if None in everyone else {}
+    for is_owner, label in ((True, "owners"), (False, "agencies")):
+        if is_owner in by_owner:
+            groups[label] = by_owner[is_owner]
+    for label, stats in groups.items():
+        print("===============================================")
+        print(f"{label.capitalize()}:")
+        print(f"Total: {stats.count}")
+        print(f"Max price: {stats.max}")
+        print(f"Min price: {stats.min}")
+        print(f"AVG price: {stats.mean}")
+        print(f"MEDIAN price: {stats.median}")
+        print(f"{PERCENTILE}% PERCENTILE: {stats.percentiles[PERCENTILE]}")
     print("===============================================")
-    print("All apartments:")
-    print(f"Total: {len(prices)}")
-    print(f"Max price: {max(prices)}")
-    print(f"Min price: {min(prices)}")
-    print(f"AVG price: {sum(prices) / len(prices)}")
-    print(f"MEDIAN price: {statistics.median(prices)}")
-
-    prices.sort()
-    index = round(len(prices) * (PERCENTILE / 100))
-    index = index if index < len(prices) else len(prices) - 1
-    percentile = prices[index]
-    print(f"{PERCENTILE}% PERCENTILE: {percentile}")
 
-    print("===============================================")
-    print("Owners:")
-    print(f"Total: {len(published_by_owner_prices)}")
-    print(f"Max price: {max(published_by_owner_prices)}")
-    print(f"Min price: {min(published_by_owner_prices)}")
-    print(
-        f"AVG price: {sum(published_by_owner_prices) / len(published_by_owner_prices)}"
-    )
-    print(f"MEDIAN price: {statistics.median(published_by_owner_prices)}")
-    published_by_owner_prices.sort()
-    index = round(len(published_by_owner_prices) * (PERCENTILE / 100))
-    index = (
-        index
-        if index < len(published_by_owner_prices)
-        else len(published_by_owner_prices) - 1
-    )
-    percentile = published_by_owner_prices[index]
-    print(f"{PERCENTILE}% PERCENTILE: {percentile}")
-    print("===============================================")
-    print("Agencies:")
-    print(f"Total: {len(published_by_agency_prices)}")
-    print(f"Max price: {max(published_by_agency_prices)}")
-    print(f"Min price: {min(published_by_agency_prices)}")
-    print(
-        f"AVG price: {sum(published_by_agency_prices) / len(published_by_agency_prices)}"
-    )
-    print(f"MEDIAN price: {statistics.median(published_by_agency_prices)}")
-    published_by_agency_prices.sort()
-    index = round(len(published_by_agency_prices) * (PERCENTILE / 100))
-    index = (
-        index
-        if index < len(published_by_agency_prices)
-        else len(published_by_agency_prices) - 1
-    )
-    percentile = published_by_agency_prices[index]
-    print(f"{PERCENTILE}% PERCENTILE: {percentile}")
-    print("===============================================")
-
-    print("\nExporting to CSV... ")
-    with open(csv_file_name, "w") as csvfile:
-        fieldnames = ["id", "price", "published_by_owner", "url"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for listing in results:
-            listing_id = listing["title"]
-            writer.writerow(
-                {
-                    "id": listing_id,
-                    "price": listing["price"],
-                    "published_by_owner": "true" if listing["is_owner"] else "false",
-                    "url": listing["url"],
-                }
-            )
     # calculate histogram values to see distribution of prices
-    bucket_size = 50000
-    first_bucket = math.floor(min(prices) / bucket_size) * bucket_size
-    last_bucket = math.ceil(max(prices) / bucket_size) * bucket_size
-    bins = [
-        value for value in range(first_bucket, last_bucket + bucket_size, bucket_size)
-    ]
-    values, buckets = numpy.histogram(prices, bins=bins)
-
-    with open(csv_file_name, "a") as csvfile:
-        fieldnames = ["alquiler", "departamentos"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        print("\nPrices distribution:")
-        print("========================")
-        for index, value in enumerate(values):
-            writer.writerow(
-                {
-                    "alquiler": str(buckets[index]) + " - " + str(buckets[index + 1]),
-                    "departamentos": value,
-                }
-            )
-            print(f"{str(buckets[index])} - {str(buckets[index + 1])} => {str(value)}")
+    values, buckets = price_histogram(listings["price"], 50000)
+    print("\nPrices distribution:")
+    print("========================")
+    for index, value in enumerate(values):
+        print(f"{str(buckets[index])} - {str(buckets[index + 1])} => {str(value)}")
     print("========================\n")
+    write_report(stats_file_name, groups, (values, buckets))
+    print(f"statistics written to {stats_file_name}")
 
 
 if __name__ == "__main__":
-    scrape()
+    asyncio.run(scrape())
@@ -0,0 +1,3 @@
+from scraping.cli import main
+
+main()
@@ -0,0 +1,72 @@
+"""
+Library API: the listings of a scrape as an async iterator, for callers that process them as they arrive
+instead of reading the exports of a run.
+
+    import asyncio
+    from scraping.api import scrape_listings
+
+    async def cheapest():
+        async for listing in scrape_listings("lavoz", max_concurrent_requests=5, parser_backend="lxml"):
+            if listing.price < 20000:
+                print(listing.price, listing.url)
+
+    asyncio.run(cheapest())
+
+Listings are yielded as soon as their page is parsed. Nothing is exported and no statistics or price
+history are recorded, only the response cache is used. Breaking out of the loop stops the scrape. The settings
+of a call only apply to its own scrape, the site scripts are left untouched so concurrent calls with different
+filters or parser backends do not affect each other.
+"""
+import asyncio
+
+from scraping.jobs import crawl_job, job_from_dict
+from scraping.listing import UniqueListings
+from scraping.metrics import Metrics
+from scraping.sites import SEARCH_URL_SETTINGS, load_site
+
+
+class _QueueSink:
+    """
+    Sink handing the listings of every page to the iterator reading them, pages are parsed in the event loop
+    thread so the queue needs no locking
+    """
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    def add(self, listings: list):
+        if listings:
+            self.queue.put_nowait(listings)
+
+
+async def scrape_listings(site: str, urls: list = None, metrics: Metrics = None, **settings):
+    """
+    Async iterator of the listings of the searches of a site, every listing once. urls default to the
+    searches of the site scraper. settings are job settings (see scraping.jobs.Job) such as
+    max_concurrent_requests, parser_workers, parser_backend, streaming, cache or filters
+    """
+    if urls is None:
+        module = load_site(site)
+        urls = [getattr(module, setting) for setting in SEARCH_URL_SETTINGS[site]]
+    spec = dict(settings, searches=[{"site": site, "url": url} for url in urls])
+    job = job_from_dict(spec, default_name=site)
+    queue = asyncio.Queue()
+    crawl = asyncio.ensure_future(crawl_job(job, [UniqueListings([_QueueSink(queue)])], metrics or Metrics()))
+    # wakes up the loop below when the crawl ends without a last page to yield
+    crawl.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while True:
+            listings = await queue.get()
+            if listings is None:
+                break
+            for listing in listings:
+                yield listing
+        # raises the error the crawl failed with
+        await crawl
+    finally:
+        if not crawl.done():
+            crawl.cancel()
+            try:
+                await crawl
+            except asyncio.CancelledError:
+                pass
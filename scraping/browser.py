@@ -0,0 +1,130 @@
+"""
+Headless browser fallback for pages the plain HTTP client gets blocked on.
+
+A BrowserPool keeps one headless Chromium, driven by Playwright, with a bounded number of browser contexts
+that stay open between pages, so a page costs a tab and not a browser start. Images, fonts, stylesheets and
+media are not downloaded. The browser is only launched the first time a Fetcher falls back to it, runs that
+never get blocked do not pay for it.
+
+Playwright is optional: `pip install playwright && playwright install chromium`.
+"""
+import asyncio
+
+from multidict import CIMultiDict
+
+from scraping.fetch import REQUEST_TIMEOUT, FetchError, FetchResponse, error_reason, looks_blocked
+
+BROWSER_POOL_SIZE = 2
+BLOCKED_RESOURCE_TYPES = ("image", "font", "stylesheet", "media")
+
+
+class BrowserNotAvailable(Exception):
+    pass
+
+
+class BrowserPool:
+    """
+    `size` warm browser contexts, a page waits for a free one. executable_path runs a Chrome or Chromium
+    already installed instead of the one downloaded by Playwright
+    """
+
+    def __init__(
+        self,
+        size: int = BROWSER_POOL_SIZE,
+        executable_path: str = None,
+        blocked_resource_types: tuple = BLOCKED_RESOURCE_TYPES,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.size = size
+        self.executable_path = executable_path
+        self.blocked_resource_types = blocked_resource_types
+        self.timeout = timeout
+        self._playwright = None
+        self._browser = None
+        self._contexts = None
+        self._lock = asyncio.Lock()
+        self._error = None
+        # why the browser could not start, not tried again for every page
+        self._unavailable = None
+
+    async def start(self):
+        """
+        Launches the browser and opens its contexts, done on the first page when not called before
+        """
+        async with self._lock:
+            if self._browser is not None:
+                return
+            if self._unavailable is not None:
+                raise BrowserNotAvailable(self._unavailable)
+            try:
+                from playwright.async_api import Error, async_playwright
+            except ImportError as e:
+                self._unavailable = f"playwright: {e}"
+                raise BrowserNotAvailable(self._unavailable)
+            self._error = Error
+            self._playwright = await async_playwright().start()
+            try:
+                self._browser = await self._playwright.chromium.launch(
+                    headless=True, executable_path=self.executable_path, args=["--no-sandbox", "--disable-gpu"]
+                )
+            except Error as e:
+                await self._playwright.stop()
+                self._playwright = None
+                # the first line says what is missing, the rest is how to install it
+                self._unavailable = f"chromium: {str(e).splitlines()[0]}"
+                raise BrowserNotAvailable(self._unavailable)
+            self._contexts = asyncio.Queue()
+            for _ in range(self.size):
+                context = await self._browser.new_context()
+                await context.route("**/*", self._route)
+                self._contexts.put_nowait(context)
+            print(f"headless browser started with {self.size} contexts")
+
+    async def _route(self, route):
+        if route.request.resource_type in self.blocked_resource_types:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def get(self, url: str) -> FetchResponse:
+        """
+        Loads the page in a free context and returns its rendered HTML. A challenge page gets until the
+        network is idle to run its scripts and move on to the real page. Raises FetchError when the page
+        does not load
+        """
+        await self.start()
+        context = await self._contexts.get()
+        try:
+            page = await context.new_page()
+            try:
+                response = await page.goto(url, wait_until="domcontentloaded", timeout=self.timeout * 1000)
+                status = response.status if response is not None else 200
+                headers = CIMultiDict(response.headers if response is not None else {})
+                content = await page.content()
+                if looks_blocked(status, content):
+                    await page.wait_for_load_state("networkidle", timeout=self.timeout * 1000)
+                    content = await page.content()
+                    if not looks_blocked(200, content):
+                        status = 200
+                return FetchResponse(status, content, headers)
+            except self._error as e:
+                raise FetchError(url, f"browser: {error_reason(e)}")
+            finally:
+                await page.close()
+        finally:
+            self._contexts.put_nowait(context)
+
+    async def close(self):
+        async with self._lock:
+            if self._browser is not None:
+                await self._browser.close()
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,142 @@
+"""
+On disk cache of result pages between runs.
+
+For every URL we keep the validators the server sent (ETag / Last-Modified), a hash of the body and the
+listings parsed out of it. The next run sends a conditional request and, when the server answers 304 or
+the body hash did not change, reuses the parsed listings instead of parsing the page again.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from collections import namedtuple
+
+from scraping.listing import Listing
+
+CACHE_FILE = "responses-cache.sqlite"
+CACHE_TTL = 7 * 24 * 60 * 60
+CACHE_MAX_ENTRIES = 10000
+
+# cards is the number of listing cards the page had before they were filtered, what tells a page past the end
+# of the results apart from a page whose listings were all filtered out
+CachedPage = namedtuple("CachedPage", ["url", "etag", "last_modified", "body_hash", "listings", "cards"])
+
+
+def body_hash(content: str) -> str:
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite backed page cache with TTL and least recently used eviction.
+
+    Entries are scoped by namespace, scrapers should change it whenever the way listings are parsed or
+    filtered changes so listings cached by a previous version are not reused.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        path: str = CACHE_FILE,
+        ttl: int = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                namespace TEXT NOT NULL,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT NOT NULL,
+                listings TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                cards INTEGER,
+                PRIMARY KEY (namespace, url)
+            )
+            """
+        )
+        # caches created before the number of cards was kept, their entries are not reused
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(pages)")]
+        if "cards" not in columns:
+            self.connection.execute("ALTER TABLE pages ADD COLUMN cards INTEGER")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+        self.connection.commit()
+
+    def lookup(self, url: str) -> CachedPage:
+        row = self.connection.execute(
+            """
+            SELECT etag, last_modified, body_hash, listings, cards FROM pages
+            WHERE namespace = ? AND url = ? AND stored_at > ? AND cards IS NOT NULL
+            """,
+            (self.namespace, url, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, page_hash, listings, cards = row
+        return CachedPage(url, etag, last_modified, page_hash, [Listing(*row) for row in json.loads(listings)], cards)
+
+    def store(self, url: str, etag: str, last_modified: str, page_hash: str, listings: list, cards: int = None):
+        now = time.time()
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO pages
+                (namespace, url, etag, last_modified, body_hash, listings, stored_at, accessed_at, cards)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                self.namespace,
+                url,
+                etag,
+                last_modified,
+                page_hash,
+                json.dumps([listing.to_tuple() for listing in listings]),
+                now,
+                now,
+                cards,
+            ),
+        )
+        self.connection.commit()
+
+    def refresh(self, url: str, etag: str = None, last_modified: str = None):
+        """
+        Marks a cached page as still valid, keeping the previous validators when the server sent none
+        """
+        now = time.time()
+        self.connection.execute(
+            """
+            UPDATE pages SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified),
+                stored_at = ?, accessed_at = ?
+            WHERE namespace = ? AND url = ?
+            """,
+            (etag, last_modified, now, now, self.namespace, url),
+        )
+        self.connection.commit()
+
+    def evict(self):
+        self.connection.execute("DELETE FROM pages WHERE stored_at <= ?", (time.time() - self.ttl,))
+        self.connection.execute(
+            "DELETE FROM pages WHERE rowid NOT IN (SELECT rowid FROM pages ORDER BY accessed_at DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+
+def conditional_headers(cached: CachedPage) -> dict:
+    headers = {}
+    if cached is None:
+        return headers
+    if cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+    return headers
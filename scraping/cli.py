@@ -0,0 +1,150 @@
+"""
+Command line of the scrapers, `python -m scraping <command>`:
+
+    python -m scraping lavoz --concurrency 10 --backend lxml --export rents.csv --export rents.parquet
+    python -m scraping mercadolibre --streaming --no-cache --browser-executable-path /usr/bin/chromium
+    python -m scraping job jobs/nueva-cordoba-1-bedroom.json --parser-workers 2
+    python -m scraping distributed --queue sqlite:///crawl.sqlite work --processes 4
+    python -m scraping history trend lavoz --segment owners
+
+A site command runs its scraper script with the settings given as options in place of the script's own,
+a job command does the same with the settings of the job spec. Only argparse is imported until a command
+runs, --help and argument errors do not wait for aiohttp, numpy or the parsers to load.
+"""
+import argparse
+import importlib
+import sys
+
+from scraping.parsers import BACKENDS_BY_PREFERENCE
+from scraping.sites import ENTRY_POINTS, SCRIPTS, load_site
+
+# option: (setting of the scraper scripts, job setting), None when it does not apply
+SETTINGS = {
+    "concurrency": ("MAX_CONCURRENT_REQUESTS", "max_concurrent_requests"),
+    "connections_per_host": ("MAX_CONNECTIONS_PER_HOST", "max_connections_per_host"),
+    "parser_workers": ("PARSER_WORKERS", "parser_workers"),
+    "backend": ("PARSER_BACKEND", "parser_backend"),
+    "streaming": ("STREAMING_PARSER", "streaming"),
+    "cache": ("RESPONSE_CACHE_FILE", "cache"),
+    "export": ("EXPORT_FILES", "export"),
+    "history": ("HISTORY_FILE", "history"),
+    "deduplicate": ("DEDUPLICATE", "deduplicate"),
+    "adaptive_rate": ("ADAPTIVE_RATE", "adaptive_rate"),
+    "browser_fallback": ("BROWSER_FALLBACK", "browser_fallback"),
+    "browser_pool_size": ("BROWSER_POOL_SIZE", "browser_pool_size"),
+    "browser_executable_path": ("BROWSER_EXECUTABLE_PATH", None),
+    "incremental": ("INCREMENTAL", None),
+    "metrics_port": ("METRICS_PORT", None),
+}
+# commands with a command line of their own, every argument after the command is passed on to its main
+DELEGATED = {
+    "distributed": ("scraping.distributed", "crawl a job with workers sharing a queue"),
+    "history": ("scraping.history", "price history across runs"),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # options that are not given are left out of the parsed arguments, so they do not override anything
+    settings_options = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    settings_options.add_argument("--concurrency", type=int, help="requests in flight")
+    settings_options.add_argument("--connections-per-host", type=int, help="connections open to each site")
+    settings_options.add_argument("--parser-workers", type=int, help="processes parsing pages")
+    settings_options.add_argument("--backend", choices=BACKENDS_BY_PREFERENCE, help="HTML parser")
+    settings_options.add_argument("--streaming", action="store_true", help="parse pages while they download")
+    settings_options.add_argument("--no-streaming", dest="streaming", action="store_false")
+    settings_options.add_argument("--cache", metavar="FILE", help="response cache")
+    settings_options.add_argument("--no-cache", dest="cache", action="store_const", const=None)
+    settings_options.add_argument(
+        "--export", metavar="FILE", action="append", help="export file, .csv, .parquet or .sqlite, can be repeated"
+    )
+    settings_options.add_argument("--history", metavar="FILE", help="price history store")
+    settings_options.add_argument("--no-history", dest="history", action="store_const", const=None)
+    settings_options.add_argument(
+        "--no-dedup", dest="deduplicate", action="store_false", help="count duplicate listings in the statistics"
+    )
+    settings_options.add_argument("--no-adaptive-rate", dest="adaptive_rate", action="store_false")
+    settings_options.add_argument("--browser-fallback", action="store_true", help="fetch blocked pages with Chromium")
+    settings_options.add_argument("--browser-pool-size", type=int, help="browser contexts kept open")
+
+    site_options = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    site_options.add_argument(
+        "--browser-executable-path",
+        metavar="PATH",
+        help="Chrome or Chromium to fetch blocked pages with, turns on --browser-fallback",
+    )
+    # kept so the flag of the old README fails with an explanation instead of an unknown argument error
+    site_options.add_argument(
+        "--chrome-driver-path",
+        metavar="PATH",
+        help="not supported, blocked pages are fetched with Chrome itself, see --browser-executable-path",
+    )
+    site_options.add_argument("--incremental", action="store_true", help="only report changes since the last run")
+    site_options.add_argument("--metrics-port", type=int, help="serve the run metrics on this port")
+
+    parser = argparse.ArgumentParser(prog="python -m scraping", description="apartment listing scrapers")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for site in SCRIPTS:
+        commands.add_parser(site, parents=[settings_options, site_options], help=f"scrape {site} searches")
+    job_parser = commands.add_parser("job", parents=[settings_options], help="run the searches of a job spec")
+    job_parser.add_argument("spec", help="job spec, a .json file or a .yaml one when PyYAML is installed")
+    for command, (_, description) in DELEGATED.items():
+        delegated_parser = commands.add_parser(command, help=f"{description}, see `{command} --help`")
+        delegated_parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    return parser
+
+
+def script_settings(args: argparse.Namespace) -> dict:
+    """
+    {script setting: value} of the options given
+    """
+    settings = {SETTINGS[option][0]: value for option, value in vars(args).items() if option in SETTINGS}
+    if settings.get("BROWSER_EXECUTABLE_PATH"):
+        settings.setdefault("BROWSER_FALLBACK", True)
+    return settings
+
+
+def job_settings(args: argparse.Namespace) -> dict:
+    """
+    {job setting: value} of the options given
+    """
+    return {
+        SETTINGS[option][1]: value for option, value in vars(args).items() if option in SETTINGS and SETTINGS[option][1]
+    }
+
+
+def run_site(site: str, settings: dict):
+    import asyncio
+
+    module = load_site(site)
+    for name, value in settings.items():
+        setattr(module, name, value)
+    # the scripts size their queue of pages waiting to be parsed after their parser workers
+    if "PARSER_WORKERS" in settings and hasattr(module, "MAX_PENDING_PAGES"):
+        module.MAX_PENDING_PAGES = settings["PARSER_WORKERS"] * 2
+    asyncio.run(getattr(module, ENTRY_POINTS[site])())
+
+
+def run_job_spec(spec: str, settings: dict):
+    import asyncio
+
+    from scraping import jobs
+
+    asyncio.run(jobs.run_job(jobs.load_job(spec)._replace(**settings)))
+
+
+def main(argv: list = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in DELEGATED:
+        importlib.import_module(DELEGATED[argv[0]][0]).main(argv[1:])
+        return
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if "chrome_driver_path" in args:
+        parser.error(
+            "--chrome-driver-path is not supported: blocked pages are fetched through Playwright with Chrome or "
+            "Chromium itself, not through a chromedriver. Pass the browser with --browser-executable-path"
+        )
+    if args.command == "job":
+        run_job_spec(args.spec, job_settings(args))
+    else:
+        run_site(args.command, script_settings(args))
@@ -0,0 +1,201 @@
+"""
+Duplicate listings across sites and publishers: the same apartment listed on lavoz and mercadolibre, or by
+its owner and by an agency, is counted once in the statistics.
+
+Two listings are the same apartment when they have the same site and listing id, or the same price and
+titles similar enough. Titles are compared through MinHash signatures of their words and word pairs, and
+locality sensitive hashing only compares listings sharing a band of their signature and their price, so
+labelling takes near linear time instead of comparing every pair of listings.
+"""
+import re
+import unicodedata
+import zlib
+
+import numpy
+
+NUM_HASHES = 64
+BANDS = 16
+# listings whose signatures agree on at least this fraction of hashes are the same apartment, an estimate of
+# the Jaccard similarity of their title shingles
+SIMILARITY_THRESHOLD = 0.6
+# prices are compared rounded to this step
+PRICE_STEP = 100
+# shingles hashed at a time, keeps the (NUM_HASHES, shingles) matrix in cache
+HASH_BATCH_SIZE = 16384
+HASH_SEED = 1
+# mixes two hashes into one, words into the hash of their pair and band hashes into a bucket key
+PAIR_MULTIPLIER = 0x9E3779B1
+NOT_DUPLICATE = -1
+
+WORD_REGEX = re.compile(r"[a-z0-9]+")
+
+
+def normalize_title(title: str) -> list:
+    """
+    Words of a title, lowercased and without accents
+    """
+    text = title.lower()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return WORD_REGEX.findall(text)
+
+
+def title_shingles(titles: list) -> tuple:
+    """
+    (shingles, owners): 32 bit hashes of the words and pairs of consecutive words of every title, grouped by
+    title, and the index of the title of each one. Words are hashed once however many titles have them,
+    pairs are hashed from the hashes of their words
+    """
+    vocabulary = {}
+    word_ids = []
+    counts = []
+    for title in titles:
+        words = normalize_title(title) if title else []
+        word_ids.extend(vocabulary.setdefault(word, len(vocabulary)) for word in words)
+        counts.append(len(words))
+    word_hashes = numpy.fromiter((zlib.crc32(word.encode("ascii")) for word in vocabulary), "u8", len(vocabulary))
+    words = word_hashes[numpy.array(word_ids, dtype="i8")]
+    word_owners = numpy.repeat(numpy.arange(len(titles)), counts)
+    consecutive = word_owners[1:] == word_owners[:-1]
+    pairs = (words[:-1][consecutive] * numpy.uint64(PAIR_MULTIPLIER) + words[1:][consecutive]) & numpy.uint64(
+        2**32 - 1
+    )
+    shingles = numpy.concatenate((words, pairs))
+    owners = numpy.concatenate((word_owners, word_owners[:-1][consecutive]))
+    order = numpy.argsort(owners, kind="stable")
+    return shingles[order], owners[order]
+
+
+def minhash_signatures(titles: list) -> numpy.ndarray:
+    """
+    (len(titles), NUM_HASHES) MinHash signatures. Hash i of a shingle x is (a_i * x + b_i) mod 2**64 >> 32,
+    a multiply-shift hash with random 64 bit a_i and b_i. Signatures of titles without words keep every
+    hash at its initial maximum
+    """
+    generator = numpy.random.RandomState(HASH_SEED)
+    multipliers = generator.randint(0, 2**64, size=NUM_HASHES, dtype="u8") | numpy.uint64(1)
+    increments = generator.randint(0, 2**64, size=NUM_HASHES, dtype="u8")
+    signatures = numpy.full((len(titles), NUM_HASHES), numpy.iinfo("u8").max, dtype="u8")
+    hashes, owners = title_shingles(titles)
+    for start in range(0, len(hashes), HASH_BATCH_SIZE):
+        # one row per hash function, so the minimums below run over contiguous memory
+        values = multipliers[:, None] * hashes[start : start + HASH_BATCH_SIZE]
+        values += increments[:, None]
+        values >>= numpy.uint64(32)
+        # shingles of a title are contiguous, the minimum of each run of columns is its part of the signature
+        batch_owners = owners[start : start + HASH_BATCH_SIZE]
+        starts = numpy.flatnonzero(numpy.r_[True, batch_owners[1:] != batch_owners[:-1]])
+        minimums = numpy.minimum.reduceat(values, starts, axis=1).T
+        rows = batch_owners[starts]
+        signatures[rows] = numpy.minimum(signatures[rows], minimums)
+    return signatures
+
+
+class _Clusters:
+    """
+    Union-find over listing indexes, every cluster is represented by its first listing and keeps the
+    publishers of its listings
+    """
+
+    def __init__(self, publishers: list):
+        self.parent = list(range(len(publishers)))
+        # by root, None for the listings that are not a root anymore
+        self.publishers = [{publisher} for publisher in publishers]
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i: int, j: int, distinct_publishers: bool = False) -> bool:
+        """
+        Merges the clusters of i and j, unless distinct_publishers and a publisher has listings in both.
+        Returns whether i and j are in the same cluster
+        """
+        first, second = sorted((self.find(i), self.find(j)))
+        if first == second:
+            return True
+        if distinct_publishers and not self.publishers[first].isdisjoint(self.publishers[second]):
+            return False
+        self.parent[second] = first
+        self.publishers[first] |= self.publishers[second]
+        self.publishers[second] = None
+        return True
+
+
+def duplicate_labels(columns: dict) -> numpy.ndarray:
+    """
+    For the listing columns of ListingSink.flush, the index of the first listing of the same apartment for
+    each listing, NOT_DUPLICATE for the first one of every apartment.
+
+    Titles are only compared between listings of different sites or publishers, an agency publishing
+    several apartments of a building with the same title and price is not publishing one apartment twice.
+    For the same reason two clusters are not merged on their titles when a publisher has listings in both,
+    otherwise two apartments of an agency would end up as one through a listing similar to both
+    """
+    size = len(columns["price"])
+    publishers = list(zip(columns["source"], columns["is_owner"]))
+    clusters = _Clusters(publishers)
+    first_of_id = {}
+    for i, (source, listing_id) in enumerate(zip(columns["source"], columns["id"])):
+        if listing_id is None:
+            continue
+        key = (source, listing_id)
+        if key in first_of_id:
+            clusters.union(first_of_id[key], i)
+        else:
+            first_of_id[key] = i
+
+    signatures = minhash_signatures(columns.get("title") or [None] * size)
+
+    def link_bucket(members: list):
+        # first listing of every publisher in the bucket
+        representatives = {}
+        for member in members:
+            for publisher, representative in representatives.items():
+                if publisher == publishers[member] or prices[member] != prices[representative]:
+                    continue
+                agreement = numpy.count_nonzero(signatures[member] == signatures[representative]) / NUM_HASHES
+                if agreement >= SIMILARITY_THRESHOLD:
+                    clusters.union(representative, member, distinct_publishers=True)
+            representatives.setdefault(publishers[member], member)
+
+    # titles without words have the initial signature and would all look alike
+    with_title = numpy.flatnonzero(signatures[:, 0] != numpy.iinfo("u8").max)
+    prices = numpy.rint(numpy.asarray(columns["price"], dtype="f8") / PRICE_STEP).astype("u8")
+    rows = NUM_HASHES // BANDS
+    for band in range(BANDS):
+        # a bucket holds the listings with the same price and the same hashes in this band, mixed into one
+        # 64 bit key, a collision only costs comparing two signatures
+        keys = prices.copy()
+        for column in range(band * rows, (band + 1) * rows):
+            keys *= numpy.uint64(PAIR_MULTIPLIER)
+            keys += signatures[:, column]
+        order = with_title[numpy.argsort(keys[with_title], kind="stable")]
+        same = keys[order[1:]] == keys[order[:-1]]
+        # runs of equal keys, the buckets with more than one listing
+        edges = numpy.diff(numpy.r_[0, same.astype("i1"), 0])
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1) + 1
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            link_bucket(order[start:end].tolist())
+
+    labels = numpy.full(size, NOT_DUPLICATE, dtype="i8")
+    for i in range(size):
+        root = clusters.find(i)
+        if root != i:
+            labels[i] = root
+    return labels
+
+
+def drop_duplicates(columns: dict) -> tuple:
+    """
+    Returns (columns of the first listing of every apartment, number of duplicates dropped)
+    """
+    labels = duplicate_labels(columns)
+    keep = (labels == NOT_DUPLICATE).tolist()
+    unique = {field: [value for value, kept in zip(values, keep) if kept] for field, values in columns.items()}
+    return unique, len(keep) - sum(keep)
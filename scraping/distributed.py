@@ -0,0 +1,592 @@
+"""
+Distributed crawls: a coordinator plans the pages of a job into a durable work queue, any number of
+worker processes, on this machine or others, lease pages from it, fetch and parse them and push their
+listings back, and the coordinator merges them into the job exports and statistics.
+
+    python -m scraping.distributed plan jobs/nueva-cordoba-1-bedroom.json --queue sqlite:///crawl.sqlite
+    python -m scraping.distributed work --queue sqlite:///crawl.sqlite --processes 4
+    python -m scraping.distributed collect --queue sqlite:///crawl.sqlite
+
+`run` does the three of them locally. The queue is SQLite, fine for the workers of one machine, or Redis
+(needs the redis package, `redis://host:6379/0`) for several. A leased page goes back to the queue when its
+worker does not report it before the lease expires, so a crawl survives workers dying and a new worker
+picks up where it stopped. Pages that keep failing are given up on after MAX_PAGE_ATTEMPTS leases.
+
+The pages of a search are planned from the result count of its first page and all of them are crawled and
+exported. Unlike a local run, a distributed crawl does not stop a search at a page that is past the end of
+its results, such as an empty page or a repeat of an earlier one, when the count was too high.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+# the jobs, fetch and stats modules load aiohttp and numpy, every command imports what it needs when it runs so
+# `--help` and argument errors do not wait for them
+from scraping.listing import Listing
+
+DEFAULT_QUEUE = "sqlite:///crawl-queue.sqlite"
+# longer than a fetch with all its retries takes
+LEASE_SECONDS = 300
+MAX_PAGE_ATTEMPTS = 3
+POLL_INTERVAL = 1.0
+WORKER_CONCURRENCY = 10
+
+Task = namedtuple("Task", ["id", "search", "site", "url", "args"])
+
+
+class WorkQueueNotAvailable(Exception):
+    pass
+
+
+class WorkQueue:
+    """
+    Base work queue. Pages go through pending -> leased -> done, or failed once they used up their attempts
+    """
+
+    def reset(self, job_spec: dict):
+        """
+        Drops whatever the queue held and starts the crawl of job_spec
+        """
+        raise NotImplementedError
+
+    def job_spec(self) -> dict:
+        raise NotImplementedError
+
+    def put(self, tasks: list):
+        """
+        Adds (search, site, url, args, listings) pages, they are leased in the order given. Pages whose
+        listings are not None are already done
+        """
+        raise NotImplementedError
+
+    def lease(self, worker: str, seconds: float = LEASE_SECONDS) -> Task:
+        """
+        Next page to process, None when there are no pages to lease right now
+        """
+        raise NotImplementedError
+
+    def complete(self, task: Task, worker: str, listings: list):
+        raise NotImplementedError
+
+    def fail(self, task: Task, worker: str, reason: str):
+        raise NotImplementedError
+
+    def unfinished(self) -> int:
+        """
+        Number of pages pending or leased
+        """
+        raise NotImplementedError
+
+    def results(self) -> list:
+        """
+        Listings of every page done, page by page in the order they were put
+        """
+        raise NotImplementedError
+
+    def failures(self) -> dict:
+        """
+        {url: reason} of the pages given up on
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def encode_listings(listings: list) -> str:
+    return json.dumps([listing.to_tuple() for listing in listings])
+
+
+def decode_listings(text: str) -> list:
+    return [Listing(*row) for row in json.loads(text)]
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    Work queue in a SQLite file, every process opens its own connection. Leases are taken in IMMEDIATE
+    transactions so two workers never lease the same page
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS job (spec TEXT NOT NULL)")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY,
+                search TEXT NOT NULL,
+                site TEXT NOT NULL,
+                url TEXT NOT NULL,
+                args TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                listings TEXT
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_state ON pages (state, id)")
+
+    def _transaction(self, statements: callable):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements()
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        return result
+
+    def reset(self, job_spec: dict):
+        def statements():
+            self.connection.execute("DELETE FROM job")
+            self.connection.execute("DELETE FROM pages")
+            self.connection.execute("INSERT INTO job VALUES (?)", (json.dumps(job_spec),))
+
+        self._transaction(statements)
+
+    def job_spec(self) -> dict:
+        row = self.connection.execute("SELECT spec FROM job").fetchone()
+        if row is None:
+            raise ValueError(f"{self.path} holds no crawl, plan one first")
+        return json.loads(row[0])
+
+    def put(self, tasks: list):
+        rows = []
+        for search, site, url, args, listings in tasks:
+            if listings is None:
+                rows.append((search, site, url, json.dumps(args), "pending", None))
+            else:
+                rows.append((search, site, url, json.dumps(args), "done", encode_listings(listings)))
+        self._transaction(
+            lambda: self.connection.executemany(
+                "INSERT INTO pages (search, site, url, args, state, listings) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+        )
+
+    def lease(self, worker: str, seconds: float = LEASE_SECONDS) -> Task:
+        def statements():
+            now = time.time()
+            self.connection.execute(
+                """
+                UPDATE pages SET state = 'failed', error = 'lease expired ' || attempts || ' times'
+                WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?
+                """,
+                (now, MAX_PAGE_ATTEMPTS),
+            )
+            row = self.connection.execute(
+                """
+                SELECT id, search, site, url, args FROM pages
+                WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                ORDER BY id LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE pages SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now + seconds, row[0]),
+            )
+            return Task(row[0], row[1], row[2], row[3], tuple(json.loads(row[4])))
+
+        return self._transaction(statements)
+
+    def complete(self, task: Task, worker: str, listings: list):
+        # a worker whose lease expired and was taken over does not report the page twice
+        self.connection.execute(
+            "UPDATE pages SET state = 'done', listings = ?, error = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+            (encode_listings(listings), task.id, worker),
+        )
+
+    def fail(self, task: Task, worker: str, reason: str):
+        self.connection.execute(
+            """
+            UPDATE pages SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?
+            WHERE id = ? AND worker = ? AND state = 'leased'
+            """,
+            (MAX_PAGE_ATTEMPTS, reason, task.id, worker),
+        )
+
+    def unfinished(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM pages WHERE state IN ('pending', 'leased')").fetchone()[0]
+
+    def results(self) -> list:
+        rows = self.connection.execute("SELECT listings FROM pages WHERE state = 'done' ORDER BY id")
+        return [decode_listings(listings) for listings, in rows]
+
+    def failures(self) -> dict:
+        return dict(self.connection.execute("SELECT url, error FROM pages WHERE state = 'failed' ORDER BY id"))
+
+    def close(self):
+        self.connection.close()
+
+
+# KEYS: pending, leased, workers, attempts, tasks, failed. ARGV: now, lease expiry, worker, MAX_PAGE_ATTEMPTS.
+# Requeues the expired leases and leases the next pending page, returns [id, task] or nil
+LEASE_SCRIPT = """
+local pending, leased, workers, attempts, tasks, failed = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', leased, '-inf', ARGV[1])) do
+    redis.call('ZREM', leased, id)
+    if tonumber(redis.call('HGET', attempts, id) or 0) >= tonumber(ARGV[4]) then
+        local url = cjson.decode(redis.call('HGET', tasks, id))[3]
+        redis.call('HSET', failed, id, cjson.encode({url, 'lease expired'}))
+    else
+        redis.call('LPUSH', pending, id)
+    end
+end
+local id = redis.call('LPOP', pending)
+if not id then
+    return nil
+end
+redis.call('ZADD', leased, ARGV[2], id)
+redis.call('HSET', workers, id, ARGV[3])
+redis.call('HINCRBY', attempts, id, 1)
+return {id, redis.call('HGET', tasks, id)}
+"""
+
+
+class RedisWorkQueue(WorkQueue):
+    """
+    Work queue in Redis, for workers on several machines. Pending page ids are a list, leased ones a sorted
+    set scored by lease expiry. Leases are taken by a Lua script, so a page is always either pending or
+    leased, even when its worker dies while leasing it. Removing an id from the sorted set is atomic, so only
+    one client reports a page
+    """
+
+    def __init__(self, url: str, prefix: str = "scraping"):
+        try:
+            import redis
+        except ImportError as e:
+            raise WorkQueueNotAvailable(f"redis: {e}")
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._lease_script = self.redis.register_script(LEASE_SCRIPT)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    def reset(self, job_spec: dict):
+        names = ("job", "next_id", "tasks", "pending", "leased", "workers", "attempts", "results", "failed")
+        self.redis.delete(*[self._key(name) for name in names])
+        self.redis.set(self._key("job"), json.dumps(job_spec))
+
+    def job_spec(self) -> dict:
+        spec = self.redis.get(self._key("job"))
+        if spec is None:
+            raise ValueError(f"{self.prefix} holds no crawl, plan one first")
+        return json.loads(spec)
+
+    def put(self, tasks: list):
+        first_id = self.redis.incrby(self._key("next_id"), len(tasks)) - len(tasks) + 1
+        pipe = self.redis.pipeline()
+        for task_id, (search, site, url, args, listings) in enumerate(tasks, first_id):
+            pipe.hset(self._key("tasks"), task_id, json.dumps([search, site, url, args]))
+            if listings is None:
+                pipe.rpush(self._key("pending"), task_id)
+            else:
+                pipe.hset(self._key("results"), task_id, encode_listings(listings))
+        pipe.execute()
+
+    def lease(self, worker: str, seconds: float = LEASE_SECONDS) -> Task:
+        now = time.time()
+        names = ("pending", "leased", "workers", "attempts", "tasks", "failed")
+        leased = self._lease_script(
+            keys=[self._key(name) for name in names], args=[now, now + seconds, worker, MAX_PAGE_ATTEMPTS]
+        )
+        if leased is None:
+            return None
+        task_id, task = leased
+        task = json.loads(task)
+        return Task(int(task_id), task[0], task[1], task[2], tuple(task[3]))
+
+    def _owns(self, task: Task, worker: str) -> bool:
+        if self.redis.hget(self._key("workers"), task.id) != worker:
+            return False
+        return bool(self.redis.zrem(self._key("leased"), task.id))
+
+    def _give_up(self, task_id, reason: str):
+        url = json.loads(self.redis.hget(self._key("tasks"), task_id))[2]
+        self.redis.hset(self._key("failed"), task_id, json.dumps([url, reason]))
+
+    def complete(self, task: Task, worker: str, listings: list):
+        if self._owns(task, worker):
+            self.redis.hset(self._key("results"), task.id, encode_listings(listings))
+
+    def fail(self, task: Task, worker: str, reason: str):
+        if not self._owns(task, worker):
+            return
+        if int(self.redis.hget(self._key("attempts"), task.id) or 0) >= MAX_PAGE_ATTEMPTS:
+            self._give_up(task.id, reason)
+        else:
+            self.redis.rpush(self._key("pending"), task.id)
+
+    def unfinished(self) -> int:
+        return self.redis.llen(self._key("pending")) + self.redis.zcard(self._key("leased"))
+
+    def results(self) -> list:
+        results = self.redis.hgetall(self._key("results"))
+        return [decode_listings(results[task_id]) for task_id in sorted(results, key=int)]
+
+    def failures(self) -> dict:
+        failed = self.redis.hgetall(self._key("failed"))
+        return dict(json.loads(failed[task_id]) for task_id in sorted(failed, key=int))
+
+    def close(self):
+        self.redis.close()
+
+
+def open_queue(url: str) -> WorkQueue:
+    """
+    sqlite:///<path> or redis://<host>:<port>/<db>
+    """
+    if url.startswith("sqlite:///"):
+        return SqliteWorkQueue(url[len("sqlite:///") :])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(url)
+    raise ValueError(f"unknown work queue: {url}, expected sqlite:///<path> or redis://<host>:<port>/<db>")
+
+
+def seed_listings(page, handler: callable) -> list:
+    """
+    Listings of a page read while planning, None for the pages left to the workers
+    """
+    if page.content is None:
+        return None
+    return handler(page.content, *page.args)
+
+
+async def plan(job, queue: WorkQueue) -> int:
+    """
+    Reads the first page of every search of the job and puts all their pages in the queue, alternating
+    searches so consecutive pages go to different hosts. First pages are parsed here, they are queued done.
+    Returns the number of pages planned
+    """
+    from scraping.fetch import Fetcher, create_session
+    from scraping.jobs import interleave_by_host, job_browser, job_to_dict, load_sites, page_parsers, plan_searches
+
+    sites = load_sites(job)
+    browser = job_browser(job)
+    try:
+        async with create_session(limit_per_host=job.max_connections_per_host) as session:
+            fetcher = Fetcher(
+                session,
+                concurrency=job.max_concurrent_requests,
+                per_host_concurrency=job.max_connections_per_host,
+                adaptive_rate=job.adaptive_rate,
+                browser=browser,
+            )
+            planned = await plan_searches(fetcher, sites, interleave_by_host(job.searches), job.parser_backend)
+    finally:
+        if browser is not None:
+            await browser.close()
+    handler, _ = page_parsers(job)
+    searches_pages = [
+        [(search.name, page.args[0], page.url, page.args[1:], seed_listings(page, handler)) for page in pages]
+        for search, pages, _ in planned
+    ]
+    tasks = [task for turn in itertools.zip_longest(*searches_pages) for task in turn if task is not None]
+    queue.reset(job_to_dict(job))
+    queue.put(tasks)
+    print(f"{len(tasks)} pages of {len(planned)} searches queued")
+    return len(tasks)
+
+
+async def process_task(fetcher, task: Task, handler: callable, executor: Executor) -> list:
+    """
+    Fetches the page of a task and parses it in a parser worker, so the other fetches of the worker go on
+    """
+    from scraping.fetch import FetchError
+    from scraping.pipeline import parse_page
+
+    response = await fetcher.get(task.url)
+    if not 200 <= response.status < 300:
+        raise FetchError(task.url, f"HTTP {response.status}")
+    loop = asyncio.get_running_loop()
+    listings, rejects, parse_seconds = await loop.run_in_executor(
+        executor, parse_page, handler, response.text, task.site, *task.args
+    )
+    fetcher.metrics.observe_parse(parse_seconds, len(listings), rejects)
+    return listings
+
+
+def worker_metrics_file(path: str, worker: str) -> str:
+    """
+    Metrics file of a worker, the job metrics file with the worker name appended
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}-{worker}{extension}"
+
+
+async def work(queue: WorkQueue, worker: str, concurrency: int = WORKER_CONCURRENCY):
+    """
+    Leases pages and processes them, `concurrency` at a time, until no page is pending or leased, and returns
+    the Metrics of the worker. Pages are parsed by `parser_workers` processes and the metrics are written
+    next to the job metrics
+    """
+    from scraping.fetch import FetchError, Fetcher, create_session, error_reason
+    from scraping.jobs import job_browser, job_from_dict, page_parsers
+    from scraping.metrics import Metrics
+
+    job = job_from_dict(queue.job_spec())
+    handler, _ = page_parsers(job)
+    metrics = Metrics()
+
+    async def process_pages(fetcher: Fetcher):
+        while True:
+            task = queue.lease(worker)
+            if task is None:
+                if not queue.unfinished():
+                    return
+                # pages leased by other workers come back if they die
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            try:
+                listings = await process_task(fetcher, task, handler, executor)
+            except Exception as e:
+                reason = e.reason if isinstance(e, FetchError) else error_reason(e)
+                print(f"[{worker}] {task.url}: {reason}")
+                queue.fail(task, worker, reason)
+                continue
+            queue.complete(task, worker, listings)
+            print(f"[{worker}] {task.search} page done, {len(listings)} listings")
+
+    browser = job_browser(job)
+    try:
+        with ProcessPoolExecutor(max_workers=job.parser_workers) as executor:
+            async with create_session(limit_per_host=job.max_connections_per_host) as session:
+                fetcher = Fetcher(
+                    session,
+                    concurrency=job.max_concurrent_requests,
+                    metrics=metrics,
+                    per_host_concurrency=job.max_connections_per_host,
+                    adaptive_rate=job.adaptive_rate,
+                    browser=browser,
+                )
+                await asyncio.gather(*[process_pages(fetcher) for _ in range(concurrency)])
+    finally:
+        if browser is not None:
+            await browser.close()
+    metrics_file = worker_metrics_file(job.metrics, worker)
+    metrics.dump_json(metrics_file)
+    print(f"[{worker}] {metrics.summary()}, metrics written to {metrics_file}")
+    return metrics
+
+
+def run_worker(queue_url: str, concurrency: int = WORKER_CONCURRENCY, worker: str = None):
+    """
+    Entry point of a worker process
+    """
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    queue = open_queue(queue_url)
+    try:
+        asyncio.run(work(queue, worker, concurrency))
+    finally:
+        queue.close()
+
+
+def run_workers(queue_url: str, processes: int, concurrency: int = WORKER_CONCURRENCY):
+    workers = [
+        # not daemonic, daemonic processes cannot start the parser workers
+        multiprocessing.Process(target=run_worker, args=(queue_url, concurrency))
+        for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+def collect(queue: WorkQueue):
+    """
+    Waits for the crawl to finish, then exports the listings of every page once and writes the statistics
+    """
+    from scraping.exporters import open_exporter
+    from scraping.history import record_run
+    from scraping.jobs import job_from_dict, job_stats, print_job_stats
+    from scraping.listing import ListingSink, UniqueListings
+    from scraping.stats import write_report
+
+    job = job_from_dict(queue.job_spec())
+    while True:
+        unfinished = queue.unfinished()
+        if not unfinished:
+            break
+        print(f"waiting for {unfinished} pages")
+        time.sleep(POLL_INTERVAL * 5)
+    sink = ListingSink()
+    exporters = [open_exporter(path) for path in job.export]
+    unique = UniqueListings([sink] + exporters)
+    try:
+        for listings in queue.results():
+            unique.add(listings)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    failures = queue.failures()
+    if failures:
+        print(f"{len(failures)} pages failed:")
+        for url, reason in failures.items():
+            print(f"  {url}: {reason}")
+    print(f"{len(unique)} listings exported to {', '.join(job.export)}, {unique.duplicates} duplicates skipped")
+    columns = sink.flush()
+    if job.history:
+        record_run(job.history, columns, name=job.name)
+    groups = job_stats(columns, job.deduplicate)
+    print_job_stats(groups)
+    write_report(job.stats, groups)
+    print(f"statistics written to {job.stats}")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m scraping.distributed", description="distributed crawls")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE, help="sqlite:///<path> or redis://<host>:<port>/<db>")
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan_parser = commands.add_parser("plan", help="queue the pages of a job spec, dropping the queued crawl")
+    plan_parser.add_argument("spec")
+    work_parser = commands.add_parser("work", help="process queued pages until there are none left")
+    work_parser.add_argument("--processes", type=int, default=1)
+    work_parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="pages per process")
+    commands.add_parser("collect", help="export the listings and statistics once every page is processed")
+    run_parser = commands.add_parser("run", help="plan, work and collect on this machine")
+    run_parser.add_argument("spec")
+    run_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    run_parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="pages per process")
+    run_parser.add_argument("--resume", action="store_true", help="keep the queued crawl if it has pages left")
+    args = parser.parse_args(argv)
+
+    # worker processes open their own connection, the queue is not held open while they start
+    if args.command in ("plan", "run"):
+        from scraping.jobs import load_job
+
+        queue = open_queue(args.queue)
+        try:
+            if args.command == "plan" or not (args.resume and queue.unfinished()):
+                asyncio.run(plan(load_job(args.spec), queue))
+        finally:
+            queue.close()
+    if args.command in ("work", "run"):
+        run_workers(args.queue, args.processes, args.concurrency)
+    if args.command in ("collect", "run"):
+        queue = open_queue(args.queue)
+        try:
+            collect(queue)
+        finally:
+            queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Streaming exporters: listings are written while the scrape runs, in batches, instead of all at the end.
+
+Every exporter buffers the listings it is given and writes them out every `batch_size` listings, so a run
+that crashes keeps what was exported until then. The format is picked from the file extension:
+.csv, .parquet (needs pyarrow) or .sqlite/.db.
+"""
+import csv
+import os
+import sqlite3
+import time
+
+EXPORT_BATCH_SIZE = 200
+
+
+class ExporterNotAvailable(Exception):
+    pass
+
+
+class Exporter:
+    """
+    Base exporter, subclasses implement write_batch(listings) and, when they hold resources, close()
+    """
+
+    def __init__(self, path: str, batch_size: int = EXPORT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.exported = 0
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, listings: list):
+        self._buffer.extend(listings)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.write_batch(self._buffer)
+            self.exported += len(self._buffer)
+            self._buffer = []
+
+    def write_batch(self, listings: list):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class CsvExporter(Exporter):
+    FIELDS = ["id", "price", "published_by_owner", "url"]
+
+    def __init__(self, path: str, batch_size: int = EXPORT_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.FIELDS)
+
+    def write_batch(self, listings: list):
+        self._writer.writerows(
+            (listing.id, listing.price, "true" if listing.is_owner else "false", listing.url) for listing in listings
+        )
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class SqliteExporter(Exporter):
+    """
+    Writes the listings of the run to a `listings` table, replacing the ones of the previous export
+    """
+
+    def __init__(self, path: str, batch_size: int = EXPORT_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        self.exported_at = time.time()
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS listings (
+                source TEXT NOT NULL,
+                id TEXT,
+                price REAL NOT NULL,
+                is_owner INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                exported_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute("DELETE FROM listings")
+        self.connection.commit()
+
+    def write_batch(self, listings: list):
+        self.connection.executemany(
+            "INSERT INTO listings VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (listing.source, listing.id, listing.price, listing.is_owner, listing.url, self.exported_at)
+                for listing in listings
+            ],
+        )
+        self.connection.commit()
+
+    def close(self):
+        super().close()
+        self.connection.close()
+
+
+class ParquetExporter(Exporter):
+    """
+    Every batch is written as a row group, the file is only readable once the exporter is closed
+    """
+
+    def __init__(self, path: str, batch_size: int = EXPORT_BATCH_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ExporterNotAvailable(f"parquet: {e}")
+        super().__init__(path, batch_size)
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema(
+            [
+                ("source", pyarrow.string()),
+                ("id", pyarrow.string()),
+                ("price", pyarrow.float64()),
+                ("is_owner", pyarrow.bool_()),
+                ("url", pyarrow.string()),
+            ]
+        )
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write_batch(self, listings: list):
+        columns = {name: [getattr(listing, name) for listing in listings] for name in self._schema.names}
+        self._writer.write_table(self._pyarrow.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        super().close()
+        self._writer.close()
+
+
+_EXPORTER_CLASSES = {
+    ".csv": CsvExporter,
+    ".parquet": ParquetExporter,
+    ".sqlite": SqliteExporter,
+    ".db": SqliteExporter,
+}
+
+
+def open_exporter(path: str, batch_size: int = EXPORT_BATCH_SIZE) -> Exporter:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in _EXPORTER_CLASSES:
+        raise ValueError(f"unknown export format: {path}, expected one of {', '.join(_EXPORTER_CLASSES)}")
+    return _EXPORTER_CLASSES[extension](path, batch_size)
@@ -0,0 +1,288 @@
+"""
+HTTP client layer shared by the scrapers: pooled keep-alive connections, per host limits and a cap
+on the number of requests in flight.
+
+Requests to each host are paced by an adaptive token bucket (see scraping.throttle). Timeouts, connection
+errors and 429/5xx responses are retried with exponential backoff and jitter, honoring Retry-After, and
+a FetchError is raised once the retries run out.
+
+Given a browser pool (see scraping.browser), pages whose response looks blocked, a 401/403/451 or a
+captcha or challenge page, are fetched again with a headless browser.
+"""
+import asyncio
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from scraping.metrics import Metrics
+from scraping.throttle import TokenBucket, backoff_delay, retry_after_seconds
+
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 10
+MAX_CONCURRENT_REQUESTS = 20
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# responses telling us to slow down, they cut the rate of the host
+THROTTLE_STATUSES = (429, 503)
+# what block and challenge pages answer, with any status
+BLOCKED_STATUSES = (401, 403, 451)
+BLOCKED_MARKERS = (
+    "captcha",
+    "cf-chl",
+    "challenge-platform",
+    "just a moment...",
+    "access denied",
+    "are you a robot",
+    "unusual traffic",
+)
+# only the head of a page is searched for markers, listings further down could mention any of them
+BLOCKED_MARKERS_SEARCH_SIZE = 4096
+
+FetchResponse = namedtuple("FetchResponse", ["status", "text", "headers"])
+
+
+class FetchError(Exception):
+    def __init__(self, url: str, reason: str):
+        super().__init__(f"{url}: {reason}")
+        self.url = url
+        self.reason = reason
+
+
+def error_reason(error: Exception) -> str:
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+
+def looks_blocked(status: int, text: str = None) -> bool:
+    """
+    Whether a response looks like the site refused to serve the page to a script, rather than a real error.
+    Without text only the status is looked at
+    """
+    if status in BLOCKED_STATUSES:
+        return True
+    if text is None or not 200 <= status < 300:
+        return False
+    if not text.strip():
+        return True
+    head = text[:BLOCKED_MARKERS_SEARCH_SIZE].lower()
+    return any(marker in head for marker in BLOCKED_MARKERS)
+
+
+class BufferedResponse:
+    """
+    Stands in for the aiohttp response Fetcher.stream yields when the page was not streamed but read whole
+    """
+
+    charset = "utf-8"
+
+    def __init__(self, response: FetchResponse):
+        self.status = response.status
+        self.headers = response.headers
+        self.body = response.text.encode(self.charset)
+        self.content = self
+
+    async def iter_chunked(self, size: int):
+        for start in range(0, len(self.body), size):
+            yield self.body[start : start + size]
+
+    def release(self):
+        pass
+
+
+def accepted_encodings() -> str:
+    """
+    Compressed encodings we can decode, brotli is only negotiated when a brotli package is installed
+    """
+    encodings = ["gzip", "deflate"]
+    for module in ("brotli", "brotlicffi"):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        encodings.append("br")
+        break
+    return ", ".join(encodings)
+
+
+def default_headers() -> dict:
+    return {"Accept-Encoding": accepted_encodings(), "Connection": "keep-alive"}
+
+
+def create_session(
+    limit: int = MAX_CONNECTIONS,
+    limit_per_host: int = MAX_CONNECTIONS_PER_HOST,
+    dns_cache_ttl: int = DNS_CACHE_TTL,
+    keepalive_timeout: int = KEEPALIVE_TIMEOUT,
+) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=dns_cache_ttl,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, headers=default_headers())
+
+
+class Fetcher:
+    """
+    Issues requests through a shared session, never more than `concurrency` at the same time, and
+    records their latency and size in `metrics`.
+
+    With per_host_concurrency each host also gets its own limit. A request first waits for a slot of its
+    host and only then for one of the shared ones, so a busy host never holds slots other hosts could use.
+    Without adaptive_rate requests are only limited by concurrency. With a browser, a BrowserPool, pages
+    that look blocked are fetched again with it
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        concurrency: int = MAX_CONCURRENT_REQUESTS,
+        metrics: Metrics = None,
+        per_host_concurrency: int = None,
+        adaptive_rate: bool = True,
+        max_retries: int = MAX_RETRIES,
+        timeout: float = REQUEST_TIMEOUT,
+        browser=None,
+    ):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.metrics = metrics or Metrics()
+        self.per_host_concurrency = per_host_concurrency
+        self.host_semaphores = {}
+        self.adaptive_rate = adaptive_rate
+        self.host_rates = {}
+        self.max_retries = max_retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.browser = browser
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        if self.per_host_concurrency is None:
+            async with self.semaphore:
+                yield
+            return
+        host = urlsplit(url).netloc
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        async with self.host_semaphores[host]:
+            async with self.semaphore:
+                yield
+
+    def host_rate(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        if host not in self.host_rates:
+            self.host_rates[host] = TokenBucket()
+        return self.host_rates[host]
+
+    async def fetch(self, url: str) -> str:
+        response = await self.get(url)
+        if not 200 <= response.status < 300:
+            raise FetchError(url, f"HTTP {response.status}")
+        return response.text
+
+    async def get(self, url: str, headers: dict = None) -> FetchResponse:
+        """
+        Returns the response once it is not one worth retrying, raises FetchError when the retries run out
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(url)
+            retry_after = None
+            try:
+                async with self.slot(url):
+                    start = time.perf_counter()
+                    async with self.session.get(url, headers=headers, timeout=self.timeout) as response:
+                        body = await response.read()
+                        seconds = time.perf_counter() - start
+                        self.metrics.observe_fetch(seconds, len(body))
+                        if response.status not in RETRY_STATUSES:
+                            self._succeeded(url, seconds)
+                            fetched = FetchResponse(response.status, await response.text(), response.headers)
+                            break
+                        reason = f"HTTP {response.status}"
+                        retry_after = self._failed(url, response.status, response.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = error_reason(e)
+                self._failed(url)
+            if attempt < self.max_retries:
+                await self._back_off(url, attempt, reason, retry_after)
+        else:
+            raise FetchError(url, reason)
+        if self.browser is not None and looks_blocked(fetched.status, fetched.text):
+            return await self._browser_get(url)
+        return fetched
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: dict = None):
+        """
+        Yields the response without reading its body, the concurrency slot is held until the block exits.
+        Reading the body is up to the caller so it is also up to it to record the fetch in metrics.
+        Responses are retried like in get until their body starts to be read. Only the status tells whether
+        a streamed page is blocked, the page fetched with the browser is yielded as a BufferedResponse
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(url)
+            retry_after = None
+            async with self.slot(url):
+                start = time.perf_counter()
+                try:
+                    response = await self.session.get(url, headers=headers, timeout=self.timeout)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    reason = error_reason(e)
+                    self._failed(url)
+                else:
+                    if self.browser is not None and looks_blocked(response.status):
+                        response.release()
+                        break
+                    if response.status not in RETRY_STATUSES:
+                        self._succeeded(url, time.perf_counter() - start)
+                        try:
+                            yield response
+                        finally:
+                            response.release()
+                        return
+                    reason = f"HTTP {response.status}"
+                    retry_after = self._failed(url, response.status, response.headers)
+                    response.release()
+            if attempt < self.max_retries:
+                await self._back_off(url, attempt, reason, retry_after)
+        else:
+            raise FetchError(url, reason)
+        # outside of the slot, the browser pool bounds its own pages
+        yield BufferedResponse(await self._browser_get(url))
+
+    async def _browser_get(self, url: str) -> FetchResponse:
+        print(f"{url}: looks blocked, fetching it with the browser")
+        start = time.perf_counter()
+        response = await self.browser.get(url)
+        self.metrics.observe_browser_page(time.perf_counter() - start, len(response.text))
+        return response
+
+    async def _wait_turn(self, url: str):
+        if self.adaptive_rate:
+            await self.host_rate(url).acquire()
+
+    def _succeeded(self, url: str, seconds: float):
+        if self.adaptive_rate:
+            self.host_rate(url).succeeded(seconds)
+
+    def _failed(self, url: str, status: int = None, headers: dict = None) -> float:
+        """
+        Slows the host down when the failure says it is overloaded, returns the Retry-After seconds if any
+        """
+        retry_after = retry_after_seconds(headers.get("Retry-After")) if headers is not None else None
+        if self.adaptive_rate and (status is None or status in THROTTLE_STATUSES):
+            self.host_rate(url).throttled(retry_after)
+        return retry_after
+
+    async def _back_off(self, url: str, attempt: int, reason: str, retry_after: float):
+        delay = max(retry_after or 0.0, backoff_delay(attempt))
+        self.metrics.observe_retry()
+        print(f"{url}: {reason}, retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
@@ -0,0 +1,154 @@
+"""
+Declarative listing filters.
+
+A ListingFilter is declared once per source (excluded keywords, accepted currency, price range) and its
+keywords are compiled into a single trie shaped regular expression. Scrapers hand it the cards of a whole
+page at once: titles are matched in one pass over the batch, prices are only extracted for the cards whose
+title passed, and every reject is counted per reason instead of printed.
+"""
+import bisect
+import hashlib
+import re
+from collections import Counter
+
+from scraping.metrics import reject
+
+EXCLUDED_KEYWORD = "excluded keyword"
+PRICE_ON_REQUEST = "price on request"
+OTHER_CURRENCY = "price not in ARS"
+PRICE_OUT_OF_RANGE = "price out of range"
+
+PRICE_REGEX = re.compile(r"(?P<currency>[^\d\s]+)?\s*(?P<amount>\d[\d.,]*)")
+# titles of a batch are joined with a character that cannot be part of a keyword
+TITLE_SEPARATOR = "\x00"
+
+_number_tables = {}
+
+
+def to_number(text: str, number_type: type = float, thousands_separator: str = ".", decimal_separator: str = ","):
+    """
+    Converts a localized amount such as "25.000,50" to a number
+    """
+    table = _number_tables.get((thousands_separator, decimal_separator))
+    if table is None:
+        table = str.maketrans({thousands_separator: None, decimal_separator: ".", " ": None})
+        _number_tables[(thousands_separator, decimal_separator)] = table
+    return number_type(text.translate(table))
+
+
+def parse_price(text: str, number_type: type = float) -> tuple:
+    """
+    Splits a price such as "$ 25.000" or "U$S 500" into (currency, amount), (None, None) when the text has
+    no amount, e.g. "Consultar precio"
+    """
+    match = PRICE_REGEX.search(text)
+    if match is None:
+        return None, None
+    return match.group("currency"), to_number(match.group("amount"), number_type)
+
+
+def keywords_pattern(keywords: tuple) -> str:
+    """
+    Regular expression matching any of the keywords, with common prefixes factored out so the regex engine
+    tries each prefix once. A keyword that extends another one is dropped: matching the shorter is enough
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        if "" in node:
+            return ""
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+class ListingFilter:
+    def __init__(self, exclude_keywords: tuple = (), currency: str = "$", min_price=None, max_price=None):
+        self.exclude_keywords = tuple(exclude_keywords)
+        self.currency = currency
+        self.min_price = min_price
+        self.max_price = max_price
+        keywords = tuple(keyword.lower() for keyword in self.exclude_keywords)
+        self.keywords_regex = re.compile(keywords_pattern(keywords)) if keywords else None
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "ListingFilter":
+        return cls(**spec)
+
+    def to_dict(self) -> dict:
+        return {
+            "exclude_keywords": list(self.exclude_keywords),
+            "currency": self.currency,
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+        }
+
+    def fingerprint(self) -> str:
+        """
+        Short digest of the filter, meant for cache namespaces so listings filtered differently are not reused
+        """
+        return hashlib.sha1(repr(sorted(self.to_dict().items())).encode("utf-8")).hexdigest()[:8]
+
+    def excluded(self, titles: list) -> list:
+        """
+        Returns for every title whether it contains an excluded keyword, ignoring case. All the titles are
+        searched in one pass that skips to the next title as soon as one matches
+        """
+        flags = [False] * len(titles)
+        if self.keywords_regex is None or not titles:
+            return flags
+        titles = [title.lower() for title in titles]
+        starts = []
+        offset = 0
+        for title in titles:
+            starts.append(offset)
+            offset += len(title) + len(TITLE_SEPARATOR)
+        text = TITLE_SEPARATOR.join(titles)
+        match = self.keywords_regex.search(text)
+        while match is not None:
+            index = bisect.bisect_right(starts, match.start()) - 1
+            flags[index] = True
+            if index + 1 == len(starts):
+                break
+            match = self.keywords_regex.search(text, starts[index + 1])
+        return flags
+
+    def price_reason(self, currency: str, price) -> str:
+        """
+        Reject reason of a price, None when it is acceptable
+        """
+        if price is None:
+            return PRICE_ON_REQUEST
+        if currency != self.currency:
+            return OTHER_CURRENCY
+        if (self.min_price is not None and price < self.min_price) or (
+            self.max_price is not None and price > self.max_price
+        ):
+            return PRICE_OUT_OF_RANGE
+        return None
+
+    def apply(self, cards: list, titles: list, price_of: callable, rejects: Counter = None) -> list:
+        """
+        Returns (card, price) for the cards that pass the filter. price_of(card) must return (currency, price)
+        and is only called for the cards whose title passed. Rejects are counted in `rejects`, by default in
+        the metrics of this process
+        """
+        accepted = []
+        for card, has_keyword in zip(cards, self.excluded(titles)):
+            reason = EXCLUDED_KEYWORD if has_keyword else None
+            if reason is None:
+                currency, price = price_of(card)
+                reason = self.price_reason(currency, price)
+            if reason is None:
+                accepted.append((card, price))
+            elif rejects is None:
+                reject(reason)
+            else:
+                rejects[reason] += 1
+        return accepted
@@ -0,0 +1,200 @@
+"""
+Price history across runs.
+
+Every run appends the listings it exported to a SQLite store: the raw observations of each run, the last
+price of every listing on each day and daily price statistics per source, for all listings, owners and
+agencies. A run only recomputes the statistics of its own day, from that day's listings, so trend queries
+read one row per day however many runs are stored.
+
+    python -m scraping.history trend lavoz --segment owners --since 2024-01-01
+    python -m scraping.history listing MLA100000301
+"""
+import argparse
+import datetime
+import sqlite3
+import time
+from collections import namedtuple
+
+HISTORY_FILE = "price-history.sqlite"
+PERCENTILES = (10, 25, 75, 90)
+# segment: is_owner of its listings, None for all of them
+SEGMENTS = {"all": None, "owners": True, "agencies": False}
+STATS_FIELDS = ["count", "min", "max", "mean", "median"] + [f"p{percentile}" for percentile in PERCENTILES]
+
+DailyStats = namedtuple("DailyStats", ["day", "source", "segment"] + STATS_FIELDS)
+
+
+class HistoryStore:
+    def __init__(self, path: str = HISTORY_FILE):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                day TEXT NOT NULL,
+                finished_at REAL NOT NULL,
+                listings INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS observations (
+                run_id INTEGER NOT NULL REFERENCES runs (id),
+                day TEXT NOT NULL,
+                source TEXT NOT NULL,
+                id TEXT,
+                url TEXT NOT NULL,
+                price NUMERIC NOT NULL,
+                is_owner INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS observations_id_day ON observations (id, day);
+            CREATE INDEX IF NOT EXISTS observations_day ON observations (day, source);
+            -- last price of every listing on each day, what the daily statistics are computed from
+            CREATE TABLE IF NOT EXISTS day_listings (
+                day TEXT NOT NULL,
+                source TEXT NOT NULL,
+                listing TEXT NOT NULL,
+                price NUMERIC NOT NULL,
+                is_owner INTEGER NOT NULL,
+                PRIMARY KEY (day, source, listing)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                source TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                day TEXT NOT NULL,
+                {", ".join(f"{field} NUMERIC NOT NULL" for field in STATS_FIELDS)},
+                PRIMARY KEY (source, segment, day)
+            ) WITHOUT ROWID;
+            """
+        )
+        self.connection.commit()
+
+    def append(self, columns: dict, name: str = None, day: str = None) -> int:
+        """
+        Stores the listing columns of a ListingSink.flush as a run of `day`, today by default, and updates
+        the statistics of that day. Returns the id of the run
+        """
+        day = day or datetime.date.today().isoformat()
+        rows = list(zip(*(columns[field] for field in ("source", "id", "price", "is_owner", "url"))))
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (name, day, finished_at, listings) VALUES (?, ?, ?, ?)",
+                (name, day, time.time(), len(rows)),
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, day, source, listing_id, url, price, is_owner)
+                    for source, listing_id, price, is_owner, url in rows
+                ],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO day_listings VALUES (?, ?, ?, ?, ?)",
+                [
+                    (day, source, listing_id or url, price, is_owner)
+                    for source, listing_id, price, is_owner, url in rows
+                ],
+            )
+            for source in sorted(set(columns["source"])):
+                self._update_daily_stats(day, source)
+        return run_id
+
+    def _update_daily_stats(self, day: str, source: str):
+        # numpy is only loaded by runs that record their listings
+        from scraping.stats import group_stats, listings_array
+
+        rows = self.connection.execute(
+            "SELECT listing, price, is_owner FROM day_listings WHERE day = ? AND source = ?", (day, source)
+        ).fetchall()
+        listings = listings_array(
+            {
+                "id": [row[0] for row in rows],
+                "price": [row[1] for row in rows],
+                "is_owner": [bool(row[2]) for row in rows],
+                "source": [source] * len(rows),
+            }
+        )
+        everyone = group_stats(listings, percentiles=PERCENTILES)
+        by_owner = group_stats(listings, by="is_owner", percentiles=PERCENTILES)
+        self.connection.execute("DELETE FROM daily_stats WHERE source = ? AND day = ?", (source, day))
+        for segment, is_owner in SEGMENTS.items():
+            stats = everyone.get(None) if is_owner is None else by_owner.get(is_owner)
+            if stats is None:
+                continue
+            values = [stats.count, stats.min, stats.max, stats.mean, stats.median]
+            values += [stats.percentiles[percentile] for percentile in PERCENTILES]
+            self.connection.execute(
+                f"INSERT INTO daily_stats VALUES ({', '.join('?' * (3 + len(STATS_FIELDS)))})",
+                [source, segment, day] + values,
+            )
+
+    def trend(self, source: str, segment: str = "all", since: str = None, until: str = None) -> list:
+        """
+        DailyStats of every day between since and until, both included, oldest first
+        """
+        rows = self.connection.execute(
+            f"""
+            SELECT day, source, segment, {", ".join(STATS_FIELDS)} FROM daily_stats
+            WHERE source = ? AND segment = ? AND day BETWEEN ? AND ? ORDER BY day
+            """,
+            (source, segment, since or "", until or "9999-12-31"),
+        )
+        return [DailyStats(*row) for row in rows]
+
+    def listing_prices(self, listing_id: str) -> list:
+        """
+        (day, source, min price, max price) of every day a listing was seen, oldest first
+        """
+        return self.connection.execute(
+            """
+            SELECT day, source, MIN(price), MAX(price) FROM observations
+            WHERE id = ? GROUP BY day, source ORDER BY day
+            """,
+            (listing_id,),
+        ).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def record_run(path: str, columns: dict, name: str = None):
+    store = HistoryStore(path)
+    try:
+        store.append(columns, name=name)
+    finally:
+        store.close()
+    print(f"{len(columns['id'])} listings added to the price history in {path}")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m scraping.history", description="price history across runs")
+    parser.add_argument("--file", default=HISTORY_FILE, help="history store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trend_parser = commands.add_parser("trend", help="daily price statistics of a site")
+    trend_parser.add_argument("source", help="site, e.g. lavoz")
+    trend_parser.add_argument("--segment", choices=list(SEGMENTS), default="all")
+    trend_parser.add_argument("--since", help="first day, YYYY-MM-DD")
+    trend_parser.add_argument("--until", help="last day, YYYY-MM-DD")
+    listing_parser = commands.add_parser("listing", help="prices of a listing over time")
+    listing_parser.add_argument("id")
+    args = parser.parse_args(argv)
+    from prettytable import PrettyTable
+
+    store = HistoryStore(args.file)
+    try:
+        table = PrettyTable()
+        if args.command == "trend":
+            table.field_names = ["day"] + STATS_FIELDS
+            for stats in store.trend(args.source, args.segment, args.since, args.until):
+                table.add_row([stats.day, stats.count, stats.min, stats.max, round(stats.mean)] + list(stats[7:]))
+        else:
+            table.field_names = ["day", "site", "min price", "max price"]
+            for row in store.listing_prices(args.id):
+                table.add_row(list(row))
+        for field in table.field_names[1:]:
+            table.align[field] = "r"
+        print(table)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Persistent index of the listings seen by previous runs, used by the incremental mode to stop
+paginating early and to report only what changed.
+"""
+
+import csv
+import sqlite3
+import time
+from collections import namedtuple
+
+SEEN_INDEX_FILE = "seen-listings.sqlite"
+NEW = "new"
+PRICE_CHANGED = "price changed"
+REMOVED = "removed"
+
+Change = namedtuple("Change", ["kind", "id", "price", "previous_price", "is_owner", "url"])
+
+
+class SeenIndex:
+    """
+    Listings are indexed per scope (usually one per search) so a listing missing from a fully scanned
+    search can be reported as removed
+    """
+
+    def __init__(self, path: str = SEEN_INDEX_FILE):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS seen (
+                scope TEXT NOT NULL,
+                id TEXT NOT NULL,
+                price REAL NOT NULL,
+                is_owner INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (scope, id)
+            )
+            """
+        )
+        self.connection.commit()
+
+    def known(self, scope: str) -> dict:
+        """
+        Returns {listing_id: price} for every listing indexed in the scope
+        """
+        return dict(self.connection.execute("SELECT id, price FROM seen WHERE scope = ?", (scope,)))
+
+    def update(self, scope: str, listings: list, complete: bool) -> list:
+        """
+        Indexes the listings found by a run and returns what changed since the previous one, listings
+        are only reported as removed when the whole search was scanned (complete)
+        """
+        now = time.time()
+        known = self.known(scope)
+        changes = []
+        seen_ids = set()
+        for listing in listings:
+            listing_id = listing.id
+            if listing_id is None or listing_id in seen_ids:
+                continue
+            seen_ids.add(listing_id)
+            previous_price = known.get(listing_id)
+            if previous_price is None:
+                changes.append(Change(NEW, listing_id, listing.price, None, listing.is_owner, listing.url))
+            elif previous_price != listing.price:
+                changes.append(
+                    Change(PRICE_CHANGED, listing_id, listing.price, previous_price, listing.is_owner, listing.url)
+                )
+            self.connection.execute(
+                """
+                INSERT INTO seen VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (scope, id) DO UPDATE SET price = excluded.price, url = excluded.url,
+                    last_seen = excluded.last_seen
+                """,
+                (scope, listing_id, listing.price, listing.is_owner, listing.url, now, now),
+            )
+        if complete:
+            removed_ids = [listing_id for listing_id in known if listing_id not in seen_ids]
+            for listing_id in removed_ids:
+                is_owner, url = self.connection.execute(
+                    "SELECT is_owner, url FROM seen WHERE scope = ? AND id = ?", (scope, listing_id)
+                ).fetchone()
+                changes.append(Change(REMOVED, listing_id, None, known[listing_id], bool(is_owner), url))
+            self.connection.executemany(
+                "DELETE FROM seen WHERE scope = ? AND id = ?", [(scope, listing_id) for listing_id in removed_ids]
+            )
+        self.connection.commit()
+        return changes
+
+    def close(self):
+        self.connection.close()
+
+
+def known_fraction(page_listings: list, known: dict) -> float:
+    ids = [listing.id for listing in page_listings if listing.id is not None]
+    if not ids:
+        return 0.0
+    return sum(1 for listing_id in ids if listing_id in known) / len(ids)
+
+
+def print_changes_and_generate_csv(changes: list, csv_file_name: str):
+    print("\n===============================================")
+    for kind in (NEW, PRICE_CHANGED, REMOVED):
+        print(f"{kind}: {sum(1 for change in changes if change.kind == kind)}")
+    print("\nExporting changes to CSV... ")
+    with open(csv_file_name, "w") as csvfile:
+        fieldnames = ["change", "id", "price", "previous_price", "published_by_owner", "url"]
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        for change in changes:
+            writer.writerow(
+                {
+                    "change": change.kind,
+                    "id": change.id,
+                    "price": change.price,
+                    "previous_price": change.previous_price,
+                    "published_by_owner": "true" if change.is_owner else "false",
+                    "url": change.url,
+                }
+            )
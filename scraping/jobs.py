@@ -0,0 +1,343 @@
+"""
+Scrape jobs: many searches, of any of the sites, run by one scheduler.
+
+A job spec is a JSON file, or YAML when PyYAML is installed, such as:
+
+    {
+        "name": "cordoba-1-bedroom",
+        "searches": [
+            {"site": "lavoz", "url": "https://clasificados.lavoz.com.ar/inmuebles/departamentos/..."},
+            {"site": "mercadolibre", "url": "https://inmuebles.mercadolibre.com.ar/departamentos/.../{}_NoIndex_True"}
+        ],
+        "filters": {"lavoz": {"exclude_keywords": ["temporal"], "currency": "$", "max_price": 30000}}
+    }
+
+Every search goes through one session, so one connection pool, and one Fetcher limiting the requests in
+flight per host: pages of different hosts are fetched side by side and a slow host only delays its own
+searches. Searches are started alternating hosts, and listings found by more than one search are exported
+and counted once.
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from scraping import pipeline
+from scraping.browser import BROWSER_POOL_SIZE, BrowserPool
+from scraping.cache import CACHE_FILE, ResponseCache
+from scraping.exporters import open_exporter
+from scraping.fetch import MAX_CONCURRENT_REQUESTS, MAX_CONNECTIONS_PER_HOST, Fetcher, create_session
+from scraping.filters import ListingFilter
+from scraping.history import HISTORY_FILE, record_run
+from scraping.listing import ListingSink, UniqueListings
+from scraping.metrics import Metrics
+from scraping.parsers import get_backend
+from scraping.sites import SCRIPTS, load_site
+
+Search = namedtuple("Search", ["site", "url", "name"])
+Job = namedtuple(
+    "Job",
+    [
+        "name",
+        "searches",
+        "export",
+        "stats",
+        "metrics",
+        "cache",
+        "filters",
+        "max_concurrent_requests",
+        "max_connections_per_host",
+        "parser_workers",
+        "streaming",
+        "adaptive_rate",
+        "browser_fallback",
+        "browser_pool_size",
+        "history",
+        "deduplicate",
+        "parser_backend",
+    ],
+)
+
+JOB_DEFAULTS = {
+    "cache": CACHE_FILE,
+    "filters": {},
+    "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+    "max_connections_per_host": MAX_CONNECTIONS_PER_HOST,
+    "parser_workers": pipeline.PARSER_WORKERS,
+    "streaming": False,
+    "adaptive_rate": True,
+    "browser_fallback": False,
+    "browser_pool_size": BROWSER_POOL_SIZE,
+    "history": HISTORY_FILE,
+    "deduplicate": True,
+    "parser_backend": None,
+}
+
+
+def job_from_dict(spec: dict, default_name: str = "job") -> Job:
+    """
+    Validates a job spec, outputs default to files named after the job
+    """
+    unknown = set(spec) - set(Job._fields)
+    if unknown:
+        raise ValueError(f"unknown job settings: {', '.join(sorted(unknown))}")
+    name = spec.get("name", default_name)
+    searches = []
+    for i, search in enumerate(spec.get("searches") or []):
+        if search.get("site") not in SCRIPTS:
+            raise ValueError(f"search {i}: unknown site {search.get('site')}, expected one of {', '.join(SCRIPTS)}")
+        if not search.get("url"):
+            raise ValueError(f"search {i}: missing url")
+        searches.append(Search(search["site"], search["url"], search.get("name", f"{search['site']}.{i}")))
+    if not searches:
+        raise ValueError(f"job {name} has no searches")
+    for site in spec.get("filters", {}):
+        if site not in SCRIPTS:
+            raise ValueError(f"filters: unknown site {site}, expected one of {', '.join(SCRIPTS)}")
+    settings = dict(JOB_DEFAULTS)
+    settings.update(spec)
+    settings.update(
+        name=name,
+        searches=searches,
+        export=spec.get("export", [f"{name}.csv"]),
+        stats=spec.get("stats", f"{name}-stats.json"),
+        metrics=spec.get("metrics", f"{name}-metrics.json"),
+    )
+    return Job(**settings)
+
+
+def job_to_dict(job: Job) -> dict:
+    spec = job._asdict()
+    spec["searches"] = [search._asdict() for search in job.searches]
+    return spec
+
+
+def load_job(path: str) -> Job:
+    with open(path) as spec_file:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as e:
+                raise ValueError(f"{path}: YAML job specs need PyYAML ({e})")
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+    return job_from_dict(spec, default_name=os.path.splitext(os.path.basename(path))[0])
+
+
+def interleave_by_host(searches: list) -> list:
+    """
+    Orders searches taking one of each host in turn, keeping the order of the searches of a host
+    """
+    by_host = {}
+    for search in searches:
+        by_host.setdefault(urlsplit(search.url).netloc, []).append(search)
+    return [search for turn in itertools.zip_longest(*by_host.values()) for search in turn if search is not None]
+
+
+def load_sites(job: Job) -> dict:
+    """
+    Loads the scrapers of the sites the job searches. Their settings are left alone, the job filters and
+    parser backend are handed to them with every page (see page_parsers)
+    """
+    return {site: load_site(site) for site in sorted({search.site for search in job.searches})}
+
+
+def job_filters(job: Job) -> dict:
+    """
+    {site: ListingFilter} of the sites whose filter the job replaces
+    """
+    return {site: ListingFilter.from_dict(spec) for site, spec in job.filters.items()}
+
+
+def cache_namespace(job: Job, sites: dict) -> str:
+    """
+    Response cache namespace of the job, the one of every site with the fingerprint of its filter in place of
+    the fingerprint of the site filter when the job replaces it
+    """
+    filters = job_filters(job)
+    namespaces = []
+    for site, module in sorted(sites.items()):
+        namespace = module.RESPONSE_CACHE_NAMESPACE
+        if site in filters:
+            namespace = namespace.replace(module.LISTING_FILTER.fingerprint(), filters[site].fingerprint())
+        namespaces.append(namespace)
+    return "+".join(namespaces)
+
+
+def job_browser(job: Job) -> BrowserPool:
+    return BrowserPool(job.browser_pool_size) if job.browser_fallback else None
+
+
+def page_parsers(job: Job) -> tuple:
+    """
+    (handler, stream_factory) parsing the pages of a job with its filters and parser backend, for
+    pipeline.run. The handler is sent to the parser workers with every page, it holds all they need
+    """
+    filters = job_filters(job)
+    return (
+        functools.partial(parse_site_page, filters=filters, parser_backend=job.parser_backend),
+        functools.partial(site_page_stream, filters=filters, parser_backend=job.parser_backend),
+    )
+
+
+def parse_site_page(content: str, site: str, *args, filters: dict = None, parser_backend: str = None) -> list:
+    """
+    Runs in a parser worker process, the args of job pages start with the site of the page
+    """
+    return load_site(site).parse_page_content(
+        content, *args, listing_filter=(filters or {}).get(site), parser_backend=parser_backend
+    )
+
+
+def site_page_stream(site: str, *args, filters: dict = None, parser_backend: str = None):
+    backend = get_backend(parser_backend) if parser_backend else None
+    return load_site(site).PageContentStream(*args, backend=backend, listing_filter=(filters or {}).get(site))
+
+
+async def plan_searches(fetcher: Fetcher, sites: dict, searches: list, parser_backend: str = None) -> list:
+    """
+    Returns (search, pages, total_number_of_apartments) for every search whose first page could be read,
+    the args of job pages start with the site of the page
+    """
+    print(f"getting pages of {len(searches)} searches")
+    plans = await asyncio.gather(
+        *[sites[search.site].plan_search(fetcher, search.url, parser_backend=parser_backend) for search in searches],
+        return_exceptions=True,
+    )
+    planned = []
+    for search, plan in zip(searches, plans):
+        if isinstance(plan, BaseException):
+            print(f"[{search.name}] skipped, its first page could not be read: {plan!r}")
+            fetcher.metrics.observe_failure(search.url, repr(plan))
+            continue
+        pages, total = plan
+        planned.append(
+            (search, [pipeline.Page(url, (search.site,) + args, *rest) for url, args, *rest in pages], total)
+        )
+    return planned
+
+
+async def crawl_job(job: Job, sinks: list, metrics: Metrics) -> list:
+    """
+    Fetches and parses the pages of every search of a job, handing the listings of each page to sinks as
+    soon as it is parsed. Returns (search, pages, total_number_of_apartments, SearchResult) of every search
+    whose first page could be read
+    """
+    sites = load_sites(job)
+    searches = interleave_by_host(job.searches)
+    cache = ResponseCache(cache_namespace(job, sites), job.cache) if job.cache else None
+    handler, stream_factory = page_parsers(job)
+    browser = job_browser(job)
+    try:
+        async with create_session(limit_per_host=job.max_connections_per_host) as session:
+            fetcher = Fetcher(
+                session,
+                concurrency=job.max_concurrent_requests,
+                metrics=metrics,
+                per_host_concurrency=job.max_connections_per_host,
+                adaptive_rate=job.adaptive_rate,
+                browser=browser,
+            )
+            planned = await plan_searches(fetcher, sites, searches, job.parser_backend)
+            results = await pipeline.run(
+                fetcher,
+                [pages for _, pages, _ in planned],
+                handler=handler,
+                stream_factory=stream_factory if job.streaming else None,
+                parser_workers=job.parser_workers,
+                cache=cache,
+                sinks=sinks,
+                keep_listings=False,
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+        if browser is not None:
+            await browser.close()
+    return [(search, pages, total, result) for (search, pages, total), result in zip(planned, results)]
+
+
+async def run_job(job: Job):
+    # numpy and prettytable are only needed once the job is done, crawl_job callers do not load them
+    from prettytable import PrettyTable
+
+    from scraping.stats import write_report
+
+    start_time = time.time()
+    sink = ListingSink()
+    exporters = [open_exporter(path) for path in job.export]
+    unique = UniqueListings([sink] + exporters)
+    metrics = Metrics()
+    try:
+        searches = await crawl_job(job, [unique], metrics)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    metrics.dump_json(job.metrics)
+    print(metrics.summary())
+    print(f"job {job.name} finished in {round((time.time() - start_time) / 60, 2)} minutes")
+
+    searches_table = PrettyTable()
+    searches_table.field_names = ["search", "site", "apartments", "pages scanned"]
+    for search, pages, total, result in searches:
+        searches_table.add_row([search.name, search.site, total, f"{result.pages_scanned}/{len(pages)}"])
+    print(searches_table)
+    print(f"{len(unique)} listings exported to {', '.join(job.export)}, {unique.duplicates} duplicates skipped")
+    columns = sink.flush()
+    if job.history:
+        record_run(job.history, columns, name=job.name)
+    groups = job_stats(columns, job.deduplicate)
+    print_job_stats(groups)
+    write_report(job.stats, groups)
+    print(f"statistics written to {job.stats}")
+
+
+def job_stats(columns: dict, deduplicate: bool = True) -> dict:
+    """
+    {label: GroupStats} of every site, and of its owners and agencies, for the listing columns of a job.
+    With deduplicate every apartment counts once, in the site and group it was found first
+    """
+    from scraping.dedup import drop_duplicates
+    from scraping.stats import group_stats, listings_array
+
+    if deduplicate:
+        columns, duplicates = drop_duplicates(columns)
+        print(f"{duplicates} listings of apartments already listed left out of the statistics")
+    listings = listings_array(columns)
+    groups = {}
+    for source, stats in group_stats(listings, by="source").items():
+        groups[source] = stats
+        by_owner = group_stats(listings[listings["source"] == source], by="is_owner")
+        for is_owner, label in ((True, "owners"), (False, "agencies")):
+            if is_owner in by_owner:
+                groups[f"{source} {label}"] = by_owner[is_owner]
+    return groups
+
+
+def print_job_stats(groups: dict):
+    from prettytable import PrettyTable
+
+    stats_table = PrettyTable()
+    stats_table.field_names = ["group", "apartments", "min price", "max price", "avg price", "median price"]
+    for field in stats_table.field_names[1:]:
+        stats_table.align[field] = "r"
+    for label, stats in groups.items():
+        stats_table.add_row([label, stats.count, stats.min, stats.max, round(stats.mean), stats.median])
+    print(stats_table)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m scraping.jobs", description="runs the searches of a job spec")
+    parser.add_argument("spec", help="job spec, a .json file or a .yaml one when PyYAML is installed")
+    args = parser.parse_args(argv)
+    asyncio.run(run_job(load_job(args.spec)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Listing record shared by the scrapers and the sink collecting them during a run.
+"""
+import sys
+import threading
+
+FIELDS = ("source", "id", "price", "is_owner", "url", "title")
+
+
+class Listing:
+    """
+    A valid listing. Slots keep it a fraction of the size of a dict and the source is interned so all the
+    listings of a site share one string, also after being unpickled from a parser worker
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, source: str, id: str, price, is_owner: bool, url: str, title: str = None):
+        self.source = sys.intern(source)
+        self.id = id
+        self.price = price
+        self.is_owner = bool(is_owner)
+        self.url = url
+        self.title = title
+
+    def __reduce__(self):
+        return Listing, self.to_tuple()
+
+    def __repr__(self) -> str:
+        return f"Listing({', '.join(repr(value) for value in self.to_tuple())})"
+
+    def to_tuple(self) -> tuple:
+        return self.source, self.id, self.price, self.is_owner, self.url, self.title
+
+
+class ListingSink:
+    """
+    Collects the listings of a run into one column per field. It can be fed from several threads or tasks,
+    parser worker processes send their listings back to the process owning the sink
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = {field: [] for field in FIELDS}
+
+    def __len__(self) -> int:
+        return len(self._columns["id"])
+
+    def add(self, listings: list):
+        with self._lock:
+            for field in FIELDS:
+                self._columns[field].extend(getattr(listing, field) for listing in listings)
+
+    def flush(self) -> dict:
+        """
+        Returns {field: values} with the listings collected so far and starts collecting new ones
+        """
+        with self._lock:
+            columns, self._columns = self._columns, {field: [] for field in FIELDS}
+        return columns
+
+
+class UniqueListings:
+    """
+    Sink passing every listing on to `sinks` only the first time it is seen, for searches that overlap.
+    Listings are told apart by source and id, or by url when they have no id
+    """
+
+    def __init__(self, sinks: list):
+        self.sinks = list(sinks)
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self._seen = set()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def add(self, listings: list):
+        unique = []
+        with self._lock:
+            for listing in listings:
+                key = (listing.source, listing.id or listing.url)
+                if key in self._seen:
+                    self.duplicates += 1
+                    continue
+                self._seen.add(key)
+                unique.append(listing)
+        for sink in self.sinks:
+            sink.add(unique)
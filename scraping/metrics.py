@@ -0,0 +1,192 @@
+"""
+Pipeline instrumentation: fetch latency, bytes downloaded, parse time, throughput, queue depth, retries,
+pages fetched with the browser, pages that failed and rejected listings per reason.
+
+Everything is kept in a Metrics object that can be dumped as JSON at the end of a run or scraped in
+Prometheus text format from a local endpoint while it runs.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import Counter
+
+from aiohttp import web
+
+PERCENTILES = (50, 95, 99)
+QUEUE_SAMPLING_INTERVAL = 0.5
+
+# rejects counted by the process parsing the listings, parser workers send theirs back with each page
+_rejects = Counter()
+
+
+def reject(reason: str):
+    _rejects[reason] += 1
+
+
+def take_rejects() -> Counter:
+    rejects = Counter(_rejects)
+    _rejects.clear()
+    return rejects
+
+
+class Histogram:
+    def __init__(self):
+        self.samples = []
+
+    def observe(self, value: float):
+        self.samples.append(value)
+
+    def percentile(self, percentile: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = max(math.ceil(percentile / 100 * len(ordered)) - 1, 0)
+        return ordered[rank]
+
+    def to_dict(self) -> dict:
+        summary = {"count": len(self.samples), "sum": sum(self.samples)}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile}"] = self.percentile(percentile)
+        return summary
+
+
+class Metrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.fetch_latency = Histogram()
+        self.parse_time = Histogram()
+        self.bytes_downloaded = 0
+        self.pages_fetched = 0
+        self.pages_parsed = 0
+        self.pages_from_cache = 0
+        self.listings = 0
+        self.rejects = Counter()
+        self.queue_depth = []
+        self.retries = 0
+        self.browser_latency = Histogram()
+        # {url: reason} of the pages given up on
+        self.failed_pages = {}
+
+    def observe_fetch(self, seconds: float, size: int):
+        self.fetch_latency.observe(seconds)
+        self.bytes_downloaded += size
+        self.pages_fetched += 1
+
+    def observe_parse(self, seconds: float, listings: int, rejects: Counter):
+        self.parse_time.observe(seconds)
+        self.pages_parsed += 1
+        self.listings += listings
+        self.rejects.update(rejects)
+
+    def observe_cached_page(self, listings: int):
+        self.pages_from_cache += 1
+        self.listings += listings
+
+    def observe_retry(self):
+        self.retries += 1
+
+    def observe_browser_page(self, seconds: float, size: int):
+        self.browser_latency.observe(seconds)
+        self.bytes_downloaded += size
+
+    def observe_failure(self, url: str, reason: str):
+        self.failed_pages[url] = reason
+
+    def observe_queue_depth(self, depth: int):
+        self.queue_depth.append((round(time.time() - self.started_at, 3), depth))
+
+    async def sample_queue_depth(self, queue: asyncio.Queue, interval: float = QUEUE_SAMPLING_INTERVAL):
+        while True:
+            self.observe_queue_depth(queue.qsize())
+            await asyncio.sleep(interval)
+
+    def to_dict(self) -> dict:
+        elapsed = time.time() - self.started_at
+        return {
+            "elapsed_seconds": elapsed,
+            "fetch_latency_seconds": self.fetch_latency.to_dict(),
+            "parse_seconds": self.parse_time.to_dict(),
+            "bytes_downloaded": self.bytes_downloaded,
+            "pages_fetched": self.pages_fetched,
+            "pages_parsed": self.pages_parsed,
+            "pages_from_cache": self.pages_from_cache,
+            "listings": self.listings,
+            "listings_per_second": self.listings / elapsed if elapsed else 0.0,
+            "pages_per_second": (self.pages_parsed + self.pages_from_cache) / elapsed if elapsed else 0.0,
+            "rejects": dict(self.rejects),
+            "queue_depth": self.queue_depth,
+            "retries": self.retries,
+            "browser_latency_seconds": self.browser_latency.to_dict(),
+            "failed_pages": [{"url": url, "reason": reason} for url, reason in self.failed_pages.items()],
+        }
+
+    def dump_json(self, path: str):
+        with open(path, "w") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+    def to_prometheus(self, prefix: str = "scraper") -> str:
+        snapshot = self.to_dict()
+        lines = []
+        histograms = (
+            ("fetch_latency_seconds", self.fetch_latency),
+            ("parse_seconds", self.parse_time),
+            ("browser_latency_seconds", self.browser_latency),
+        )
+        for name, histogram in histograms:
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            for percentile in PERCENTILES:
+                lines.append(f'{prefix}_{name}{{quantile="{percentile / 100}"}} {histogram.percentile(percentile)}')
+            lines.append(f"{prefix}_{name}_sum {sum(histogram.samples)}")
+            lines.append(f"{prefix}_{name}_count {len(histogram.samples)}")
+        for name in ("bytes_downloaded", "pages_fetched", "pages_parsed", "pages_from_cache", "listings"):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {snapshot[name]}")
+        lines.append(f"# TYPE {prefix}_retries_total counter")
+        lines.append(f"{prefix}_retries_total {self.retries}")
+        lines.append(f"# TYPE {prefix}_failed_pages_total counter")
+        lines.append(f"{prefix}_failed_pages_total {len(self.failed_pages)}")
+        lines.append(f"# TYPE {prefix}_rejects_total counter")
+        for reason, count in sorted(self.rejects.items()):
+            lines.append(f'{prefix}_rejects_total{{reason="{reason}"}} {count}')
+        for name in ("listings_per_second", "pages_per_second"):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {snapshot[name]}")
+        lines.append(f"# TYPE {prefix}_queue_depth gauge")
+        lines.append(f"{prefix}_queue_depth {self.queue_depth[-1][1] if self.queue_depth else 0}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        snapshot = self.to_dict()
+        latency = snapshot["fetch_latency_seconds"]
+        parse = snapshot["parse_seconds"]
+        summary = (
+            f"fetched {snapshot['pages_fetched']} pages ({snapshot['bytes_downloaded'] / 1024:.0f} KiB), "
+            f"latency p50/p95/p99: {latency['p50']:.3f}/{latency['p95']:.3f}/{latency['p99']:.3f}s, "
+            f"parse p50/p95/p99: {parse['p50']:.3f}/{parse['p95']:.3f}/{parse['p99']:.3f}s, "
+            f"{snapshot['listings_per_second']:.1f} listings/s, {self.retries} retries, rejects: {dict(self.rejects)}"
+        )
+        if self.browser_latency.samples:
+            browser = snapshot["browser_latency_seconds"]
+            summary += f"\n{browser['count']} pages fetched with the browser, latency p50/p95: "
+            summary += f"{browser['p50']:.3f}/{browser['p95']:.3f}s"
+        if self.failed_pages:
+            summary += f"\n{len(self.failed_pages)} pages failed:"
+            summary += "".join(f"\n  {url}: {reason}" for url, reason in self.failed_pages.items())
+        return summary
+
+
+async def serve(metrics: Metrics, port: int, host: str = "127.0.0.1") -> web.AppRunner:
+    """
+    Serves the metrics in Prometheus text format on http://host:port/metrics until the runner is cleaned up
+    """
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.to_prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
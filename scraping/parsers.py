@@ -0,0 +1,165 @@
+"""
+HTML parser backends used to extract listings from result pages.
+
+Every backend exposes the same small interface (parse, compile, select, select_one, text, attr) so
+the scrapers can describe what they need with CSS selectors and run on the fastest parser installed.
+"""
+import os
+
+# preferred order when no backend is requested explicitly
+BACKENDS_BY_PREFERENCE = ("selectolax", "lxml", "bs4")
+# lets a run pick the backend without touching code, e.g. SCRAPING_PARSER_BACKEND=bs4
+BACKEND_ENV_VARIABLE = "SCRAPING_PARSER_BACKEND"
+
+
+class BackendNotAvailable(Exception):
+    pass
+
+
+class Bs4Backend:
+    name = "bs4"
+
+    def __init__(self):
+        try:
+            import soupsieve
+            from bs4 import BeautifulSoup
+        except ImportError as e:
+            raise BackendNotAvailable(f"{self.name}: {e}")
+        self._soup = BeautifulSoup
+        self._soupsieve = soupsieve
+
+    def parse(self, content: str):
+        return self._soup(content, "html.parser")
+
+    def compile(self, css: str):
+        return self._soupsieve.compile(css)
+
+    def select(self, node, selector) -> list:
+        return selector.select(node)
+
+    def select_one(self, node, selector):
+        return selector.select_one(node)
+
+    def text(self, node) -> str:
+        return node.get_text()
+
+    def attr(self, node, name: str):
+        return node.get(name)
+
+
+class LxmlBackend:
+    name = "lxml"
+
+    def __init__(self):
+        try:
+            import lxml.html
+            from lxml.cssselect import CSSSelector
+        except ImportError as e:
+            raise BackendNotAvailable(f"{self.name}: {e}")
+        self._fromstring = lxml.html.document_fromstring
+        self._css_selector = CSSSelector
+
+    def parse(self, content: str):
+        return self._fromstring(content)
+
+    def compile(self, css: str):
+        # CSSSelector translates the selector to a compiled XPath expression once
+        return self._css_selector(css)
+
+    def select(self, node, selector) -> list:
+        return selector(node)
+
+    def select_one(self, node, selector):
+        nodes = selector(node)
+        return nodes[0] if nodes else None
+
+    def text(self, node) -> str:
+        return node.text_content()
+
+    def attr(self, node, name: str):
+        return node.get(name)
+
+
+class SelectolaxBackend:
+    name = "selectolax"
+
+    def __init__(self):
+        try:
+            from selectolax.lexbor import LexborHTMLParser
+        except ImportError as e:
+            raise BackendNotAvailable(f"{self.name}: {e}")
+        self._html_parser = LexborHTMLParser
+
+    def parse(self, content: str):
+        return self._html_parser(content)
+
+    def compile(self, css: str):
+        # selectolax compiles selectors internally, the css string is all it needs
+        return css
+
+    def select(self, node, selector) -> list:
+        return node.css(selector)
+
+    def select_one(self, node, selector):
+        return node.css_first(selector)
+
+    def text(self, node) -> str:
+        return node.text(deep=True)
+
+    def attr(self, node, name: str):
+        return node.attributes.get(name)
+
+
+_BACKEND_CLASSES = {
+    Bs4Backend.name: Bs4Backend,
+    LxmlBackend.name: LxmlBackend,
+    SelectolaxBackend.name: SelectolaxBackend,
+}
+_backends = {}
+
+
+def get_backend(name: str = None):
+    """
+    Returns the backend called `name`, or the fastest one installed when no name is given
+    """
+    name = name or os.environ.get(BACKEND_ENV_VARIABLE)
+    if name:
+        if name not in _BACKEND_CLASSES:
+            raise ValueError(f"unknown parser backend: {name}, expected one of {', '.join(_BACKEND_CLASSES)}")
+        if name not in _backends:
+            _backends[name] = _BACKEND_CLASSES[name]()
+        return _backends[name]
+    for candidate in BACKENDS_BY_PREFERENCE:
+        try:
+            return get_backend(candidate)
+        except BackendNotAvailable:
+            continue
+    raise BackendNotAvailable(f"none of {', '.join(BACKENDS_BY_PREFERENCE)} is installed")
+
+
+def available_backends() -> list:
+    names = []
+    for name in BACKENDS_BY_PREFERENCE:
+        try:
+            get_backend(name)
+            names.append(name)
+        except BackendNotAvailable:
+            continue
+    return names
+
+
+class Selectors:
+    """
+    Named CSS selectors, compiled once per backend on first use
+    """
+
+    def __init__(self, **css: str):
+        self._css = css
+        self._compiled = {}
+
+    def compiled(self, backend) -> dict:
+        compiled = self._compiled.get(backend.name)
+        if compiled is None:
+            compiled = {key: backend.compile(css) for key, css in self._css.items()}
+            self._compiled[backend.name] = compiled
+        return compiled
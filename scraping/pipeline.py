@@ -0,0 +1,342 @@
+"""
+Fetch -> parse pipeline shared by the scrapers.
+
+Pages are downloaded concurrently through a Fetcher and parsed in a pool of worker processes, a
+bounded queue between both stages keeps fetched pages from piling up when parsing falls behind.
+Only successful responses reach the parsers, pages that fail are recorded in the run metrics.
+
+A search is a list of pages, each one (url, args) or a Page that may hold its already downloaded content,
+such as the first page of a search read to plan its pagination. Pages past the end of the results stop
+their search, the pages after them are not fetched.
+"""
+
+import asyncio
+import codecs
+import hashlib
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from scraping.cache import ResponseCache, body_hash, conditional_headers
+from scraping.fetch import FetchError, Fetcher, error_reason
+from scraping.metrics import Metrics, take_rejects
+
+PARSER_WORKERS = os.cpu_count() or 1
+STREAM_CHUNK_SIZE = 64 * 1024
+
+SearchResult = namedtuple("SearchResult", ["listings", "pages_scanned", "complete"])
+Page = namedtuple("Page", ["url", "args", "content"], defaults=(None,))
+
+
+class PageListings(list):
+    """
+    Listings of a page, cards is the number of listing cards the page had before they were filtered, None
+    when it is not known
+    """
+
+    def __init__(self, listings: list = (), cards: int = None):
+        super().__init__(listings)
+        self.cards = cards
+
+
+def parse_page(handler: callable, content: str, *args) -> tuple:
+    """
+    Runs handler in a parser worker, returns (listings, rejects, parse_seconds)
+    """
+    start = time.perf_counter()
+    listings = handler(content, *args)
+    return listings, take_rejects(), time.perf_counter() - start
+
+
+async def consumer(name: str, queue: asyncio.Queue, handler: callable, executor: Executor, metrics: Metrics):
+    loop = asyncio.get_running_loop()
+    while True:
+        content, args, parsed = await queue.get()
+        try:
+            listings, rejects, parse_seconds = await loop.run_in_executor(executor, parse_page, handler, content, *args)
+            metrics.observe_parse(parse_seconds, len(listings), rejects)
+            # every card is either a listing or a reject
+            if not parsed.cancelled():
+                parsed.set_result(PageListings(listings, len(listings) + sum(rejects.values())))
+            print(f"{name}::page processed, {len(listings)} listings")
+        except Exception as e:
+            print(f"{name}:: {e}")
+            if not parsed.cancelled():
+                parsed.set_exception(e)
+        finally:
+            queue.task_done()
+
+
+async def html_fetcher(
+    name: str, fetcher: Fetcher, url: str, args: tuple, queue: asyncio.Queue, cache: ResponseCache, content: str = None
+) -> list:
+    """
+    Returns the listings of the page once a consumer parsed it, or the cached ones when it did not change.
+    A page whose content is given is only parsed
+    """
+    if content is not None:
+        parsed = asyncio.get_running_loop().create_future()
+        await queue.put((content, args, parsed))
+        return await parsed
+    cached = cache.lookup(url) if cache is not None else None
+    response = await fetcher.get(url, headers=conditional_headers(cached))
+    etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    if cached is not None and response.status == 304:
+        cache.refresh(url, etag, last_modified)
+        fetcher.metrics.observe_cached_page(len(cached.listings))
+        print(f"[{name}] not modified, {len(cached.listings)} cached listings")
+        return PageListings(cached.listings, cached.cards)
+    page_hash = body_hash(response.text) if cache is not None else None
+    if cached is not None and cached.body_hash == page_hash:
+        cache.refresh(url, etag, last_modified)
+        fetcher.metrics.observe_cached_page(len(cached.listings))
+        print(f"[{name}] content unchanged, {len(cached.listings)} cached listings")
+        return PageListings(cached.listings, cached.cards)
+    if not 200 <= response.status < 300:
+        raise FetchError(url, f"HTTP {response.status}")
+    parsed = asyncio.get_running_loop().create_future()
+    await queue.put((response.text, args, parsed))
+    print(f"[{name}] fetch done")
+    listings = await parsed
+    if cache is not None and response.status == 200:
+        cache.store(url, etag, last_modified, page_hash, listings, listings.cards)
+    return listings
+
+
+async def html_streamer(
+    name: str, fetcher: Fetcher, url: str, stream, cache: ResponseCache, content: str = None
+) -> list:
+    if content is not None:
+        start = time.perf_counter()
+        listings = stream.feed(content) + stream.close()
+        rejects = stream.rejects
+        fetcher.metrics.observe_parse(time.perf_counter() - start, len(listings), rejects)
+        return PageListings(listings, len(listings) + sum(rejects.values()))
+    cached = cache.lookup(url) if cache is not None else None
+    start = time.perf_counter()
+    async with fetcher.stream(url, headers=conditional_headers(cached)) as response:
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if cached is not None and response.status == 304:
+            fetcher.metrics.observe_fetch(time.perf_counter() - start, 0)
+            cache.refresh(url, etag, last_modified)
+            fetcher.metrics.observe_cached_page(len(cached.listings))
+            print(f"[{name}] not modified, {len(cached.listings)} cached listings")
+            return PageListings(cached.listings, cached.cards)
+        if not 200 <= response.status < 300:
+            raise FetchError(url, f"HTTP {response.status}")
+        listings = []
+        size = 0
+        parse_seconds = 0.0
+        # same digest as cache.body_hash, computed as the page arrives
+        page_hash = hashlib.sha1()
+        decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            size += len(chunk)
+            parse_start = time.perf_counter()
+            text = decoder.decode(chunk)
+            page_hash.update(text.encode("utf-8"))
+            listings.extend(stream.feed(text))
+            parse_seconds += time.perf_counter() - parse_start
+        parse_start = time.perf_counter()
+        text = decoder.decode(b"", final=True)
+        page_hash.update(text.encode("utf-8"))
+        listings.extend(stream.feed(text))
+        listings.extend(stream.close())
+        parse_seconds += time.perf_counter() - parse_start
+        fetcher.metrics.observe_fetch(time.perf_counter() - start - parse_seconds, size)
+        rejects = stream.rejects
+        fetcher.metrics.observe_parse(parse_seconds, len(listings), rejects)
+        page_listings = PageListings(listings, len(listings) + sum(rejects.values()))
+        if cache is not None and response.status == 200:
+            cache.store(url, etag, last_modified, page_hash.hexdigest(), page_listings, page_listings.cards)
+        print(f"[{name}] fetch done")
+        return page_listings
+
+
+def end_of_results(page_listings: list, seen_pages: set) -> bool:
+    """
+    Whether a page is past the end of its search: it has no listing cards, or exactly the listings of a page
+    seen before, which is what sites serve for pages beyond the last one. seen_pages collects the pages seen
+    """
+    cards = getattr(page_listings, "cards", None)
+    if cards == 0:
+        return True
+    if not page_listings:
+        return False
+    page = (cards, frozenset(listing.id or listing.url for listing in page_listings))
+    if page in seen_pages:
+        return True
+    seen_pages.add(page)
+    return False
+
+
+async def search_pages(
+    name: str,
+    pages: list,
+    process_page: callable,
+    window: int,
+    stop_when: callable,
+    keep_listings: bool = True,
+    emit: callable = None,
+):
+    """
+    Processes the pages of one search, `window` pages at a time, and stops scheduling more pages as soon
+    as stop_when(page_listings) is true for one of them. The listings of every page are passed to emit in
+    page order, once every page before it was processed.
+
+    The first page found past the end of the results ends the search, pages after it still waiting to be
+    fetched are cancelled and the listings of those already processed are dropped. A search with pages that
+    failed before its end is not complete
+    """
+    listings = []
+    failed_pages = []
+    seen_pages = set()
+    end = len(pages)
+    # pages processed and not passed on yet, because a page before them is still being processed
+    finished = {}
+    next_page = 0
+    window = window or len(pages) or 1
+
+    def mark_end(number: int, tasks: dict):
+        nonlocal end
+        end = number
+        print(f"[{name}] results end before page {number}")
+        for later, later_number in tasks.items():
+            if later_number > number:
+                later.cancel()
+
+    for start in range(0, len(pages), window):
+        batch = pages[start : start + window]
+        tasks = {
+            asyncio.ensure_future(process_page(f"{name}.{number}", *page)): number
+            for number, page in enumerate(batch, start)
+        }
+        pages_listings = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                number = tasks[task]
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    failed_pages.append(number)
+                    finished[number] = None
+                    continue
+                finished[number] = task.result()
+                # a page without cards ends the search whatever the pages before it hold, pages after it are
+                # cancelled without waiting for those
+                if getattr(finished[number], "cards", None) == 0 and number < end:
+                    mark_end(number, tasks)
+            # repeated pages are told by comparing each page with the ones before it, in page order
+            while next_page < end and next_page in finished:
+                page_listings = finished.pop(next_page)
+                if page_listings is not None:
+                    if end_of_results(page_listings, seen_pages):
+                        mark_end(next_page, tasks)
+                        break
+                    if emit is not None:
+                        emit(page_listings)
+                    pages_listings.append(page_listings)
+                    if keep_listings:
+                        listings.extend(page_listings)
+                next_page += 1
+        complete = not any(number < end for number in failed_pages)
+        if end < len(pages):
+            return SearchResult(listings, end, complete)
+        scanned = start + len(batch)
+        if stop_when is not None and scanned < len(pages) and any(stop_when(page) for page in pages_listings):
+            print(f"[{name}] stopping after {scanned} of {len(pages)} pages")
+            return SearchResult(listings, scanned, False)
+    return SearchResult(listings, len(pages), not failed_pages)
+
+
+async def run(
+    fetcher: Fetcher,
+    searches: list,
+    handler: callable,
+    stream_factory: callable = None,
+    parser_workers: int = PARSER_WORKERS,
+    max_pending_pages: int = None,
+    cache: ResponseCache = None,
+    window: int = None,
+    stop_when: callable = None,
+    sinks: list = (),
+    keep_listings: bool = True,
+) -> list:
+    """
+    Fetches the pages of every search, each one a list of (url, args) or Page, and returns a SearchResult
+    per search with the listings found by handler(content, *args).
+
+    Handlers run in worker processes so they must be module level functions. When a stream_factory is
+    given pages are parsed while they download instead: stream_factory(*args) must return an object
+    with feed(text) and close() methods returning the listings found so far, and a rejects Counter of the
+    cards of its page the filter rejected, several pages stream at once in the event loop.
+    With a cache, pages that did not change since they were cached are not parsed again.
+    Searches are paginated `window` pages at a time (all at once by default), stop_when(search_number,
+    page_listings) returning true stops scheduling further pages of that search.
+    The listings of every page are passed to sink.add(listings) of each sink as soon as the page is parsed,
+    without keep_listings they are only handed to the sinks and SearchResult.listings stays empty.
+    """
+
+    def emit(listings: list):
+        for sink in sinks:
+            sink.add(listings)
+
+    def record_failure(name: str, url: str, error: Exception):
+        reason = error.reason if isinstance(error, FetchError) else error_reason(error)
+        print(f"[{name}] failed: {reason}")
+        fetcher.metrics.observe_failure(url, reason)
+
+    def search_stop_when(search_number: int):
+        if stop_when is None:
+            return None
+        return lambda page_listings: stop_when(search_number, page_listings)
+
+    if stream_factory is not None:
+
+        async def process_page(name: str, url: str, args: tuple, content: str = None) -> list:
+            try:
+                return await html_streamer(name, fetcher, url, stream_factory(*args), cache, content)
+            except Exception as e:
+                record_failure(name, url, e)
+                raise
+
+        print(f"streaming {sum(len(pages) for pages in searches)} pages")
+        return await asyncio.gather(
+            *[
+                search_pages(str(i), pages, process_page, window, search_stop_when(i), keep_listings, emit)
+                for i, pages in enumerate(searches)
+            ]
+        )
+
+    with ProcessPoolExecutor(max_workers=parser_workers) as executor:
+        content_queue = asyncio.Queue(maxsize=max_pending_pages or parser_workers * 2)
+        consumers = [
+            asyncio.create_task(
+                consumer(name=str(i), queue=content_queue, handler=handler, executor=executor, metrics=fetcher.metrics)
+            )
+            for i in range(parser_workers)
+        ]
+        print(f"{len(consumers)} page content consumer/s started")
+        queue_sampler = asyncio.create_task(fetcher.metrics.sample_queue_depth(content_queue))
+
+        async def process_page(name: str, url: str, args: tuple, content: str = None) -> list:
+            try:
+                return await html_fetcher(name, fetcher, url, args, content_queue, cache, content)
+            except Exception as e:
+                record_failure(name, url, e)
+                raise
+
+        print(f"fetching {sum(len(pages) for pages in searches)} pages")
+        results = await asyncio.gather(
+            *[
+                search_pages(str(i), pages, process_page, window, search_stop_when(i), keep_listings, emit)
+                for i, pages in enumerate(searches)
+            ]
+        )
+        queue_sampler.cancel()
+        for c in consumers:
+            c.cancel()
+    return results
@@ -0,0 +1,47 @@
+"""
+Registry of the site scrapers. They are standalone scripts with hyphenated names, load_site imports one as a
+module so jobs and benchmarks can drive it.
+
+Every scraper exposes the same surface: SOURCE, LISTING_FILTER, RESPONSE_CACHE_NAMESPACE, plan_search(fetcher,
+url, parser_backend=None) returning the pages of a search, parse_page_content(content, *args, listing_filter=None,
+parser_backend=None) and PageContentStream(*args, backend=None, listing_filter=None). The filter and backend
+arguments default to the script settings, modules shared by several jobs are driven through them and never
+modified. Its settings are module constants, the command line overrides them on the loaded module before running it.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = {
+    "lavoz": "scrape-listings-lavoz.py",
+    "mercadolibre": "scrape-listings-mercadolibre.py",
+}
+# coroutine of each script running a whole scrape, and the settings holding the URLs of its searches
+ENTRY_POINTS = {"lavoz": "main", "mercadolibre": "scrape"}
+SEARCH_URL_SETTINGS = {
+    "lavoz": ("URL_TO_SCRAPE_AGENCIES", "URL_TO_SCRAPE_OWNERS"),
+    "mercadolibre": ("AGENCIES_URL_TO_SCRAPE", "OWNERS_URL_TO_SCRAPE"),
+}
+
+
+def module_name(site: str) -> str:
+    return f"scrape_listings_{site}"
+
+
+def load_site(site: str):
+    """
+    Imports the scraper script of `site`, it is registered in sys.modules so parser worker processes can
+    unpickle its handlers
+    """
+    if site not in SCRIPTS:
+        raise ValueError(f"unknown site: {site}, expected one of {', '.join(SCRIPTS)}")
+    name = module_name(site)
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, SCRIPTS[site]))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,110 @@
+"""
+Price statistics over listings held in a columnar NumPy structured array.
+
+Listings are sorted once by group and price, after that count, min, max, mean, median and percentiles of
+every group are read with vectorized operations at the group boundaries instead of one Python pass per group.
+Results are Python numbers computed the same way as the builtins they replace (statistics.median, round),
+so reports do not change.
+"""
+import json
+import math
+from collections import namedtuple
+
+import numpy
+
+GroupStats = namedtuple("GroupStats", ["count", "min", "max", "mean", "median", "percentiles"])
+
+
+def listings_array(columns: dict) -> numpy.ndarray:
+    """
+    Structured array with the price, is_owner, id and source columns of ListingSink.flush, prices stay
+    integers when they all are
+    """
+    prices = columns["price"]
+    price_type = "i8" if all(isinstance(price, int) for price in prices) else "f8"
+    id_size = max((len(listing_id or "") for listing_id in columns["id"]), default=0) or 1
+    source_size = max((len(source) for source in columns["source"]), default=0) or 1
+    array = numpy.empty(
+        len(prices),
+        dtype=[("price", price_type), ("is_owner", "?"), ("id", f"U{id_size}"), ("source", f"U{source_size}")],
+    )
+    array["price"] = prices
+    array["is_owner"] = columns["is_owner"]
+    array["id"] = [listing_id or "" for listing_id in columns["id"]]
+    array["source"] = columns["source"]
+    return array
+
+
+def group_stats(array: numpy.ndarray, by: str = None, percentiles: tuple = ()) -> dict:
+    """
+    Returns {group: GroupStats} for every value of the `by` field, or {None: GroupStats} for the whole
+    array when `by` is None.
+
+    The percentile p of a group is its sorted price at index round(count * p / 100), capped to the last one.
+    Means are totals of the prices in the order they were listed, as sum() computed them, divided by count.
+    """
+    if by is None:
+        keys = numpy.zeros(len(array), dtype="?")
+    else:
+        keys = array[by]
+    order = numpy.lexsort((array["price"], keys))
+    sorted_prices = array["price"][order]
+    groups, starts, counts = numpy.unique(keys[order], return_index=True, return_counts=True)
+    if not len(groups):
+        return {}
+    ends = starts + counts - 1
+    # sum() added the prices one at a time in the order they were listed, float totals only come out the same
+    # added in that order, which accumulate does and reduceat, summing pairwise, does not
+    listed_prices = array["price"][numpy.argsort(keys, kind="stable")]
+    totals = [numpy.add.accumulate(listed_prices[start : start + count])[-1] for start, count in zip(starts, counts)]
+    lower_middles = sorted_prices[starts + (counts - 1) // 2]
+    upper_middles = sorted_prices[starts + counts // 2]
+    group_percentiles = {}
+    for percentile in percentiles:
+        indexes = numpy.minimum(numpy.rint(counts * (percentile / 100)).astype("i8"), counts - 1)
+        group_percentiles[percentile] = sorted_prices[starts + indexes]
+
+    stats = {}
+    for i, group in enumerate(groups.tolist()):
+        count = int(counts[i])
+        if count % 2:
+            median = lower_middles[i].item()
+        else:
+            median = (lower_middles[i].item() + upper_middles[i].item()) / 2
+        stats[None if by is None else group] = GroupStats(
+            count=count,
+            min=sorted_prices[starts[i]].item(),
+            max=sorted_prices[ends[i]].item(),
+            mean=totals[i].item() / count,
+            median=median,
+            percentiles={percentile: values[i].item() for percentile, values in group_percentiles.items()},
+        )
+    return stats
+
+
+def price_histogram(prices: numpy.ndarray, bucket_size: int) -> tuple:
+    """
+    Returns (apartments per bucket, bucket edges) for buckets of bucket_size covering every price, no buckets
+    when there are no prices
+    """
+    if not len(prices):
+        return numpy.zeros(0, dtype="i8"), numpy.zeros(0, dtype=prices.dtype)
+    first_bucket = math.floor(prices.min() / bucket_size) * bucket_size
+    last_bucket = math.ceil(prices.max() / bucket_size) * bucket_size
+    bins = [value for value in range(int(first_bucket), int(last_bucket) + bucket_size, bucket_size)]
+    return numpy.histogram(prices, bins=bins)
+
+
+def write_report(path: str, groups: dict, histogram: tuple = None):
+    """
+    Writes {label: GroupStats} and, when given, a price_histogram as JSON, the statistics artifact of a run
+    """
+    report = {"groups": {label: stats._asdict() for label, stats in groups.items()}}
+    if histogram is not None:
+        values, buckets = histogram
+        report["histogram"] = [
+            {"from": buckets[i].item(), "to": buckets[i + 1].item(), "listings": value.item()}
+            for i, value in enumerate(values)
+        ]
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
@@ -0,0 +1,132 @@
+"""
+Incremental extraction of elements from HTML as it arrives.
+
+ElementStream tokenizes chunks of markup and keeps only the elements it was asked for, each one is
+handed back as a small HTML fragment as soon as its closing tag is seen, so the whole page is never
+held as a tree. Targets can also report when the element holding their matches closes, which tells a
+caller it has seen all of them.
+"""
+from html.parser import HTMLParser
+
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "param",
+    "source",
+    "track",
+    "wbr",
+}
+
+
+class StreamTarget:
+    """
+    Matches a tag by its class attribute, either the whole attribute (exact) or one of its classes. With
+    section_end, the stream hands back (name, None) when the parent of the matched elements closes
+    """
+
+    def __init__(self, tag: str, class_name: str, exact: bool = False, section_end: bool = False):
+        self.tag = tag
+        self.class_name = class_name
+        self.exact = exact
+        self.section_end = section_end
+
+    def matches(self, tag: str, attrs: list) -> bool:
+        if tag != self.tag:
+            return False
+        classes = dict(attrs).get("class") or ""
+        if self.exact:
+            return classes == self.class_name
+        return self.class_name in classes.split()
+
+
+class ElementStream(HTMLParser):
+    def __init__(self, **targets: StreamTarget):
+        super().__init__(convert_charrefs=False)
+        self.targets = targets
+        self._completed = []
+        self._current = None
+        self._fragment = []
+        self._open_tags = []
+        # tags open outside the targets, and by target the number of them open when its section started
+        self._outer_tags = []
+        self._sections = {}
+
+    def feed(self, data: str) -> list:
+        """
+        Returns the (target_name, html_fragment) of every element closed by this chunk
+        """
+        super().feed(data)
+        return self._pop_completed()
+
+    def close(self) -> list:
+        super().close()
+        return self._pop_completed()
+
+    def _pop_completed(self) -> list:
+        completed, self._completed = self._completed, []
+        return completed
+
+    def handle_starttag(self, tag, attrs):
+        if self._current is None:
+            for name, target in self.targets.items():
+                if target.matches(tag, attrs):
+                    self._current = name
+                    if target.section_end:
+                        self._sections.setdefault(name, len(self._outer_tags))
+                    break
+            else:
+                if tag not in VOID_ELEMENTS:
+                    self._outer_tags.append(tag)
+                return
+        self._fragment.append(self.get_starttag_text())
+        if tag not in VOID_ELEMENTS:
+            self._open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self._current is not None:
+            self._fragment.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self._current is None:
+            self._close_outer_tag(tag)
+            return
+        if tag not in self._open_tags:
+            return
+        # implicitly closed elements (e.g. a <p> without </p>) are closed along with their parent
+        while self._open_tags.pop() != tag:
+            pass
+        self._fragment.append(f"</{tag}>")
+        if not self._open_tags:
+            self._completed.append((self._current, "".join(self._fragment)))
+            self._current = None
+            self._fragment = []
+
+    def _close_outer_tag(self, tag: str):
+        if tag not in self._outer_tags:
+            return
+        while self._outer_tags.pop() != tag:
+            pass
+        for name, depth in list(self._sections.items()):
+            if len(self._outer_tags) < depth:
+                del self._sections[name]
+                self._completed.append((name, None))
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._fragment.append(data)
+
+    def handle_entityref(self, name):
+        if self._current is not None:
+            self._fragment.append(f"&{name};")
+
+    def handle_charref(self, name):
+        if self._current is not None:
+            self._fragment.append(f"&#{name};")
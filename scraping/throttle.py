@@ -0,0 +1,116 @@
+"""
+Adaptive per host rate limiting and retry delays.
+
+Every host gets a token bucket whose rate follows AIMD: it grows additively while the host answers fast and
+successfully, and is cut multiplicatively when the host answers 429/503, times out or gets slower than the
+latency target. Like TCP slow start the rate doubles every second until the host pushes back for the first
+time, so fast hosts reach their limit quickly. A Retry-After header pauses the host until then. This keeps
+each host at the highest rate it sustains instead of a fixed, conservative one.
+"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# requests per second
+INITIAL_RATE = 10.0
+MIN_RATE = 0.5
+MAX_RATE = 100.0
+# the rate grows by RATE_INCREASE requests per second every second of successful responses
+RATE_INCREASE = 1.0
+RATE_DECREASE = 0.5
+# cuts closer than this are one congestion event, responses sent at the old rate should not cut it again
+DECREASE_COOLDOWN = 1.0
+LATENCY_TARGET = 5.0
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRY_AFTER_MAX = 120.0
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float = INITIAL_RATE,
+        min_rate: float = MIN_RATE,
+        max_rate: float = MAX_RATE,
+        increase: float = RATE_INCREASE,
+        decrease: float = RATE_DECREASE,
+        latency_target: float = LATENCY_TARGET,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.decreased_at = float("-inf")
+        self.slow_start = True
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Waits for a token, waiters are served in order
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                # at most a second worth of requests is saved up
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def succeeded(self, latency: float):
+        if latency > self.latency_target:
+            self._decrease()
+        elif self.slow_start:
+            # `rate` responses arrive per second, one more request per second for each doubles the rate
+            self.rate = min(self.max_rate, self.rate + 1)
+        else:
+            # and `increase / rate` for each grows it by `increase` every second
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def throttled(self, retry_after: float = None):
+        self._decrease()
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.decreased_at < DECREASE_COOLDOWN:
+            return
+        self.decreased_at = now
+        self.slow_start = False
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+def retry_after_seconds(value: str) -> float:
+    """
+    Seconds to wait according to a Retry-After header, given in seconds or as an HTTP date, capped to
+    RETRY_AFTER_MAX. None when there is no valid header
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """
+    Exponential backoff with full jitter: a random delay up to base * 2 ** attempt, capped
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
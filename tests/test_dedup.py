@@ -0,0 +1,72 @@
+"""
+duplicate_labels must count an apartment listed on several sites or by several publishers once, and never
+take two listings of one publisher for the same apartment
+"""
+from scraping.dedup import NOT_DUPLICATE, duplicate_labels, drop_duplicates
+
+TITLE = "Departamento un dormitorio Nueva Córdoba balcón cochera amenities"
+
+
+def columns(listings: list) -> dict:
+    """
+    Columns of (source, is_owner, id, price, title) listings
+    """
+    fields = ("source", "is_owner", "id", "price", "title")
+    return {field: [listing[i] for listing in listings] for i, field in enumerate(fields)}
+
+
+def clusters(labels) -> list:
+    """
+    Sets of listing indexes counted as one apartment
+    """
+    groups = {}
+    for i, label in enumerate(labels.tolist()):
+        groups.setdefault(i if label == NOT_DUPLICATE else label, set()).add(i)
+    return sorted(groups.values(), key=min)
+
+
+def test_same_apartment_on_both_sites_is_counted_once():
+    labels = duplicate_labels(
+        columns(
+            [
+                ("lavoz", False, "1", 250000, TITLE),
+                ("mercadolibre", False, "MLA1", 250000, TITLE.upper()),
+                ("mercadolibre", False, "MLA2", 250000, "Casa tres dormitorios con patio y parrilla en Güemes"),
+            ]
+        )
+    )
+    assert clusters(labels) == [{0, 1}, {2}]
+
+
+def test_listings_of_one_publisher_are_not_merged_through_another_listing():
+    # A ~ B ~ C, A and C are two apartments of the same agency with the same title and price
+    labels = duplicate_labels(
+        columns(
+            [
+                ("lavoz", False, "1", 250000, TITLE),
+                ("mercadolibre", True, "MLA1", 250000, TITLE),
+                ("lavoz", False, "2", 250000, TITLE),
+            ]
+        )
+    )
+    assert not any({0, 2} <= cluster for cluster in clusters(labels))
+    assert clusters(labels) == [{0, 1}, {2}]
+
+
+def test_every_publisher_appears_once_per_apartment():
+    publishers = [("lavoz", False), ("lavoz", False), ("mercadolibre", True), ("lavoz", True), ("mercadolibre", False)]
+    listings = [(source, is_owner, str(i), 250000, TITLE) for i, (source, is_owner) in enumerate(publishers)]
+    for cluster in clusters(duplicate_labels(columns(listings))):
+        cluster_publishers = [publishers[i] for i in cluster]
+        assert len(cluster_publishers) == len(set(cluster_publishers))
+
+
+def test_same_listing_id_is_merged_whatever_the_publisher_rule():
+    listings = [
+        ("lavoz", False, "1", 250000, TITLE),
+        ("mercadolibre", True, "MLA1", 250000, TITLE),
+        ("lavoz", False, "1", 250000, TITLE),
+    ]
+    assert clusters(duplicate_labels(columns(listings))) == [{0, 1, 2}]
+    unique, duplicates = drop_duplicates(columns(listings))
+    assert duplicates == 2 and unique["id"] == ["1"]
@@ -0,0 +1,123 @@
+"""
+ListingFilter must reject the same cards as checking every title and price one at a time
+"""
+import random
+import re
+from collections import Counter
+
+import pytest
+
+from scraping.filters import (
+    EXCLUDED_KEYWORD,
+    OTHER_CURRENCY,
+    PRICE_ON_REQUEST,
+    PRICE_OUT_OF_RANGE,
+    ListingFilter,
+    keywords_pattern,
+    parse_price,
+)
+
+KEYWORDS = ("venta", "vendo", "temporal", "temporario", "amoblado", "inversión", "dueño directo", "u$s")
+
+
+def contains_keyword(title: str, keywords: tuple = KEYWORDS) -> bool:
+    return any(keyword.lower() in title.lower() for keyword in keywords)
+
+
+def test_keywords_pattern_matches_exactly_the_keywords():
+    pattern = re.compile(keywords_pattern(KEYWORDS))
+    for keyword in KEYWORDS:
+        assert pattern.search(f"depto {keyword} centro"), keyword
+    for text in ("vent", "tempo", "amoblad", "dueño", "us", "u$"):
+        assert pattern.search(text) is None, text
+
+
+def test_keywords_pattern_factors_prefixes_and_drops_extensions():
+    assert keywords_pattern(("temporal", "temporario")) == "tempora(?:l|rio)"
+    # matching "vent" is enough for "venta" too
+    assert keywords_pattern(("venta", "vent")) == "vent"
+    assert keywords_pattern(("u$s",)) == re.escape("u$s")
+
+
+def test_excluded_matches_titles_one_at_a_time():
+    generator = random.Random(1)
+    words = ["depto", "luminoso", "Venta", "centro", "TEMPORARIO", "ven", "ta", "dueño", "directo", "amoblado", "u$s"]
+    titles = [" ".join(generator.choice(words) for _ in range(generator.randrange(0, 5))) for _ in range(500)]
+    assert ListingFilter(KEYWORDS).excluded(titles) == [contains_keyword(title) for title in titles]
+
+
+@pytest.mark.parametrize(
+    "titles",
+    [
+        ["depto ven", "ta centro"],
+        ["alquiler dueño", "directo nueva córdoba"],
+        ["depto temporar", "io"],
+        ["u$", "s 500"],
+    ],
+)
+def test_keywords_do_not_match_across_titles(titles):
+    assert ListingFilter(KEYWORDS).excluded(titles) == [False, False]
+
+
+def test_excluded_flags_every_title_with_a_keyword():
+    titles = ["Venta depto", "depto", "alquiler temporal", "", "DUEÑO DIRECTO", "depto venta"]
+    assert ListingFilter(KEYWORDS).excluded(titles) == [True, False, True, False, True, True]
+    assert ListingFilter().excluded(titles) == [False] * len(titles)
+
+
+@pytest.mark.parametrize(
+    "currency, price, reason",
+    [
+        (None, None, PRICE_ON_REQUEST),
+        ("U$S", 500, OTHER_CURRENCY),
+        ("$", 11999, PRICE_OUT_OF_RANGE),
+        ("$", 30001, PRICE_OUT_OF_RANGE),
+        ("$", 12000, None),
+        ("$", 30000, None),
+        ("$", 20000.5, None),
+    ],
+)
+def test_price_reason(currency, price, reason):
+    assert ListingFilter(currency="$", min_price=12000, max_price=30000).price_reason(currency, price) == reason
+
+
+def test_price_reason_without_range():
+    listing_filter = ListingFilter(currency="$")
+    assert listing_filter.price_reason("$", 1) is None
+    assert listing_filter.price_reason("$", 10**9) is None
+
+
+@pytest.mark.parametrize(
+    "text, price",
+    [
+        ("$ 25.000", ("$", 25000.0)),
+        ("$ 18.000,50", ("$", 18000.5)),
+        ("U$S 500", ("U$S", 500.0)),
+        ("Consultar precio", (None, None)),
+    ],
+)
+def test_parse_price(text, price):
+    assert parse_price(text) == price
+
+
+def test_apply_counts_every_reject_by_reason():
+    listing_filter = ListingFilter(("venta",), currency="$", min_price=12000, max_price=30000)
+    cards = [
+        ("depto venta", "$ 20.000"),
+        ("depto", "Consultar precio"),
+        ("depto", "U$S 300"),
+        ("depto", "$ 50.000"),
+        ("depto luminoso", "$ 20.000"),
+    ]
+    priced = []
+
+    def price_of(card):
+        priced.append(card)
+        return parse_price(card[1])
+
+    rejects = Counter()
+    accepted = listing_filter.apply(cards, [title for title, _ in cards], price_of, rejects)
+    assert accepted == [(cards[4], 20000.0)]
+    assert rejects == {EXCLUDED_KEYWORD: 1, PRICE_ON_REQUEST: 1, OTHER_CURRENCY: 1, PRICE_OUT_OF_RANGE: 1}
+    # prices are only read for the cards whose title passed
+    assert cards[0] not in priced
@@ -0,0 +1,68 @@
+"""
+Parser backends must extract the same listings from the same page. Runs on the pages in tests/fixtures and on
+the recorded corpus of the benchmarks when there is one (`python -m benchmarks record`)
+"""
+import os
+
+import pytest
+
+from benchmarks.fixtures import Corpus
+from benchmarks.sites import SITES
+from scraping.parsers import available_backends
+from scraping.sites import load_site
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# page file: (site, extra arguments of parse_page_content)
+PAGES = {
+    "lavoz-agency.html": ("lavoz", ()),
+    "lavoz-owner.html": ("lavoz", ()),
+    "mercadolibre.html": ("mercadolibre", (False,)),
+}
+BACKENDS = available_backends()
+
+
+def read_page(file_name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, file_name), encoding="utf-8") as page_file:
+        return page_file.read()
+
+
+def extracted(site: str, content: str, args: tuple, backend: str) -> list:
+    listings = load_site(site).parse_page_content(content, *args, parser_backend=backend)
+    return [(listing.price, listing.title, listing.url, listing.is_owner) for listing in listings]
+
+
+def corpus_pages() -> list:
+    return [
+        pytest.param(site, content, id=f"{site}-{number}")
+        for site in SITES
+        for number, content in enumerate(Corpus(site).pages())
+    ]
+
+
+@pytest.mark.skipif(len(BACKENDS) < 2, reason="a single parser backend is installed")
+@pytest.mark.parametrize("file_name", sorted(PAGES))
+def test_backends_extract_the_same_listings(file_name):
+    site, args = PAGES[file_name]
+    content = read_page(file_name)
+    expected = extracted(site, content, args, BACKENDS[0])
+    assert expected
+    for backend in BACKENDS[1:]:
+        assert extracted(site, content, args, backend) == expected, backend
+
+
+@pytest.mark.parametrize("file_name, is_owner", [("lavoz-agency.html", False), ("lavoz-owner.html", True)])
+def test_lavoz_publisher_comes_from_the_filter_chips(file_name, is_owner):
+    for backend in BACKENDS:
+        listings = extracted("lavoz", read_page(file_name), (), backend)
+        assert {listing[3] for listing in listings} == {is_owner}, backend
+
+
+@pytest.mark.skipif(len(BACKENDS) < 2, reason="a single parser backend is installed")
+@pytest.mark.parametrize(
+    "site, content", corpus_pages() or [pytest.param(None, None, marks=pytest.mark.skip(reason="no recorded corpus"))]
+)
+def test_backends_extract_the_same_listings_from_the_corpus(site, content):
+    args = SITES[site].page_args
+    expected = extracted(site, content, args, BACKENDS[0])
+    for backend in BACKENDS[1:]:
+        assert extracted(site, content, args, backend) == expected, backend
@@ -0,0 +1,95 @@
+"""
+search_pages must pass listings on in page order and stop a search at the end of its results, cancelling the
+pages after it, and cached pages must keep the number of cards they had
+"""
+import asyncio
+
+from scraping.cache import ResponseCache, body_hash
+from scraping.fetch import FetchResponse
+from scraping.listing import Listing
+from scraping.metrics import Metrics
+from scraping.pipeline import PageListings, end_of_results, html_fetcher, search_pages
+
+
+def page_listings(page: int, size: int = 3) -> PageListings:
+    listings = [Listing("lavoz", f"{page}-{i}", 20000, False, f"https://lavoz/{page}-{i}") for i in range(size)]
+    return PageListings(listings, size)
+
+
+def crawl(results: dict, delays: dict) -> tuple:
+    """
+    Runs search_pages over pages whose listings are results[page], each one processed after delays[page]
+    seconds. Returns (SearchResult, pages passed on, pages cancelled)
+    """
+    emitted = []
+    cancelled = set()
+
+    async def process_page(name: str, url: int, args: tuple) -> list:
+        try:
+            await asyncio.sleep(delays.get(url, 0))
+        except asyncio.CancelledError:
+            cancelled.add(url)
+            raise
+        return results[url]
+
+    def emit(listings: list):
+        emitted.append(next(page for page, page_result in results.items() if page_result is listings))
+
+    pages = [(page, ()) for page in sorted(results)]
+    result = asyncio.run(search_pages("search", pages, process_page, None, None, emit=emit))
+    return result, emitted, cancelled
+
+
+def test_listings_are_passed_on_in_page_order():
+    results = {page: page_listings(page) for page in range(5)}
+    # later pages finish first
+    result, emitted, cancelled = crawl(results, {page: (5 - page) * 0.01 for page in results})
+    assert emitted == [0, 1, 2, 3, 4]
+    assert result.pages_scanned == 5 and result.complete
+    assert [listing.id for listing in result.listings] == [f"{page}-{i}" for page in range(5) for i in range(3)]
+
+
+def test_a_page_without_cards_cancels_the_pages_after_it():
+    results = {page: page_listings(page) for page in range(5)}
+    results[2] = PageListings([], 0)
+    # page 2 ends the search while page 0 and the pages after it are still being fetched
+    result, emitted, cancelled = crawl(results, {0: 0.05, 3: 1, 4: 1})
+    assert cancelled == {3, 4}
+    assert emitted == [0, 1]
+    assert result.pages_scanned == 2 and result.complete
+
+
+def test_pages_after_a_repeated_page_are_dropped():
+    results = {page: page_listings(page) for page in range(5)}
+    # sites serve the last page again for pages past the end, page 4 is done before the repeat is known
+    results[3] = PageListings(list(results[2]), 3)
+    result, emitted, cancelled = crawl(results, {3: 0.05})
+    assert emitted == [0, 1, 2]
+    assert result.pages_scanned == 3
+    assert all(not listing.id.startswith("4-") for listing in result.listings)
+
+
+class NotModifiedFetcher:
+    def __init__(self):
+        self.metrics = Metrics()
+
+    async def get(self, url: str, headers: dict = None) -> FetchResponse:
+        return FetchResponse(304, "", {"ETag": headers.get("If-None-Match")})
+
+
+def test_cached_page_without_listings_keeps_its_cards(tmp_path):
+    cache = ResponseCache("test", path=str(tmp_path / "cache.sqlite"))
+    url = "https://lavoz/page-2"
+    # every card of the page was rejected by the filters
+    cache.store(url, '"etag"', None, body_hash("<html></html>"), [], cards=12)
+    try:
+        cached = asyncio.run(html_fetcher("search.2", NotModifiedFetcher(), url, (), asyncio.Queue(), cache))
+    finally:
+        cache.close()
+    assert cached == [] and cached.cards == 12
+    assert not end_of_results(cached, set())
+
+    results = {0: page_listings(0), 1: cached, 2: page_listings(2)}
+    result, emitted, cancelled = crawl(results, {})
+    assert emitted == [0, 1, 2]
+    assert result.pages_scanned == 3
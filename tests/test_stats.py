@@ -0,0 +1,115 @@
+"""
+group_stats must report the numbers the scrapers computed with the statistics module and Python lists, and
+the reports must be written when the filters leave a group, or every group, empty
+"""
+import json
+import math
+import random
+import statistics
+
+import numpy
+import pytest
+
+from scraping.sites import load_site
+from scraping.stats import group_stats, listings_array, price_histogram
+
+PERCENTILE = 80
+
+
+def baseline_stats(prices: list) -> tuple:
+    """
+    (count, min, max, mean, median, percentile) the way the scrapers used to compute them
+    """
+    ordered = sorted(prices)
+    index = round(len(ordered) * (PERCENTILE / 100))
+    index = index if index < len(ordered) else len(ordered) - 1
+    mean = sum(prices) / len(prices)
+    return len(prices), max(prices), min(prices), mean, statistics.median(prices), ordered[index]
+
+
+def baseline_histogram(prices: list, bucket_size: int) -> tuple:
+    first_bucket = math.floor(min(prices) / bucket_size) * bucket_size
+    last_bucket = math.ceil(max(prices) / bucket_size) * bucket_size
+    bins = [value for value in range(int(first_bucket), int(last_bucket) + bucket_size, bucket_size)]
+    return numpy.histogram(prices, bins=bins)
+
+
+def columns(prices: list, is_owner: list) -> dict:
+    return {
+        "price": prices,
+        "is_owner": is_owner,
+        "id": [str(i) for i in range(len(prices))],
+        "source": ["lavoz"] * len(prices),
+    }
+
+
+def random_prices(seed: int, size: int, integers: bool) -> list:
+    generator = random.Random(seed)
+    if integers:
+        return [generator.randrange(100, 1000) * 100 for _ in range(size)]
+    return [generator.randrange(1000000, 3000000) / 100 for _ in range(size)]
+
+
+def as_tuple(stats) -> tuple:
+    return stats.count, stats.max, stats.min, stats.mean, stats.median, stats.percentiles[PERCENTILE]
+
+
+@pytest.mark.parametrize("integers", [True, False])
+@pytest.mark.parametrize("size", [1, 2, 5, 10, 101, 1000])
+def test_group_stats_match_the_baseline(size, integers):
+    prices = random_prices(size, size, integers)
+    is_owner = [i % 3 == 0 for i in range(size)]
+    listings = listings_array(columns(prices, is_owner))
+
+    everyone = group_stats(listings, percentiles=(PERCENTILE,))
+    assert as_tuple(everyone[None]) == baseline_stats(prices)
+    by_owner = group_stats(listings, by="is_owner", percentiles=(PERCENTILE,))
+    for owner in (True, False):
+        group_prices = [price for price, flag in zip(prices, is_owner) if flag == owner]
+        if group_prices:
+            assert as_tuple(by_owner[owner]) == baseline_stats(group_prices)
+        else:
+            assert owner not in by_owner
+
+
+@pytest.mark.parametrize("integers", [True, False])
+def test_price_histogram_matches_the_baseline(integers):
+    prices = random_prices(7, 200, integers)
+    values, buckets = price_histogram(listings_array(columns(prices, [False] * len(prices)))["price"], 1000)
+    expected_values, expected_buckets = baseline_histogram(prices, 1000)
+    assert values.tolist() == expected_values.tolist()
+    assert buckets.tolist() == expected_buckets.tolist()
+
+
+def test_no_listings_have_no_groups_and_no_buckets():
+    listings = listings_array(columns([], []))
+    assert group_stats(listings) == {}
+    assert group_stats(listings, by="is_owner") == {}
+    values, buckets = price_histogram(listings["price"], 1000)
+    assert len(values) == 0
+
+
+# publishers of the listings: groups reported
+EMPTY_GROUPS = [
+    ([], []),
+    ([True, True], ["all apartments", "owners"]),
+    ([False], ["all apartments", "agencies"]),
+]
+
+
+@pytest.mark.parametrize("is_owner, expected", EMPTY_GROUPS)
+def test_lavoz_report_with_empty_groups(tmp_path, monkeypatch, is_owner, expected):
+    scraper = load_site("lavoz")
+    stats_file = tmp_path / "stats.json"
+    monkeypatch.setattr(scraper, "STATS_FILE_NAME", str(stats_file))
+    scraper.print_results_and_generate_stats(5, columns([20000] * len(is_owner), is_owner))
+    assert list(json.loads(stats_file.read_text())["groups"]) == expected
+
+
+@pytest.mark.parametrize("is_owner, expected", EMPTY_GROUPS)
+def test_mercadolibre_report_with_empty_groups(tmp_path, monkeypatch, is_owner, expected):
+    scraper = load_site("mercadolibre")
+    stats_file = tmp_path / "stats.json"
+    monkeypatch.setattr(scraper, "stats_file_name", str(stats_file))
+    scraper.print_results_and_generate_stats(columns([200000] * len(is_owner), is_owner), 5, 0.1)
+    assert list(json.loads(stats_file.read_text())["groups"]) == expected
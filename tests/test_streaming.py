@@ -0,0 +1,74 @@
+"""
+The streaming parsers must extract the same listings as parsing the whole page, whatever the chunks a page
+arrives in
+"""
+import os
+
+import pytest
+
+from scraping.sites import load_site
+from scraping.streaming import ElementStream, StreamTarget
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CHIP = '<a class="inline-flex btn btn-outline-main m0 p03" href="#">{} ×</a>'
+
+
+def read_page(file_name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, file_name), encoding="utf-8") as page_file:
+        return page_file.read()
+
+
+def streamed(stream, content: str, chunk_size: int) -> list:
+    listings = []
+    for start in range(0, len(content), chunk_size):
+        listings.extend(stream.feed(content[start : start + chunk_size]))
+    return listings + stream.close()
+
+
+def rows(listings: list) -> list:
+    return [listing.to_tuple() for listing in listings]
+
+
+def test_element_stream_reports_the_end_of_a_section():
+    stream = ElementStream(chip=StreamTarget("a", "chip", section_end=True), card=StreamTarget("p", "card"))
+    elements = stream.feed(
+        '<div><a class="chip">1</a><p class="card">a</p><a class="chip">2</a></div><p class="card">b</p>'
+    )
+    assert elements == [
+        ("chip", '<a class="chip">1</a>'),
+        ("card", '<p class="card">a</p>'),
+        ("chip", '<a class="chip">2</a>'),
+        ("chip", None),
+        ("card", '<p class="card">b</p>'),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 1 << 20])
+@pytest.mark.parametrize("file_name", ["lavoz-agency.html", "lavoz-owner.html"])
+def test_lavoz_stream_matches_the_whole_page(file_name, chunk_size):
+    scraper = load_site("lavoz")
+    content = read_page(file_name)
+    assert rows(streamed(scraper.PageContentStream(), content, chunk_size)) == rows(scraper.parse_page_content(content))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 1 << 20])
+def test_mercadolibre_stream_matches_the_whole_page(chunk_size):
+    scraper = load_site("mercadolibre")
+    content = read_page("mercadolibre.html")
+    assert rows(streamed(scraper.PageContentStream(True), content, chunk_size)) == rows(
+        scraper.parse_page_content(content, True)
+    )
+
+
+def test_lavoz_publisher_waits_for_every_applied_filter():
+    scraper = load_site("lavoz")
+    content = read_page("lavoz-owner.html")
+    start = content.index(CHIP.format("Particular"))
+    card_start = content.index('<div class="col-6')
+    card = content[card_start : content.index('<div class="col-6', card_start + 1)]
+    # the publisher chip comes after another chip and a card, all in the section of the applied filters
+    chips = f'<div>{CHIP.format("Departamentos")}{card}{CHIP.format("Particular")}</div>'
+    content = content[:start] + chips + content[start + len(CHIP.format("Particular")) :]
+    listings = streamed(scraper.PageContentStream(), content, 64)
+    assert listings and all(listing.is_owner for listing in listings)
+    assert rows(listings) == rows(scraper.parse_page_content(content))